@@ -0,0 +1,241 @@
+import sys
+import json
+import time
+import timeit
+import argparse
+import numpy as np
+
+from scipy.integrate import quad
+
+from grba_int import GrbaIntegrator, load_backend, read_stats, reset_stats, R0_MAX_CACHE, PHI_METHODS, PHI_METHOD
+
+# The (y, kap, thv) grid of the grba_int and grba_sweep drivers; thv in degrees.
+STANDARD_GRID = {'ys': [0.001, 0.1, 0.5, 0.9, 0.999],
+                 'kaps': [0.0, 1.0, 10.0],
+                 'thvs': [0.0, 1.0, 3.0]}
+
+BENCHMARKS = ('simps_phi', 'phi_int', 'r0_int', 'r0_int_ct', 'r0_max')
+
+# Benchmarks whose evals are the r0 integrand evaluations of read_stats.
+R0_BENCHES = ('r0_int', 'r0_int_ct')
+
+# Integrator entry points whose calls are counted as function evaluations.
+# fluxG_ct is left alone: quad calls the native one directly as a C function
+# pointer, which a Python wrapper would defeat. The r0 integrals are counted
+# by their integrand evaluations instead, see R0_BENCHES.
+COUNTED = ('_root_fun', 'thetaPrime', 'engProf', 'phiInt', 'fluxG', 'r0IntDE', 'r0Max',
+           'thetaPrimeBatch', 'engProfBatch', 'phiIntBatch', 'fluxGBatch', 'fluxGPairBatch',
+           'r0MaxBatch', 'r0MaxWalk')
+
+class _Counter(object):
+    def __init__(self, fun, counts):
+        self.fun = fun
+        self.counts = counts
+
+    def __call__(self, *args):
+        self.counts['evals'] += 1
+        return self.fun(*args)
+
+def counted_integrator(kap, thv, sig, gA, k, p, backend):
+    # GrbaIntegrator whose bound backend functions and phi root function
+    # count their calls in grb.counts['evals'].
+    grb = GrbaIntegrator(kap, thv, sig, gA, k, p, backend=backend)
+    grb.counts = {'evals': 0}
+    for name in COUNTED:
+        setattr(grb, name, _Counter(getattr(grb, name), grb.counts))
+    return grb
+
+def _case(bench, grb, y, rmin):
+    # The call to time for one grid point, or None where the quantity is not
+    # defined (no emitting r0 range).
+    if bench == 'r0_max':
+        def run():
+            R0_MAX_CACHE.clear()
+            return grb.r0_max(y)
+        return run
+    if bench == 'r0_int':
+        return lambda: grb.r0_int(y, rmin)
+    R0MAX = grb.r0_max(y)
+    if bench == 'r0_int_ct':
+        if R0MAX <= rmin:
+            return None
+        return lambda: grb.r0_int_ct(y, rmin, R0MAX)
+    if R0MAX <= 0.0:
+        return None
+    if bench == 'phi_int':
+        return lambda: grb.phi_int(0.5*R0MAX)
+    return lambda: grb.simps_phi(0.5*R0MAX)
+
+def measure(run, lib, counts, repeat=3, r0_evals=False):
+    # Best wall time of repeat calls, plus the root solves, root iterations
+    # and evaluations of a single call: the counted ones, or with r0_evals
+    # the r0 integrand evaluations read_stats has for it.
+    reset_stats(lib)
+    counts['evals'] = 0
+    value = run()
+    stats = read_stats(lib)
+    solves, iters = stats['root_solves'], stats['root_iters']
+    evals = stats['r0_evals'] if r0_evals else counts['evals']
+    best = np.inf
+    for _ in xrange(repeat):
+        start = timeit.default_timer()
+        run()
+        best = min(best, timeit.default_timer() - start)
+    return value, best, solves, iters, evals
+
+def _run_grid(benches, grid, lib, repeat, sig, gA, k, p, rmin, verbose):
+    results = []
+    for bench in benches:
+        for y in grid['ys']:
+            for kap in grid['kaps']:
+                for thv in grid['thvs']:
+                    grb = counted_integrator(kap, np.radians(thv), sig, gA, k, p, lib)
+                    run = _case(bench, grb, y, rmin)
+                    if run is None:
+                        continue
+                    value, elapsed, solves, iters, evals = measure(run, lib, grb.counts, repeat,
+                                                                   bench in R0_BENCHES)
+                    results.append({'bench': bench, 'y': y, 'kap': kap, 'thv': thv,
+                                    'value': float(value), 'time': elapsed,
+                                    'root_solves': int(solves), 'root_iters': int(iters),
+                                    'evals': int(evals)})
+                    if verbose:
+                        print "{:10s} {:6.3f} {:5.1f} {:4.1f}  {:.3e}s  {}".format(bench, y, kap, thv, elapsed, solves)
+    return results
+
+def run_benchmarks(benches=BENCHMARKS, grid=STANDARD_GRID, backend=None, repeat=3,
+                   sig=2.0, gA=1.0, k=0.0, p=2.2, rmin=1.0e-5, verbose=False, phi_method='simpson'):
+    lib = load_backend(backend)
+    for bench in benches:
+        if bench not in BENCHMARKS:
+            raise ValueError("unknown benchmark {!r}, expected one of {}".format(bench, BENCHMARKS))
+    # The phi method is process wide; the caller's is put back afterwards.
+    previous = PHI_METHOD['method']
+    GrbaIntegrator(0.0, 0.0, sig, gA, k, p, backend=lib).set_phi_method(phi_method)
+    try:
+        results = _run_grid(benches, grid, lib, repeat, sig, gA, k, p, rmin, verbose)
+    finally:
+        GrbaIntegrator(0.0, 0.0, sig, gA, k, p, backend=lib).set_phi_method(previous)
+    meta = {'backend': lib.name, 'phi_method': phi_method, 'repeat': repeat,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0], 'numpy': np.__version__, 'grid': grid,
+            'params': {'sig': sig, 'gA': gA, 'k': k, 'p': p, 'rmin': rmin}}
+    return {'meta': meta, 'results': results}
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _key(rec):
+    return (rec['bench'], rec['y'], rec['kap'], rec['thv'])
+
+def compare(report, baseline, time_tol=0.25, min_time=1.0e-4, value_rtol=1.0e-6):
+    # Regressions of report against baseline, one (key, kind, old, new) per
+    # finding. A point is slower when it takes more than (1 + time_tol)
+    # times the baseline and more than min_time, which keeps timer noise on
+    # the fast paths out. Values that move by more than value_rtol and
+    # counts that grow are flagged too.
+    base = dict((_key(rec), rec) for rec in baseline['results'])
+    found = []
+    for rec in report['results']:
+        old = base.get(_key(rec))
+        if old is None:
+            continue
+        if rec['time'] > max(min_time, (1.0 + time_tol)*old['time']):
+            found.append((_key(rec), 'time', old['time'], rec['time']))
+        scale = max(abs(old['value']), 1.0e-300)
+        same = np.isnan(rec['value']) and np.isnan(old['value'])
+        if not same and not abs(rec['value'] - old['value']) <= value_rtol*scale:
+            found.append((_key(rec), 'value', old['value'], rec['value']))
+        for count in ('root_solves', 'root_iters', 'evals'):
+            if count in old and rec[count] > old[count]:
+                found.append((_key(rec), count, old[count], rec[count]))
+    return found
+
+# How r0_int_ct can hand the native fluxG to quad.
+QUAD_PATHS = ('lowlevel', 'ctypes', 'python')
+
+def quad_overhead(y=0.5, kap=1.0, thv=1.0, sig=2.0, gA=1.0, k=0.0, p=2.2, rmin=1.0e-5, repeat=5):
+    # Best time per fluxG evaluation of one r0_int_ct quad on the native
+    # library with each path: the LowLevelCallable with its user_data block,
+    # the ctypes fluxWrap_ct with an args tuple, and fluxWrap called from
+    # Python, which is what quad falls back to when it cannot match a
+    # signature. thv in degrees.
+    grb = GrbaIntegrator(kap, np.radians(thv), sig, gA, k, p, backend='native')
+    R0MAX = grb.r0_max(y)
+    if R0MAX <= rmin:
+        raise ValueError("no emitting r0 range: r0_max({}) = {} <= rmin = {}".format(y, R0MAX, rmin))
+    args = (y, grb.kap, grb.sig, grb.thv, grb.k, grb.p, grb.gA)
+    fun, _ = grb._flux_quad(args)
+    fluxG = grb.fluxG
+    paths = {'lowlevel': (fun, ()), 'ctypes': (grb.fluxG_ct, args),
+             'python': (lambda r0: fluxG(y, r0, grb.kap, grb.sig, grb.thv, grb.gA, grb.k, grb.p), ())}
+    neval = quad(grb.fluxG_ct, rmin, R0MAX, args, full_output=1)[2]['neval']
+    # The paths take turns so drift in the machine's speed hits them alike.
+    best = dict((name, np.inf) for name in QUAD_PATHS)
+    for _ in xrange(repeat):
+        for name in QUAD_PATHS:
+            f, a = paths[name]
+            start = timeit.default_timer()
+            quad(f, rmin, R0MAX, a)
+            best[name] = min(best[name], timeit.default_timer() - start)
+    return dict((name, best[name] / neval) for name in QUAD_PATHS)
+
+def summary(report):
+    # Total time, root solves, root iterations and evaluations per benchmark.
+    totals = {}
+    for rec in report['results']:
+        t = totals.setdefault(rec['bench'], [0.0, 0, 0, 0])
+        t[0] += rec['time']
+        t[1] += rec['root_solves']
+        t[2] += rec.get('root_iters', 0)
+        t[3] += rec['evals']
+    return totals
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the grba integration engines on the standard grid.")
+    parser.add_argument('benches', nargs='*', default=list(BENCHMARKS), help="subset of {}".format(', '.join(BENCHMARKS)))
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default=None, help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="compare against this JSON file")
+    parser.add_argument('--time-tol', type=float, default=0.25)
+    parser.add_argument('--phi-method', default='simpson', choices=PHI_METHODS)
+    parser.add_argument('--quad-overhead', action='store_true',
+                        help="time one fluxG evaluation inside quad on each call path instead")
+    args = parser.parse_args(argv)
+
+    if args.quad_overhead:
+        per_eval = quad_overhead(repeat=args.repeat)
+        for name in QUAD_PATHS:
+            print "{:8s}  {:.3f} us/eval".format(name, 1.0e6*per_eval[name])
+        return 0
+
+    report = run_benchmarks(args.benches, backend=args.backend, repeat=args.repeat,
+                            phi_method=args.phi_method)
+    print "backend: {}, phi method: {}".format(report['meta']['backend'], args.phi_method)
+    title = "|  BENCH     |  TIME(s)   | ROOT SOLVES | ROOT ITERS |   EVALS   |"
+    print title
+    print "-"*len(title)
+    totals = summary(report)
+    for bench in args.benches:
+        if bench in totals:
+            t = totals[bench]
+            print "|  {:9s} |  {:.3e} | {:11d} | {:10d} | {:9d} |".format(bench, t[0], t[1], t[2], t[3])
+    if args.out:
+        save(report, args.out)
+    if args.baseline:
+        found = compare(report, load(args.baseline), time_tol=args.time_tol)
+        for key, kind, old, new in found:
+            print "REGRESSION {} {}: {} -> {}".format(key, kind, old, new)
+        if found:
+            return 1
+        print "no regressions against {}".format(args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
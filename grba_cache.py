@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+# Where ResultCache keeps its database unless given a path.
+DEFAULT_PATH = os.environ.get('GRBA_CACHE_PATH',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'grba', 'results.sqlite'))
+
+def canonical(value):
+    # JSON-able form of a key part in which equal parameters always look the
+    # same: floats (and numpy scalars) by their exact hex form, so 0.1 and
+    # np.float64(0.1) share a key and nothing is lost to rounding.
+    if isinstance(value, dict):
+        return dict((str(k), canonical(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if value is None or isinstance(value, (bool, str, unicode)):
+        return value
+    return float(value).hex()
+
+def make_key(kind, params):
+    # Content hash of the quantity name and its canonical parameters.
+    text = json.dumps([kind, canonical(params)], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class ResultCache(object):
+    # Persistent float results in SQLite, shared by every process that opens
+    # the same file: WAL mode lets readers run next to a writer and writers
+    # wait up to timeout seconds for each other. Entries carry the time they
+    # were last used and the least recently used ones are dropped once the
+    # table holds more than maxsize, checked every EVICT_EVERY puts. The
+    # cache is best effort: a locked or broken database is counted in
+    # stats['errors'] and the caller simply computes the value.
+    EVICT_EVERY = 64
+
+    def __init__(self, path=None, maxsize=1 << 20, timeout=30.0):
+        self.path = DEFAULT_PATH if path is None else path
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.stats = {'hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0, 'errors': 0}
+        self._conn = None
+        self._pid = None
+        self._puts = 0
+
+    def _connection(self):
+        # One connection per process; a forked worker opens its own.
+        if self._conn is None or self._pid != os.getpid():
+            if self.path != ':memory:':
+                folder = os.path.dirname(os.path.abspath(self.path))
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = {:d}".format(int(1000*self.timeout)))
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, kind TEXT, "
+                         "value REAL, used REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key):
+        # The value stored under key, or None.
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error:
+            self.stats['errors'] += 1
+            return None
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        # SQLite stores NaN as NULL.
+        return float('nan') if row[0] is None else row[0]
+
+    def put(self, key, value, kind=None):
+        try:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO results (key, kind, value, used) VALUES (?, ?, ?, ?)",
+                         (key, kind, float(value), time.time()))
+            self.stats['puts'] += 1
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self.evict()
+        except sqlite3.Error:
+            self.stats['errors'] += 1
+
+    def fetch(self, key, compute, kind=None):
+        # The value stored under key, computed and stored on a miss.
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, kind)
+        return value
+
+    def evict(self):
+        # Drop the least recently used entries beyond maxsize.
+        conn = self._connection()
+        extra = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.maxsize
+        if extra > 0:
+            conn.execute("DELETE FROM results WHERE key IN "
+                         "(SELECT key FROM results ORDER BY used LIMIT ?)", (extra,))
+            self.stats['evictions'] += extra
+        return max(extra, 0)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM results")
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def info(self):
+        # This process's hit/miss counts plus the entries in the file, by kind.
+        counts = dict(self._connection().execute("SELECT kind, COUNT(*) FROM results GROUP BY kind"))
+        out = dict(self.stats)
+        out['entries'] = sum(counts.values())
+        out['kinds'] = counts
+        out['hit_rate'] = self.stats['hits'] / float(max(self.stats['hits'] + self.stats['misses'], 1))
+        return out
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __getstate__(self):
+        # Pickles (e.g. to pool workers) as the path and settings only.
+        state = dict(self.__dict__)
+        state['_conn'] = state['_pid'] = None
+        return state
@@ -1,46 +1,1018 @@
+import os
+import timeit
+import warnings
 import numpy as np
+from collections import OrderedDict, deque
+from functools import wraps
 from scipy.optimize import root, fsolve
-from scipy.integrate import quad
-from ctypes import cdll, c_double, c_int
+from scipy.integrate import quad, IntegrationWarning
+from ctypes import cdll, byref, cast, POINTER, Structure, c_double, c_int, c_longlong, c_void_p
+try:
+    from scipy import LowLevelCallable
+except ImportError:
+    # scipy before 0.19; quad then calls the ctypes fluxWrap_ct.
+    LowLevelCallable = None
+
+from grba_cache import ResultCache, make_key
+
+c_double_p = np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS')
+c_int_p = np.ctypeslib.ndpointer(dtype=np.intc, flags='C_CONTIGUOUS')
+
+def _as_doubles(x):
+    # No copy is made when x is already a contiguous float64 array.
+    return np.ascontiguousarray(x, dtype=np.float64)
+
+def _points(*columns):
+    # Broadcast the columns against each other into a contiguous (n, ncols)
+    # array of rows, plus the broadcast shape.
+    columns = np.broadcast_arrays(*[_as_doubles(c) for c in columns])
+    return _as_doubles(np.column_stack([c.ravel() for c in columns])), columns[0].shape
+
+def theta_prime(r, thv, phi):
+    numer = r*np.sqrt(np.power(np.cos(thv), 2.0) - 0.25*np.power(np.sin(2.0*thv), 2.0)*np.power(np.cos(phi), 2.0))
+    denom = 1.0 + 0.5*r*np.sin(2.0*thv)*np.cos(phi)
+    return numer / denom
+
+def energy_profile(thp, sig, kap):
+    return np.exp2(-np.power(thp / sig, 2.0*kap))
+
+def phi_root_fun(r, r0, phi, kap, sig, thv):
+    thp = theta_prime(r, thv, phi)
+    eng = energy_profile(thp, sig, kap)
+    lhs = eng*(np.power(r, 2.0) + 2.0*r*np.tan(thv)*np.cos(phi) + np.power(np.tan(thv), 2.0))
+    thp0 = theta_prime(r, thv, 0.0)
+    eng0 = energy_profile(thp0, sig, kap)
+    rhs = np.power(r0 + np.tan(thv), 2.0)*eng0
+    return lhs - rhs
+
+def phi_root_jac(r, r0, phi, kap, sig, thv):
+    thp = theta_prime(r, thv, phi)
+    first = r + np.tan(thv)*np.cos(phi)
+    second = np.power(r, 2.0) + 2.0*r*np.tan(thv)*np.cos(phi) + np.power(np.tan(thv), 2.0)
+    frac = (kap*np.log(2.0)*np.power(thp / sig, 2.0*kap)) / (r*(1.0 + 0.5*r*np.sin(2.0*thv)*np.cos(phi)))
+    exponent = 2.0*energy_profile(thp, sig, kap)
+    thp0 = theta_prime(r, thv, 0.0)
+    frac0 = (kap*np.log(2.0)*np.power(thp0 / sig, 2.0*kap)) / (r*(1.0 + 0.5*r*np.sin(2.0*thv)))
+    exponent0 = 2.0*energy_profile(thp0, sig, kap)
+    return (first - second*frac)*exponent + np.power(r0 + np.tan(thv), 2.0)*frac0*exponent0
+
+def phi_root_guess(r0, phi, thv):
+    # Exact root of the kap = 0 problem, a good starting point for any kap.
+    tv = np.tan(thv)
+    return np.sqrt(np.power(r0 + tv, 2.0) - np.power(tv*np.sin(phi), 2.0)) - tv*np.cos(phi)
+
+def phi_root_slope(r, r0, phi, kap, sig, thv):
+    # dr'/dphi along the root, -f_phi / f_r by the implicit function
+    # theorem.
+    tv = np.tan(thv)
+    s2 = np.sin(2.0*thv)
+    cphi, sphi = np.cos(phi), np.sin(phi)
+    thp = theta_prime(r, thv, phi)
+    eng = energy_profile(thp, sig, kap)
+    q = kap*np.log(2.0)*np.power(thp / sig, 2.0*kap)
+    S = np.power(r, 2.0) + 2.0*r*tv*cphi + np.power(tv, 2.0)
+    D = 1.0 + 0.5*r*s2*cphi
+    A = np.power(np.cos(thv), 2.0) - 0.25*np.power(s2*cphi, 2.0)
+    dLogThp = 0.25*np.power(s2, 2.0)*sphi*cphi / A + 0.5*r*s2*sphi / D
+    fPhi = -2.0*eng*(r*tv*sphi + q*S*dLogThp)
+    return -fPhi / phi_root_jac(r, r0, phi, kap, sig, thv)
+
+def hermite_mid(rl, rr, sl, sr, h):
+    # Cubic Hermite value half way across an interval of width 2 h, from the
+    # roots and slopes at its ends; the mean of the ends where the cubic
+    # would not stay positive.
+    g = 0.5*(rl + rr) + 0.25*h*(sl - sr)
+    return np.where(g > 0.0, g, 0.5*(rl + rr))
+
+def newton_phi(r0, phi, g, kap, sig, thv, xacc=1.0e-10, maxit=50):
+    # Newton iterations on every (r0, phi) node at once. Like the native
+    # solver the step uses |f'|, so it always heads for the positive root;
+    # steps that would leave r' > 0 are replaced by halving and steps past
+    # ten times the current value are capped there. Returns the roots, a
+    # mask of the nodes that converged and the iterations each node took.
+    g, r0, phi = np.broadcast_arrays(g, r0, phi)
+    r = np.array(g, dtype=float)
+    active = np.ones(r.shape, dtype=bool)
+    iters = np.zeros(r.shape, dtype=int)
+    for it in xrange(maxit):
+        idx = np.nonzero(active)
+        iters[idx] += 1
+        ra = r[idx]
+        dx = phi_root_fun(ra, r0[idx], phi[idx], kap, sig, thv) / np.abs(phi_root_jac(ra, r0[idx], phi[idx], kap, sig, thv))
+        rn = ra - dx
+        low = ~(rn > 0.0)
+        rn[low] = 0.5*ra[low]
+        high = ~(rn < 10.0*ra)
+        rn[high] = 10.0*ra[high]
+        bad = low | high
+        r[idx] = rn
+        done = ~bad & (np.abs(dx) <= xacc*rn)
+        active[tuple(i[done] for i in idx)] = False
+        if not active.any():
+            break
+    return r, ~active, iters
+
+# Instrumentation of every integration stage, in the order of the native
+# GrbaStats struct: phi root solves and their iterations, phi integrals and
+# the Simpson levels they reached, r0_max solves, r0 integrals with their
+# integrand evaluations and summed error estimates, and the seconds spent in
+# the r0_max, phi and r0 stages (kept only while timing is on; r0 time
+# includes the phi integrals inside it).
+STAT_FIELDS = ('root_solves', 'root_iters', 'phi_integrals', 'simpson_levels',
+               'r0_max_solves', 'r0_integrals', 'r0_evals', 'r0_error',
+               'r0_max_time', 'phi_time', 'r0_time')
+
+class GrbaStats(Structure):
+    _fields_ = [(name, c_longlong) for name in STAT_FIELDS[:7]] + \
+               [(name, c_double) for name in STAT_FIELDS[7:]]
+
+def _zero_stats():
+    return dict((name, 0 if ctype is c_longlong else 0.0) for name, ctype in GrbaStats._fields_)
+
+# The counts of the Python engines (simps_phi, simps_phi_np, rtsafe_r0,
+# de_integrate callers); the native library keeps its own behind readStats().
+COUNTERS = _zero_stats()
+TIMING = {'on': False}
+_TIMED_DEPTH = dict((key, 0) for key in STAT_FIELDS[8:])
+
+def _timed(key):
+    # Decorator adding the wall time of the outermost call to COUNTERS[key]
+    # while TIMING is on; nested calls of the same stage are not counted
+    # twice, whichever functions they go through.
+    def decorator(fun):
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            if not TIMING['on'] or _TIMED_DEPTH[key]:
+                return fun(*args, **kwargs)
+            _TIMED_DEPTH[key] += 1
+            start = timeit.default_timer()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                _TIMED_DEPTH[key] -= 1
+                COUNTERS[key] += timeit.default_timer() - start
+        return wrapper
+    return decorator
+
+def _count_r0_integral(neval, err):
+    COUNTERS['r0_integrals'] += 1
+    COUNTERS['r0_evals'] += int(neval)
+    COUNTERS['r0_error'] += float(err)
+
+# How the Simpson engines guess the roots at new midpoints: 'neighbour' from
+# the roots either side, 'tangent' from a cubic Hermite predictor through
+# those roots and their slopes dr'/dphi. The index is the native mode.
+PHI_PREDICTORS = ('neighbour', 'tangent')
+PHI_PREDICTOR = {'mode': 'tangent'}
+
+# Quadrature of the phi engines over the refinement levels: 'simpson' sums, or
+# the 'trapezoid' sums themselves, which converge exponentially since the
+# integrand is smooth, periodic and even about 0 and pi. The index is the
+# native method.
+PHI_METHODS = ('simpson', 'trapezoid')
+PHI_METHOD = {'method': 'simpson'}
+
+def _solve_phi_nodes(r0, phi, g, kap, sig, thv, xacc=1.0e-10):
+    g, r0, phi = np.broadcast_arrays(g, r0, phi)
+    rp, conv, iters = newton_phi(r0, phi, g, kap, sig, thv, xacc)
+    for idx in zip(*np.nonzero(~conv)):
+        sol = root(phi_root_fun, phi_root_guess(r0[idx], phi[idx], thv),
+                   args = (r0[idx], phi[idx], kap, sig, thv),
+                   jac = phi_root_jac)
+        rp[idx] = sol.x[0]
+        iters[idx] += sol.nfev
+    COUNTERS['root_solves'] += rp.size
+    COUNTERS['root_iters'] += int(np.sum(iters))
+    return rp
+
+def phi_int_kap0(r0, thv):
+    # Closed form of the phi integral when kap = 0, where
+    # r' = sqrt((r0 + tan thv)**2 - (tan thv sin phi)**2) - tan thv cos phi;
+    # it reduces to 2 pi for thv = 0 whatever kap is.
+    return 2.0*np.pi*np.power(1.0 + np.tan(thv) / r0, 2.0)
+
+def phi_int_degenerate(kap, thv):
+    return kap == 0.0 or thv == 0.0
+
+def _phi_predictor(predictor):
+    if predictor is None:
+        predictor = PHI_PREDICTOR['mode']
+    if predictor not in PHI_PREDICTORS:
+        raise ValueError("unknown predictor {!r}, expected one of {}".format(predictor, PHI_PREDICTORS))
+    return predictor
+
+def _phi_method(method):
+    if method is None:
+        method = PHI_METHOD['method']
+    if method not in PHI_METHODS:
+        raise ValueError("unknown phi method {!r}, expected one of {}".format(method, PHI_METHODS))
+    return method
+
+@_timed('phi_time')
+def simps_phi_np(r0, kap, sig, thv, eps=1.0e-9, nmin=6, full_output=False, predictor=None, xacc=1.0e-10,
+                 method=None):
+    # Composite Simpson rule for one or many r0 at once. The integrand only
+    # depends on phi through cos(phi), so [0, pi] is integrated and doubled;
+    # level n uses the step of 2**(n - 1) intervals over [0, 2 pi]. Every r0
+    # stops on its own with the simps_phi criterion and r0 that never
+    # converge come back as NaN. Later levels only solve the new midpoints,
+    # starting from their neighbours as chosen by predictor (see
+    # PHI_PREDICTORS); roots are solved to a relative xacc. method picks the
+    # Simpson or trapezoid sums (see PHI_METHODS). full_output adds the
+    # number of root solves and Newton iterations and the level each r0
+    # stopped at (0 when the closed form was used).
+    NMAX = 25
+    tangent = _phi_predictor(predictor) == 'tangent'
+    trapezoid = _phi_method(method) == 'trapezoid'
+    scalar = np.isscalar(r0)
+    shape = np.shape(r0)
+    r0 = _as_doubles(r0).ravel()
+    levels = np.zeros(r0.shape, dtype=int)
+    nroots = 0
+    iters0 = COUNTERS['root_iters']
+    if phi_int_degenerate(kap, thv):
+        result = phi_int_kap0(r0, thv)
+    else:
+        result = np.empty(r0.shape)
+        result.fill(np.nan)
+        osum = np.zeros(r0.shape)
+        rEnd = _solve_phi_nodes(r0[:, np.newaxis], np.array([np.pi]),
+                                phi_root_guess(r0[:, np.newaxis], np.pi, thv), kap, sig, thv, xacc)
+        fEnd = np.power(rEnd[:, 0] / r0, 2.0)
+        nroots += r0.size
+        active = np.arange(r0.size)
+        rPrev = None
+        for n in xrange(nmin, NMAX):
+            it = 1 << (n - 2)
+            h = np.pi / it
+            phis = h*np.arange(1, it)
+            r0a = r0[active][:, np.newaxis]
+            if rPrev is None:
+                rp = _solve_phi_nodes(r0a, phis, phi_root_guess(r0a, phis, thv), kap, sig, thv, xacc)
+            else:
+                ends = np.hstack((r0a, rPrev, rEnd[active]))
+                if tangent:
+                    # Slopes of the previous level's midpoints are only worked
+                    # out now that a level needs them; dr'/dphi vanishes at
+                    # phi = 0 and pi.
+                    new = np.isnan(sPrev)
+                    phiPrev = np.broadcast_to(phis[1::2], sPrev.shape)
+                    r0Prev = np.broadcast_to(r0a, sPrev.shape)
+                    sPrev[new] = phi_root_slope(rPrev[new], r0Prev[new], phiPrev[new], kap, sig, thv)
+                    slopes = np.hstack((np.zeros_like(r0a), sPrev, np.zeros_like(r0a)))
+                    guess = hermite_mid(ends[:, :-1], ends[:, 1:], slopes[:, :-1], slopes[:, 1:], h)
+                else:
+                    guess = 0.5*(ends[:, :-1] + ends[:, 1:])
+                rp = np.empty((active.size, it - 1))
+                rp[:, 1::2] = rPrev
+                rp[:, 0::2] = _solve_phi_nodes(r0a, phis[0::2], guess, kap, sig, thv, xacc)
+            if tangent:
+                sp = np.empty_like(rp)
+                sp.fill(np.nan)
+                if rPrev is not None:
+                    sp[:, 1::2] = sPrev
+            nroots += (it - 1 if rPrev is None else it // 2)*active.size
+            fx = np.power(rp / r0a, 2.0)
+            if trapezoid:
+                sum = (0.5*(1.0 + fEnd[active]) + np.sum(fx, axis=1))*2.0*h
+            else:
+                sum = (1.0 + fEnd[active] + 4.0*np.sum(fx[:, 0::2], axis=1) + 2.0*np.sum(fx[:, 1::2], axis=1))*2.0*h / 3.0
+            osumA = osum[active]
+            done = (np.abs(sum - osumA) < eps*np.abs(osumA)) | ((sum == 0.0) & (osumA == 0.0))
+            if n == nmin:
+                done[:] = False
+            result[active[done]] = sum[done]
+            levels[active] = n
+            osum[active] = sum
+            rPrev = rp[~done]
+            if tangent:
+                sPrev = sp[~done]
+            active = active[~done]
+            if active.size == 0:
+                break
+
+    COUNTERS['phi_integrals'] += r0.size
+    COUNTERS['simpson_levels'] += int(np.sum(levels))
+    if scalar:
+        result, levels = result[0], levels[0]
+    else:
+        result, levels = result.reshape(shape), levels.reshape(shape)
+    if full_output:
+        iters = COUNTERS['root_iters'] - iters0
+        return result, {'root_solves': nroots, 'root_iters': iters,
+                        'iters_per_node': iters / float(max(nroots, 1)), 'level': levels}
+    return result
+
+def int_g(y, chi, k, p):
+    bG = (1.0 - p)/2.0
+    ys = np.power(y, 0.5*(bG*(4.0 - k) + 4.0 - 3.0*k))
+    chis = np.power(chi, np.divide(7.0*k - 23.0 + bG*(13.0 + k), 6.0*(4.0 - k)))
+    factor = np.power((7.0 - 2.0*k)*chi*np.power(y, 4.0 - k) + 1.0, bG - 2.0)
+    return ys*chis*factor
+
+def flux_prefactor(y, r0, kap, sig, thv, gA, k, p):
+    # Everything in fluxG except the phi integral.
+    Gk = (4.0 - k)*np.power(gA, 2.0)
+    thP0 = theta_prime(r0 / y, thv, 0.0)
+    exp0 = np.power(thP0 / sig, 2.0*kap)
+    chiVal = (y - Gk*np.exp2(-exp0)*np.power(np.tan(thv) + r0 / y, 2.0)) / np.power(y, 5.0 - k)
+    return r0*int_g(y, chiVal, k, p)
+
+def flux_g(y, r0, kap, sig, thv, gA, k, p, eps=1.0e-9, xacc=1.0e-10):
+    return flux_prefactor(y, r0, kap, sig, thv, gA, k, p)*simps_phi_np(r0, kap, sig, thv, eps, nmin=3, xacc=xacc)
+
+# Shares of a relative tolerance on r0_int: the DE rule gets R0_SHARE of it and
+# every phi integral PHI_SHARE, which bounds the relative error it passes on
+# to the integrand; roots go ROOT_SHARE further in, since their noise has to
+# stay well below the Simpson eps. The inner tolerances never get tighter than
+# the fixed defaults, or looser than PHI_EPS_MAX.
+R0_SHARE = 0.5
+PHI_SHARE = 0.5
+ROOT_SHARE = 0.1
+PHI_EPS_MAX = 1.0e-3
+
+# Integration variables of r0_int and r0_int_ct: r0 itself, or log r0, in
+# which fluxG ~ 1 / r0 at small r0 becomes flat and the nodes spread evenly
+# over the decades instead of crowding near RMIN.
+R0_VARIABLES = ('linear', 'log')
+
+def _r0_variable(variable, *limits):
+    if variable not in R0_VARIABLES:
+        raise ValueError("unknown r0 variable {!r}, expected one of {}".format(variable, R0_VARIABLES))
+    if variable == 'log' and not all(x > 0.0 for x in limits):
+        raise ValueError("log r0 integration needs positive limits, got {}".format(limits))
+    return variable
+
+def tolerance_budget(rtol=None, atol=None):
+    # Split an r0 integral target into the tolerances of its levels: r0_atol
+    # and r0_rtol for the outer rule, phi_eps for the Simpson phi integrals
+    # and root_xacc for the phi roots. With no rtol the inner levels keep
+    # their fixed defaults, since a bare atol says nothing about how
+    # accurate each phi integral has to be.
+    if rtol is None and atol is None:
+        raise ValueError("tolerance_budget needs rtol, atol or both")
+    rtol = 0.0 if rtol is None else float(rtol)
+    atol = 0.0 if atol is None else float(atol)
+    if rtol < 0.0 or atol < 0.0 or rtol == atol == 0.0:
+        raise ValueError("tolerances must be >= 0 and not both 0, got rtol = {}, atol = {}".format(rtol, atol))
+    phi_eps = min(max(PHI_SHARE*rtol, 1.0e-9), PHI_EPS_MAX)
+    return {'r0_rtol': R0_SHARE*rtol, 'r0_atol': atol, 'phi_eps': phi_eps,
+            'root_xacc': max(ROOT_SHARE*phi_eps, 1.0e-10)}
+
+def r0_root_fun(r0, y, kap, sig, thv, k, gA):
+    r0 = r0 / y
+    Gk = (4.0 - k)*np.power(gA, 2.0)
+    eng0 = energy_profile(theta_prime(r0, thv, 0.0), sig, kap)
+    lhs = np.power(r0 + np.tan(thv), 2.0)*eng0
+    rhs = (y - np.power(y, 5.0 - k)) / Gk
+    return lhs - rhs
+
+def r0_root_jac(r0, y, kap, sig, thv, k, gA):
+    r0 = r0 / y
+    thp0 = theta_prime(r0, thv, 0.0)
+    frac = kap*np.log(2.0)*np.power(thp0 / sig, 2.0*kap)*((r0 + np.tan(thv)) / (r0*(1.0 + r0*np.sin(thv)*np.cos(thv))))
+    exponent = 2.0*energy_profile(thp0, sig, kap)
+    return (1.0 - frac)*exponent*(r0 + np.tan(thv)) / y
+
+@_timed('r0_max_time')
+def rtsafe_r0(y, kap, sig, thv, k, gA, x1=0.0, x2=0.65, xacc=1.0e-7, fl=None, fh=None, x0=None):
+    # Port of the native rtsafeR0, including its -1.0 "not bracketed" value;
+    # fl and fh are the function at x1 and x2 when already known, x0 the
+    # first iterate (the middle by default).
+    COUNTERS['r0_max_solves'] += 1
+    MAXIT = 100
+    args = (y, kap, sig, thv, k, gA)
+    if fl is None:
+        fl = r0_root_fun(x1, *args)
+    if fh is None:
+        fh = r0_root_fun(x2, *args)
+    if (fl > 0.0 and fh > 0.0) or (fl < 0.0 and fh < 0.0):
+        return -1.0
+    if fl == 0.0:
+        return x1
+    if fh == 0.0:
+        return x2
+    if fl < 0.0:
+        xl, xh = x1, x2
+    else:
+        xh, xl = x1, x2
+    rts = 0.5*(x1 + x2) if x0 is None else x0
+    dxold = abs(x2 - x1)
+    dx = dxold
+    f = r0_root_fun(rts, *args)
+    df = r0_root_jac(rts, *args)
+    for j in xrange(MAXIT):
+        if (((rts - xh)*df - f)*((rts - xl)*df - f) > 0.0) or (abs(2.0*f) > abs(dxold*df)):
+            dxold = dx
+            dx = 0.5*(xh - xl)
+            rts = xl + dx
+            if xl == rts:
+                return rts
+        else:
+            dxold = dx
+            dx = f / df
+            temp = rts
+            rts -= dx
+            if temp == rts:
+                return rts
+        if abs(dx) < xacc:
+            return rts
+        f = r0_root_fun(rts, *args)
+        df = r0_root_jac(rts, *args)
+        if f < 0.0:
+            xl = rts
+        else:
+            xh = rts
+    raise RuntimeError("Maximum number of iterations exceeded in rtsafe_r0")
+
+# The r0_max root is searched in [0, R0_BRACKET]; when r0_root_fun is
+# negative at both ends the root lies beyond it and the upper end is doubled
+# until the sign changes or it passes R0_BRACKET_MAX, as in the native r0Max.
+R0_BRACKET = 0.65
+R0_BRACKET_MAX = 1.0e3
+
+def r0_bracket(y, kap, sig, thv, k, gA):
+    # The upper end of the bracket and the function at both ends.
+    hi = R0_BRACKET
+    fl = r0_root_fun(0.0, y, kap, sig, thv, k, gA)
+    fh = r0_root_fun(hi, y, kap, sig, thv, k, gA)
+    while fl < 0.0 and fh < 0.0 and hi < R0_BRACKET_MAX:
+        hi *= 2.0
+        fh = r0_root_fun(hi, y, kap, sig, thv, k, gA)
+    return hi, fl, fh
+
+def r0_max_np(y, kap, sig, thv, k, gA, xacc=1.0e-7):
+    # The native r0Max: rtsafe_r0 on the expanded bracket, -1.0 when nothing
+    # emits.
+    hi, fl, fh = r0_bracket(y, kap, sig, thv, k, gA)
+    return rtsafe_r0(y, kap, sig, thv, k, gA, 0.0, hi, xacc, fl, fh)
+
+@_timed('r0_max_time')
+def r0_max_walk(ys, kap, sig, thv, k, gA, xacc=1.0e-7):
+    # Port of the native r0MaxWalk: r0_max along y (best ascending), each
+    # solve started from the root extrapolated from the two before it.
+    # Returns the roots, NaN where nothing emits, and the mask of the ones
+    # found.
+    out = np.full(len(ys), np.nan)
+    found = np.zeros(len(ys), dtype=bool)
+    prev = []
+    for i, y in enumerate(ys):
+        hi, fl, fh = r0_bracket(y, kap, sig, thv, k, gA)
+        if fl*fh > 0.0:
+            prev = []
+            continue
+        guess = 0.5*hi
+        if prev:
+            x0 = prev[0][1]
+            if len(prev) > 1 and prev[0][0] != prev[1][0]:
+                x0 += (prev[0][1] - prev[1][1])*(y - prev[0][0]) / (prev[0][0] - prev[1][0])
+            # r0_root_jac is singular at r0 = 0.
+            if 0.0 < x0 < hi:
+                guess = x0
+        R0MAX = rtsafe_r0(y, kap, sig, thv, k, gA, 0.0, hi, xacc, fl, fh, guess)
+        if R0MAX < 0.0:
+            prev = []
+            continue
+        out[i], found[i] = R0MAX, True
+        prev = [(y, R0MAX)] + prev[:1]
+    return out, found
+
+class LRUCache(object):
+    # Bounded mapping that evicts the least recently used entry; keeps hit
+    # and miss counts.
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+def memoize(maxsize=4096):
+    # Decorator caching a function of hashable arguments in an LRUCache,
+    # exposed as fun.cache.
+    def decorator(fun):
+        cache = LRUCache(maxsize)
+        def wrapper(*args, **kwargs):
+            key = args + tuple(sorted(kwargs.items()))
+            value = cache.get(key)
+            if value is None:
+                value = fun(*args, **kwargs)
+                cache.put(key, value)
+            return value
+        wrapper.cache = cache
+        wrapper.__name__ = fun.__name__
+        wrapper.__doc__ = fun.__doc__
+        return wrapper
+    return decorator
+
+# r0_max results shared by every GrbaIntegrator, keyed by
+# (y, kap, sig, thv, k, p, gA, backend name).
+R0_MAX_CACHE = LRUCache(1 << 16)
+
+# Part of every persistent cache key (see grba_cache); bump it whenever a
+# change moves the values the engines compute, so old results stop matching.
+ENGINE_VERSION = 2
+
+def _de_rule():
+    # Abscissas and weights of DEIntegrationConstants.h, one array per level:
+    # t = 0, 1, 2, 3 first, then the odd multiples of 2**-level below 3.
+    ts = [np.arange(0.0, 4.0)]
+    for level in xrange(1, 7):
+        h = 0.5**level
+        ts.append(h*np.arange(1, int(3.0 / h), 2))
+    xs = [np.tanh(0.5*np.pi*np.sinh(t)) for t in ts]
+    ws = [0.5*np.pi*np.cosh(t) / np.power(np.cosh(0.5*np.pi*np.sinh(t)), 2.0) for t in ts]
+    return xs, ws
+
+_DE_ABSCISSAS, _DE_WEIGHTS = _de_rule()
+
+def de_integrate(f, a, b, tol, rtol=0.0):
+    # Port of DEIntegrator::Integrate for an integrand that accepts arrays,
+    # so every level is a single call; it stops once the error estimate is
+    # below tol or rtol times the integral. Returns the integral, the number
+    # of function evaluations and the error estimate.
+    c = 0.5*(b - a)
+    d = 0.5*(a + b)
+    tol /= c
+    x, w = _DE_ABSCISSAS[0], _DE_WEIGHTS[0]
+    fx = f(np.concatenate((c*x + d, -c*x[1:] + d)))
+    integral = w[0]*fx[0] + np.dot(w[1:], fx[1:4] + fx[4:])
+    neval = fx.size
+    errorEstimate = np.finfo(float).max
+    h = 1.0
+    currentDelta = np.finfo(float).max
+    for level in xrange(1, len(_DE_ABSCISSAS)):
+        x, w = _DE_ABSCISSAS[level], _DE_WEIGHTS[level]
+        h *= 0.5
+        fx = f(np.concatenate((c*x + d, -c*x + d)))
+        neval += fx.size
+        newContribution = h*np.dot(w, fx[:x.size] + fx[x.size:])
+        previousDelta = currentDelta
+        currentDelta = np.abs(0.5*integral - newContribution)
+        integral = 0.5*integral + newContribution
+        if level == 1:
+            continue
+        if currentDelta == 0.0:
+            break
+        with np.errstate(divide='ignore'):
+            r = np.log(currentDelta) / np.log(previousDelta)
+        if r > 1.9 and r < 2.1:
+            errorEstimate = currentDelta*currentDelta
+        else:
+            errorEstimate = currentDelta
+        if errorEstimate < 0.1*tol or errorEstimate < 0.1*rtol*np.abs(integral):
+            break
+
+    return c*integral, neval, errorEstimate*c
+
+def de_integrate_multi(f, a, b, tol, rtol=0.0):
+    # de_integrate for an integrand returning an (nodes, m) array, i.e. m
+    # integrals over the same nodes. Each column stops on its own at the
+    # level de_integrate would stop it and keeps that value while the rest
+    # go on. Returns the m integrals, the number of nodes evaluated and the
+    # m error estimates.
+    c = 0.5*(b - a)
+    d = 0.5*(a + b)
+    tol /= c
+    x, w = _DE_ABSCISSAS[0], _DE_WEIGHTS[0]
+    fx = f(np.concatenate((c*x + d, -c*x[1:] + d)))
+    integral = w[0]*fx[0] + np.dot(w[1:], fx[1:4] + fx[4:])
+    neval = len(fx)
+    m = integral.size
+    errorEstimate = np.empty(m)
+    errorEstimate.fill(np.finfo(float).max)
+    active = np.ones(m, dtype=bool)
+    h = 1.0
+    currentDelta = np.empty(m)
+    currentDelta.fill(np.finfo(float).max)
+    for level in xrange(1, len(_DE_ABSCISSAS)):
+        x, w = _DE_ABSCISSAS[level], _DE_WEIGHTS[level]
+        h *= 0.5
+        fx = f(np.concatenate((c*x + d, -c*x + d)))[:, active]
+        neval += len(fx)
+        newContribution = h*np.dot(w, fx[:x.size] + fx[x.size:])
+        previousDelta = currentDelta[active]
+        delta = np.abs(0.5*integral[active] - newContribution)
+        integral[active] = 0.5*integral[active] + newContribution
+        currentDelta[active] = delta
+        if level == 1:
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.log(delta) / np.log(previousDelta)
+        err = np.where((r > 1.9) & (r < 2.1), delta*delta, delta)
+        errorEstimate[active] = np.where(delta == 0.0, errorEstimate[active], err)
+        done = (delta == 0.0) | (err < 0.1*tol) | (err < 0.1*rtol*np.abs(integral[active]))
+        active[np.nonzero(active)[0][done]] = False
+        if not active.any():
+            break
+
+    return c*integral, neval, errorEstimate*c
+
+@_timed('r0_time')
+def _r0_int_de(fun, a, b, tol=1.0e-5, rtol=0.0):
+    # de_integrate with the r0IntDE target, counted as one r0 integral.
+    # Returns the integral and its error estimate.
+    value, neval, err = de_integrate(fun, a, b, tol, rtol)
+    _count_r0_integral(neval, err)
+    return value, err
+
+@_timed('r0_time')
+def _r0_int_de_multi(fun, a, b, tol=1.0e-5, rtol=0.0):
+    # de_integrate_multi, counted as one r0 integral per column.
+    values, neval, err = de_integrate_multi(fun, a, b, tol, rtol)
+    COUNTERS['r0_integrals'] += values.size
+    COUNTERS['r0_evals'] += int(neval)
+    COUNTERS['r0_error'] += float(np.sum(err))
+    return values
+
+@_timed('r0_time')
+def _r0_int_quad(fun, a, b, args=(), **kwargs):
+    # quad, counted as one r0 integral with its evaluations and error
+    # estimate. Its warnings are raised as quad itself would.
+    out = quad(fun, a, b, args, full_output=1, **kwargs)
+    if len(out) > 3:
+        warnings.warn(out[3], IntegrationWarning)
+    _count_r0_integral(out[2]['neval'], out[1])
+    return out[0], out[1]
+
+# The exports NativeBackend binds, as attribute: (symbol, restype, argtypes);
+# argtypes None leaves ctypes to convert the arguments.
+NATIVE_EXPORTS = {
+    'thetaPrime': ('thetaPrime', c_double, [c_double]*3),
+    'energyProfile': ('energyProfile', c_double, [c_double]*3),
+    'phiInt': ('phiInt', c_double, [c_double]*4),
+    'fluxWrap': ('fluxWrap', c_double, [c_double]*8),
+    'r0IntDE': ('r0IntDE', c_double, [c_double]*8),
+    '_r0IntDETol': ('r0IntDETol', c_double, [c_double]*12 + [POINTER(c_double)]),
+    'fluxWrap_ct': ('fluxWrap_ct', c_double, (c_int, c_double)),
+    'fluxWrap_ud': ('fluxWrap_ud', c_double, [c_double, c_void_p]),
+    'r0Max': ('r0Max', c_double, [c_double]*7),
+    'thetaPrimeBatch': ('thetaPrimeBatch', None, [c_double_p, c_int, c_double, c_double, c_double_p]),
+    'energyProfileBatch': ('energyProfileBatch', None, [c_double_p, c_int, c_double, c_double, c_double_p]),
+    'phiIntBatch': ('phiIntBatch', None, [c_double_p, c_int, c_double, c_double, c_double, c_double_p]),
+    'phiIntBatchTol': ('phiIntBatchTol', None, [c_double_p, c_int] + [c_double]*5 + [c_double_p]),
+    'fluxWrapBatch': ('fluxWrapBatch', None, [c_double, c_double_p, c_int] + [c_double]*6 + [c_double_p]),
+    'fluxWrapPairBatch': ('fluxWrapPairBatch', None, [c_double_p, c_double_p, c_int] + [c_double]*6 + [c_double_p]),
+    'fluxWrapBatchTol': ('fluxWrapBatchTol', None, [c_double, c_double_p, c_int] + [c_double]*8 + [c_double_p]),
+    'r0MaxBatch': ('r0MaxBatch', None, [c_double_p, c_int] + [c_double]*6 + [c_double_p]),
+    'r0MaxWalk': ('r0MaxWalk', None, [c_double_p, c_int] + [c_double]*6 + [c_double_p, c_int_p]),
+    'r0IntDEPoints': ('r0IntDEPoints', None, [c_double_p, c_int, c_int, c_double_p]),
+    'phiIntPoints': ('phiIntPoints', None, [c_double_p, c_int, c_int, c_double_p]),
+    'rootSolveCount': ('rootSolveCount', c_longlong, []),
+    'rootIterCount': ('rootIterCount', c_longlong, []),
+    'resetRootSolveCount': ('resetRootSolveCount', None, []),
+    'setPhiPredictor': ('setPhiPredictor', None, [c_int]),
+    'setPhiMethod': ('setPhiMethod', None, [c_int]),
+    '_readStats': ('readStats', None, None),
+    'resetStats': ('resetStats', None, []),
+    'setStatsTiming': ('setStatsTiming', None, [c_int]),
+}
+
+class NativeBackend(object):
+    # The shared library behind the NumpyBackend entry points. It is loaded
+    # here, but each export is only bound (restype and argtypes set) the
+    # first time it is looked up, and then kept on the instance.
+    name = 'native'
+    # Default relative tolerance of the phi roots.
+    phi_xacc = 1.0e-9
+
+    def __init__(self, path):
+        self.path = path
+        self._lib = cdll.LoadLibrary(path)
+
+    def __getattr__(self, attr):
+        if attr not in NATIVE_EXPORTS:
+            raise AttributeError("{!r} object has no attribute {!r}".format(type(self).__name__, attr))
+        symbol, restype, argtypes = NATIVE_EXPORTS[attr]
+        fun = getattr(self._lib, symbol)
+        fun.restype = restype
+        if argtypes is not None:
+            fun.argtypes = argtypes
+        setattr(self, attr, fun)
+        return fun
+
+    def r0IntDETol(self, y, RMIN, kap, sig, thv, k, p, gA, atol, rtol, phiEps, xacc):
+        # Returns the integral and the DE error estimate.
+        err = c_double()
+        value = self._r0IntDETol(y, RMIN, kap, sig, thv, k, p, gA, atol, rtol, phiEps, xacc, byref(err))
+        return value, err.value
+
+    def readStats(self):
+        stats = GrbaStats()
+        self._readStats(byref(stats))
+        return dict((name, getattr(stats, name)) for name in STAT_FIELDS)
+
+class NumpyBackend(object):
+    # Pure NumPy stand-in for the native library with the same entry points
+    # and argument order, used wherever the shared library is unavailable.
+    name = 'numpy'
+    path = None
+    phi_xacc = 1.0e-10
+
+    def thetaPrime(self, r, thv, phi):
+        return theta_prime(r, thv, phi)
+
+    def energyProfile(self, thp, sig, kap):
+        return energy_profile(thp, sig, kap)
+
+    def phiInt(self, r0, kap, thv, sig):
+        return simps_phi_np(r0, kap, sig, thv, nmin=3)
+
+    def fluxWrap(self, y, r0, kap, sig, thv, gA, k, p):
+        return flux_g(y, r0, kap, sig, thv, gA, k, p)
+
+    def fluxWrap_ct(self, r0, y, kap, sig, thv, k, p, gA, phiEps=1.0e-9, xacc=1.0e-10):
+        return flux_g(y, r0, kap, sig, thv, gA, k, p, phiEps, xacc)
+
+    def r0Max(self, y, kap, sig, thv, k, p, gA):
+        return r0_max_np(y, kap, sig, thv, k, gA)
+
+    def r0IntDE(self, y, RMIN, kap, sig, thv, k, p, gA):
+        R0MAX = r0_max_np(y, kap, sig, thv, k, gA)
+        if R0MAX < 0.0:
+            return 0.0
+        return _r0_int_de(lambda r0: flux_g(y, r0, kap, sig, thv, gA, k, p), RMIN, R0MAX)[0]
+
+    def r0IntDETol(self, y, RMIN, kap, sig, thv, k, p, gA, atol, rtol, phiEps, xacc):
+        R0MAX = r0_max_np(y, kap, sig, thv, k, gA)
+        if R0MAX < 0.0:
+            return 0.0, 0.0
+        fun = lambda r0: flux_g(y, r0, kap, sig, thv, gA, k, p, phiEps, xacc)
+        return _r0_int_de(fun, RMIN, R0MAX, atol, rtol)
+
+    def thetaPrimeBatch(self, r, n, thv, phi, out):
+        out[:n] = theta_prime(r[:n], thv, phi)
+
+    def energyProfileBatch(self, thp, n, sig, kap, out):
+        out[:n] = energy_profile(thp[:n], sig, kap)
+
+    def phiIntBatch(self, r0, n, kap, thv, sig, out):
+        out[:n] = simps_phi_np(r0[:n], kap, sig, thv, nmin=3)
+
+    def phiIntBatchTol(self, r0, n, kap, thv, sig, eps, xacc, out):
+        out[:n] = simps_phi_np(r0[:n], kap, sig, thv, eps, nmin=3, xacc=xacc)
+
+    def fluxWrapBatch(self, y, r0, n, kap, sig, thv, gA, k, p, out):
+        out[:n] = flux_g(y, r0[:n], kap, sig, thv, gA, k, p)
+
+    def fluxWrapPairBatch(self, y, r0, n, kap, sig, thv, gA, k, p, out):
+        out[:n] = flux_g(y[:n], r0[:n], kap, sig, thv, gA, k, p)
+
+    def fluxWrapBatchTol(self, y, r0, n, kap, sig, thv, gA, k, p, phiEps, xacc, out):
+        out[:n] = flux_g(y, r0[:n], kap, sig, thv, gA, k, p, phiEps, xacc)
+
+    def r0MaxBatch(self, y, n, kap, sig, thv, k, p, gA, out):
+        for i in xrange(n):
+            out[i] = r0_max_np(y[i], kap, sig, thv, k, gA)
+
+    def r0MaxWalk(self, y, n, kap, sig, thv, k, p, gA, out, found):
+        out[:n], found[:n] = r0_max_walk(y[:n], kap, sig, thv, k, gA)
+
+    # The point batches run in turn here; nthreads is only for the native
+    # library.
+    def r0IntDEPoints(self, points, n, nthreads, out):
+        for i in xrange(n):
+            out[i] = self.r0IntDE(*points[i])
+
+    def phiIntPoints(self, points, n, nthreads, out):
+        for i in xrange(n):
+            out[i] = self.phiInt(*points[i])
+
+    def rootSolveCount(self):
+        return COUNTERS['root_solves']
+
+    def rootIterCount(self):
+        return COUNTERS['root_iters']
+
+    def resetRootSolveCount(self):
+        COUNTERS['root_solves'] = 0
+        COUNTERS['root_iters'] = 0
+
+    def setPhiPredictor(self, mode):
+        PHI_PREDICTOR['mode'] = PHI_PREDICTORS[mode]
+
+    def setPhiMethod(self, method):
+        PHI_METHOD['method'] = PHI_METHODS[method]
+
+    def readStats(self):
+        return dict(COUNTERS)
+
+    def resetStats(self):
+        COUNTERS.update(_zero_stats())
+
+    def setStatsTiming(self, on):
+        TIMING['on'] = bool(on)
+
+BACKENDS = ('native', 'numba', 'numpy')
+
+def find_native_library():
+    # GRBA_INTEGRATION_LIB wins; otherwise look for the Release build next to
+    # the working directory and next to this module.
+    path = os.environ.get('GRBA_INTEGRATION_LIB')
+    if path:
+        return path
+    name = 'grba_integration.dll' if os.name == 'nt' else 'grba_integration.so'
+    for base in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        candidate = os.path.join(base, 'Release', name)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+# NativeBackend instances by library path, shared by everything in this
+# process. A forked child notices the new pid and loads its own.
+_NATIVE_BACKENDS = {'pid': None, 'libs': {}}
+
+def native_backend(path=None):
+    # The shared NativeBackend of path, find_native_library() by default.
+    if path is None:
+        path = find_native_library()
+        if path is None:
+            raise OSError("grba_integration library not found; build it with `make` or set GRBA_INTEGRATION_LIB")
+    if _NATIVE_BACKENDS['pid'] != os.getpid():
+        _NATIVE_BACKENDS['pid'] = os.getpid()
+        _NATIVE_BACKENDS['libs'] = {}
+    libs = _NATIVE_BACKENDS['libs']
+    lib = libs.get(path)
+    if lib is None:
+        lib = libs[path] = NativeBackend(path)
+    return lib
+
+def load_backend(name=None):
+    # None or 'auto' picks the native library when it can be loaded, then
+    # the numba kernels when numba is installed, then the NumPy engine.
+    # Backend instances are returned unchanged.
+    if isinstance(name, (NativeBackend, NumpyBackend)):
+        return name
+    if name is None or name == 'auto':
+        try:
+            return load_backend('native')
+        except OSError:
+            pass
+        try:
+            return load_backend('numba')
+        except ImportError:
+            return NumpyBackend()
+    if name == 'native':
+        return native_backend()
+    if name == 'numba':
+        # Optional: compiled versions of the NumPy engine, cached on disk.
+        from grba_numba import NumbaBackend
+        return NumbaBackend()
+    if name == 'numpy':
+        return NumpyBackend()
+    raise ValueError("unknown backend {!r}, expected one of {}".format(name, BACKENDS))
+
+def read_stats(lib):
+    # Totals of STAT_FIELDS for a backend: the Python engines always count in
+    # COUNTERS, to which the native library adds its own.
+    stats = dict(COUNTERS)
+    if lib.name == 'native':
+        for name, value in lib.readStats().items():
+            stats[name] += value
+    return stats
+
+def reset_stats(lib):
+    COUNTERS.update(_zero_stats())
+    if lib.name == 'native':
+        lib.resetStats()
+
+def set_stats_timing(lib, on):
+    TIMING['on'] = bool(on)
+    lib.setStatsTiming(int(bool(on)))
+
+class IntegratorStats(object):
+    # What GrbaIntegrator.enable_stats() collects: for every top level call
+    # of an instrumented method, the change of read_stats() plus its name
+    # and wall time. history keeps the latest maxlen records, total sums all
+    # of them and calls counts them by method.
+    def __init__(self, maxlen=1000):
+        self.history = deque(maxlen=maxlen)
+        self.total = _zero_stats()
+        self.total['wall'] = 0.0
+        self.calls = {}
+        self._depth = 0
+
+    @property
+    def last(self):
+        return self.history[-1] if self.history else None
+
+    def record(self, name, before, after, wall):
+        rec = dict((key, after[key] - before[key]) for key in STAT_FIELDS)
+        rec['wall'] = wall
+        for key in rec:
+            self.total[key] += rec[key]
+        rec['call'] = name
+        self.history.append(rec)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return rec
+
+    def clear(self):
+        self.history.clear()
+        self.total = _zero_stats()
+        self.total['wall'] = 0.0
+        self.calls = {}
+
+    def summary(self, rec=None):
+        # rec (total by default) with the derived ratios: iterations per root
+        # solve, Simpson levels per phi integral and evaluations per r0
+        # integral.
+        if rec is None:
+            rec = self.total
+        out = dict(rec)
+        out['iters_per_solve'] = rec['root_iters'] / float(max(rec['root_solves'], 1))
+        out['levels_per_phi'] = rec['simpson_levels'] / float(max(rec['phi_integrals'], 1))
+        out['evals_per_r0'] = rec['r0_evals'] / float(max(rec['r0_integrals'], 1))
+        return out
+
+def _instrumented(fun):
+    # Records the stats of a GrbaIntegrator method call in self.stats when
+    # stats are enabled; calls made from inside another instrumented call
+    # belong to the outer record.
+    @wraps(fun)
+    def wrapper(self, *args, **kwargs):
+        stats = self.stats
+        if stats is None or stats._depth:
+            return fun(self, *args, **kwargs)
+        before = read_stats(self.backend)
+        stats._depth += 1
+        start = timeit.default_timer()
+        try:
+            return fun(self, *args, **kwargs)
+        finally:
+            wall = timeit.default_timer() - start
+            stats._depth -= 1
+            stats.record(fun.__name__, before, read_stats(self.backend), wall)
+    return wrapper
 
 class GrbaIntegrator(object):
-    def __init__(self, kap, thv, sig, gA, k, p):
-        # grbaint = cdll.LoadLibrary("Debug/grba_integration.dll")
-        grbaint = cdll.LoadLibrary("Release/grba_integration.dll")
-        thetaPrime = grbaint.thetaPrime
-        thetaPrime.restype = c_double
-        thetaPrime.argtypes = [c_double, c_double, c_double]
-        engProf = grbaint.energyProfile
-        engProf.restype = c_double
-        engProf.argtypes = [c_double, c_double, c_double]
-        phiInt = grbaint.phiInt
-        phiInt.restype = c_double
-        phiInt.argtypes = [c_double, c_double, c_double, c_double]
-        fluxG = grbaint.fluxWrap
-        fluxG.restype = c_double
-        fluxG.argtypes = [c_double, c_double, c_double, c_double, c_double, c_double, c_double, c_double]
-        r0IntDE = grbaint.r0IntDE
-        r0IntDE.restype = c_double
-        r0IntDE.argtypes = [c_double, c_double, c_double, c_double, c_double, c_double, c_double, c_double]
-        fluxG_ct = grbaint.fluxWrap_ct
-        fluxG_ct.restype = c_double
-        fluxG_ct.argtypes = (c_int, c_double)
-        r0Max = grbaint.r0Max
-        r0Max.restype = c_double
-        r0Max.argtypes = [c_double, c_double, c_double, c_double, c_double, c_double, c_double]
-        
+    # Whether r0_int_ct hands quad the native fluxG as a LowLevelCallable;
+    # False keeps it on the ctypes fluxG_ct.
+    lowlevel = True
+
+    def __init__(self, kap, thv, sig, gA, k, p, backend=None, phi_table=None, cache=None):
+        # cache is a grba_cache.ResultCache, or a path to open one at, that
+        # keeps scalar r0_int, r0_max and phi_int results across processes.
+        lib = load_backend(backend)
+        if cache is not None and not isinstance(cache, ResultCache):
+            cache = ResultCache(cache)
+        if phi_table is not None:
+            if phi_table.sig != sig:
+                raise ValueError("phi_table was built for sig = {}, not {}".format(phi_table.sig, sig))
+            phi_table.check(kap, thv)
+
         self.kap = kap
         self.thv = thv
         self.sig = sig
         self.gA = gA
         self.k = k
         self.p = p
-        self.thetaPrime = thetaPrime
-        self.engProf = engProf
-        self.fluxG = fluxG
-        self.r0IntDE = r0IntDE
-        self.fluxG_ct = fluxG_ct
-        self.r0Max = r0Max
+        self.backend = lib
+        self.phi_table = phi_table
+        self.cache = cache
+        self.stats = None
+        self.thetaPrime = lib.thetaPrime
+        self.engProf = lib.energyProfile
+        self.phiInt = lib.phiInt
+        self.fluxG = lib.fluxWrap
+        self.r0IntDE = lib.r0IntDE
+        self.r0IntDETol = lib.r0IntDETol
+        self.fluxG_ct = lib.fluxWrap_ct
+        self.r0Max = lib.r0Max
+        self.thetaPrimeBatch = lib.thetaPrimeBatch
+        self.engProfBatch = lib.energyProfileBatch
+        self.phiIntBatch = lib.phiIntBatch
+        self.phiIntBatchTol = lib.phiIntBatchTol
+        self.fluxGBatch = lib.fluxWrapBatch
+        self.fluxGPairBatch = lib.fluxWrapPairBatch
+        self.fluxGBatchTol = lib.fluxWrapBatchTol
+        self.r0MaxBatch = lib.r0MaxBatch
+        self.r0MaxWalk = lib.r0MaxWalk
     
     def _root_fun(self, r, r0, phi, kap, sig, thv):
         thp = self.thetaPrime(r, thv, phi)
@@ -57,71 +1029,537 @@ class GrbaIntegrator(object):
         second = np.power(r, 2.0) + 2.0*r*np.tan(thv)*np.cos(phi) + np.power(np.tan(thv), 2.0)
         frac = (kap*np.log(2.0)*np.power(thp / sig, 2.0*kap)) / (r*(1.0 + 0.5*r*np.sin(2.0*thv)*np.cos(phi)))
         exponent = 2.0*self.engProf(thp, sig, kap)
-        return (first - second*frac)*exponent
+        thp0 = self.thetaPrime(r, thv, 0.0)
+        frac0 = (kap*np.log(2.0)*np.power(thp0 / sig, 2.0*kap)) / (r*(1.0 + 0.5*r*np.sin(2.0*thv)))
+        exponent0 = 2.0*self.engProf(thp0, sig, kap)
+        return (first - second*frac)*exponent + np.power(r0 + np.tan(thv), 2.0)*frac0*exponent0
     
-    def simps_phi(self, r0, eps = 1.0e-9):
+    def _solve_phi(self, r0, phi, g):
+        # One scipy root solve; a solve that fails or lands on a negative
+        # root is redone from the kap = 0 root. Returns the root and the
+        # function evaluations spent.
+        sol = root(self._root_fun, g, args = (r0, phi, self.kap, self.sig, self.thv),
+                   jac = self._root_jac)
+        rp, nfev = sol.x[0], sol.nfev
+        if not (sol.success and rp > 0.0):
+            sol = root(self._root_fun, phi_root_guess(r0, phi, self.thv),
+                       args = (r0, phi, self.kap, self.sig, self.thv), jac = self._root_jac)
+            rp, nfev = sol.x[0], nfev + sol.nfev
+        return rp, nfev
+
+    @_instrumented
+    @_timed('phi_time')
+    def simps_phi(self, r0, eps = 1.0e-9, full_output = False, predictor = None, method = None):
+        # Trapezoid refinement of [0, pi], doubled since the integrand is
+        # symmetric about pi: each pass only solves the roots at the new
+        # midpoints and the Simpson sum with it intervals is
+        # (4 T_it - T_it/2) / 3. Level n has the step of 2**(n - 1) intervals
+        # over [0, 2 pi], as in the full Simpson rebuild. The first midpoint
+        # starts from the kap = 0 root, later ones from their neighbours as
+        # chosen by predictor (see PHI_PREDICTORS). method = 'trapezoid'
+        # returns 2 T_it itself. kap = 0 and thv = 0 use the closed form. The
+        # numba backend runs the same levels on its compiled kernel.
+        if self.backend.name == 'numba':
+            return self.backend.simpsPhi(r0, self.kap, self.sig, self.thv, eps, full_output = full_output,
+                                         predictor = predictor, method = method)
+        if phi_int_degenerate(self.kap, self.thv):
+            sum = phi_int_kap0(r0, self.thv)
+            COUNTERS['phi_integrals'] += 1
+            if full_output:
+                return sum, {'root_solves': 0, 'root_iters': 0, 'iters_per_node': 0.0, 'level': 0}
+            return sum
         NMAX = 25
-        sum = 0.0
+        tangent = _phi_predictor(predictor) == 'tangent'
+        trapezoid = _phi_method(method) == 'trapezoid'
         osum = 0.0
-        for n in xrange(6, NMAX):
-            it = 2
-            for j in xrange(1, n-1): 
-                it <<= 1
-            
-            tnm = it
-            h = 2.0*np.pi / tnm
-            s = 2.0
-            g = r0
-            phi = 0.0
-            for i in xrange(1, it):
-                phi += h
-                rp = root(self._root_fun, g, 
-                            args = (r0, phi, self.kap, self.sig, self.thv),
-                            jac = self._root_jac).x[0]
-                g = rp
-                fx = np.power(rp / r0, 2.0)
-                
-                if (i % 2):
-                    s += 4.0*fx
+        rEnd, niters = self._solve_phi(r0, np.pi, phi_root_guess(r0, np.pi, self.thv))
+        nroots = 1
+        rps = [r0, rEnd]
+        # dr'/dphi vanishes at phi = 0 and pi; the other slopes are worked
+        # out when a level first needs them.
+        sps = [0.0, 0.0]
+        trap = 0.5*np.pi*(1.0 + np.power(rEnd / r0, 2.0))
+        for m in xrange(1, NMAX - 1):
+            it = 1 << m
+            h = np.pi / it
+            s = 0.0
+            nextRps, nextSps = [], []
+            for j in xrange(it // 2):
+                phi = (2*j + 1)*h
+                if m == 1:
+                    g = phi_root_guess(r0, phi, self.thv)
+                elif tangent:
+                    for i in (j, j + 1):
+                        if sps[i] is None:
+                            sps[i] = phi_root_slope(rps[i], r0, 2*i*h, self.kap, self.sig, self.thv)
+                    g = float(hermite_mid(rps[j], rps[j + 1], sps[j], sps[j + 1], h))
                 else:
-                    s += 2.0*fx
-                    
-            sum = s*h / 3.0
+                    g = 0.5*(rps[j] + rps[j + 1])
+                rp, nfev = self._solve_phi(r0, phi, g)
+                niters += nfev
+                nextRps.extend((rps[j], rp))
+                nextSps.extend((sps[j], None))
+                s += np.power(rp / r0, 2.0)
+            nextRps.append(rps[-1])
+            nextSps.append(sps[-1])
+            rps, sps = nextRps, nextSps
+            nroots += it // 2
+            otrap = trap
+            trap = 0.5*trap + h*s
+
+            n = m + 2
+            if n < 6:
+                continue
+            sum = 2.0*trap if trapezoid else 2.0*(4.0*trap - otrap) / 3.0
             if (np.abs(sum - osum) < eps*np.abs(osum) or (sum == 0.0 and osum == 0.0)):
+                COUNTERS['root_solves'] += nroots
+                COUNTERS['root_iters'] += niters
+                COUNTERS['phi_integrals'] += 1
+                COUNTERS['simpson_levels'] += n
+                if full_output:
+                    return sum, {'root_solves': nroots, 'root_iters': niters,
+                                 'iters_per_node': niters / float(nroots), 'level': n}
                 return sum
             
             osum = sum
-     
+
+        COUNTERS['root_solves'] += nroots
+        COUNTERS['root_iters'] += niters
+        COUNTERS['phi_integrals'] += 1
+        COUNTERS['simpson_levels'] += NMAX - 1
+
+    @_instrumented
+    def simps_phi_vec(self, r0, eps = 1.0e-9, full_output = False, predictor = None, method = None):
+        # Same Simpson levels and stopping rule as simps_phi, but every phi
+        # node of a level is solved in one batched Newton call.
+        if self.backend.name == 'numba':
+            return self.backend.simpsPhi(r0, self.kap, self.sig, self.thv, eps, full_output = full_output,
+                                         predictor = predictor, method = method)
+        return simps_phi_np(r0, self.kap, self.sig, self.thv, eps, full_output = full_output,
+                            predictor = predictor, method = method)
+
+    def root_solve_count(self):
+        # Cumulative phi root solves of this integrator's backend.
+        return self.backend.rootSolveCount()
+
+    def root_iter_count(self):
+        # Cumulative iterations of those solves, so root_iter_count() /
+        # root_solve_count() is the mean number of iterations per node.
+        return self.backend.rootIterCount()
+
+    def reset_root_solve_count(self):
+        self.backend.resetRootSolveCount()
+
+    def enable_stats(self, timing=True, maxlen=1000):
+        # Start collecting an IntegratorStats in self.stats. timing switches
+        # on the stage timers, which are process wide (and per thread in the
+        # native library) like the counters behind them.
+        if self.stats is None:
+            self.stats = IntegratorStats(maxlen)
+        set_stats_timing(self.backend, timing)
+        return self.stats
+
+    def disable_stats(self):
+        stats, self.stats = self.stats, None
+        set_stats_timing(self.backend, False)
+        return stats
+
+    def set_phi_predictor(self, predictor):
+        # Midpoint predictor of the backend's phi integrals and the default
+        # of the Python engines; shared by every integrator in the process.
+        mode = PHI_PREDICTORS.index(_phi_predictor(predictor))
+        self.backend.setPhiPredictor(mode)
+        PHI_PREDICTOR['mode'] = PHI_PREDICTORS[mode]
+
+    def set_phi_method(self, method):
+        # Quadrature of the backend's phi integrals (phiInt, fluxG and the r0
+        # integrals built on them) and the default of the Python engines;
+        # process wide like set_phi_predictor.
+        index = PHI_METHODS.index(_phi_method(method))
+        self.backend.setPhiMethod(index)
+        PHI_METHOD['method'] = PHI_METHODS[index]
+
+    def _cache_key(self, kind, params):
+        # Persistent cache key of kind at params: the model parameters and
+        # everything else that moves the result, i.e. the engine version,
+        # the backend and the phi method and predictor, go in with them.
+        params = dict(params, kap = self.kap, thv = self.thv, sig = self.sig, gA = self.gA, k = self.k,
+                      p = self.p, engine = ENGINE_VERSION, backend = self.backend.name,
+                      phi_method = PHI_METHOD['method'], phi_predictor = PHI_PREDICTOR['mode'])
+        return make_key(kind, params)
+
+    def _cached(self, kind, params, compute):
+        if self.cache is None:
+            return compute()
+        return self.cache.fetch(self._cache_key(kind, params), compute, kind)
+
+    def theta_prime(self, r, phi):
+        if np.isscalar(r):
+            return self.thetaPrime(r, self.thv, phi)
+        r = _as_doubles(r)
+        out = np.empty_like(r)
+        self.thetaPrimeBatch(r, r.size, self.thv, phi, out)
+        return out
+
+    def energy_profile(self, thp):
+        if np.isscalar(thp):
+            return self.engProf(thp, self.sig, self.kap)
+        thp = _as_doubles(thp)
+        out = np.empty_like(thp)
+        self.engProfBatch(thp, thp.size, self.sig, self.kap, out)
+        return out
+
+    @_instrumented
     def phi_int(self, r0):
-        return self.phiInt(r0, self.kap, self.thv, self.sig)
+        if self.phi_table is not None:
+            return self.phi_table(r0, self.kap, self.thv)
+        if np.isscalar(r0):
+            return self._cached('phi_int', {'r0': r0},
+                                lambda: self.phiInt(r0, self.kap, self.thv, self.sig))
+        r0 = _as_doubles(r0)
+        out = np.empty_like(r0)
+        self.phiIntBatch(r0, r0.size, self.kap, self.thv, self.sig, out)
+        return out
     
+    # Both r0 integrands take scalars or broadcastable y and r0 arrays; arrays
+    # are evaluated in one batched call (simps_phi_vec, or the native batch
+    # exports) so an outer rule can pass all its nodes at once.
     def _r0_integrand(self, y, r0):
         Gk = (4.0 - self.k)*self.gA**2.0
-        thP0 = self.thetaPrime(r0 / y, self.thv, 0.0)
+        thP0 = self.theta_prime(r0 / y, 0.0)
         exp0 = np.power(np.divide(thP0, self.sig), 2.0*self.kap)
         chiVal = np.divide(y - Gk*np.exp2(-exp0)*(np.tan(self.thv) + r0 / y)**2.0, np.power(y, 5.0 - self.k))
         bG = (1.0 - self.p)/2.0
         ys = np.power(y, 0.5*(bG*(4.0 - self.k) + 4.0 - 3.0*self.k))
         chis = np.power(chiVal, np.divide(7.0*self.k - 23.0 + bG*(13.0 + self.k), 6.0*(4.0 - self.k)))
         factor = np.power((7.0 - 2.0*self.k)*chiVal*np.power(y, 4.0 - self.k) + 1.0, bG - 2.0)
-        return r0*ys*chis*factor*self.simps_phi(r0 / y)
+        if self.phi_table is not None:
+            phi = self.phi_table(r0 / y, self.kap, self.thv)
+        elif np.isscalar(r0 / y):
+            phi = self.simps_phi(r0 / y)
+        else:
+            phi = self.simps_phi_vec(r0 / y)
+        return r0*ys*chis*factor*phi
     
     def _r0_integrand_c(self, y, r0):
-        return self.fluxG(y, r0, self.kap, self.sig, self.thv, self.gA, self.k, self.p)
+        if self.phi_table is not None:
+            return flux_prefactor(y, r0, self.kap, self.sig, self.thv, self.gA, self.k, self.p)*self.phi_int(r0)
+        if np.isscalar(y):
+            if np.isscalar(r0):
+                return self.fluxG(y, r0, self.kap, self.sig, self.thv, self.gA, self.k, self.p)
+            r0 = _as_doubles(r0)
+            out = np.empty_like(r0)
+            self.fluxGBatch(y, r0, r0.size, self.kap, self.sig, self.thv, self.gA, self.k, self.p, out)
+            return out
+        y, r0 = [_as_doubles(a) for a in np.broadcast_arrays(y, r0)]
+        out = np.empty_like(r0)
+        self.fluxGPairBatch(y, r0, r0.size, self.kap, self.sig, self.thv, self.gA, self.k, self.p, out)
+        return out
     
-    def r0_max(self, y):
-        return self.r0Max(y, self.kap, self.sig, self.thv, self.k, self.p, self.gA)
+    def _r0_max_key(self, y):
+        return (float(y), self.kap, self.sig, self.thv, self.k, self.p, self.gA, self.backend.name)
+
+    @_instrumented
+    def r0_max(self, y, mask = False):
+        # -1.0 where nothing emits, or with mask the value (NaN there) and
+        # whether it emits.
+        if np.isscalar(y):
+            key = self._r0_max_key(y)
+            R0MAX = R0_MAX_CACHE.get(key)
+            if R0MAX is None:
+                R0MAX = self._cached('r0_max', {'y': y},
+                                     lambda: self.r0Max(y, self.kap, self.sig, self.thv, self.k, self.p, self.gA))
+                R0_MAX_CACHE.put(key, R0MAX)
+            if mask:
+                return (R0MAX, True) if R0MAX >= 0.0 else (np.nan, False)
+            return R0MAX
+        return self.r0_max_batch(y, mask)
+
+    @_instrumented
+    def r0_max_batch(self, ys, mask = False):
+        # Cached values are reused; the rest are solved in one r0MaxWalk
+        # pass in ascending y order, each root continued from the ones
+        # before. -1.0 where nothing emits, or with mask the values (NaN
+        # there) and the emitting mask.
+        ys = _as_doubles(ys)
+        flat = ys.ravel()
+        keys = [self._r0_max_key(y) for y in flat.tolist()]
+        out = np.empty(flat.shape)
+        missing = []
+        for i, key in enumerate(keys):
+            R0MAX = R0_MAX_CACHE.get(key)
+            if R0MAX is None and self.cache is not None:
+                R0MAX = self.cache.get(self._cache_key('r0_max', {'y': key[0]}))
+                if R0MAX is not None:
+                    R0_MAX_CACHE.put(key, R0MAX)
+            if R0MAX is None:
+                missing.append(i)
+            else:
+                out[i] = R0MAX
+        if missing:
+            missing = np.array(missing)
+            missing = missing[np.argsort(flat[missing], kind='mergesort')]
+            ym = np.ascontiguousarray(flat[missing])
+            vals = np.empty_like(ym)
+            found = np.empty(ym.shape, dtype=np.intc)
+            self.r0MaxWalk(ym, ym.size, self.kap, self.sig, self.thv, self.k, self.p, self.gA, vals, found)
+            vals[found == 0] = -1.0
+            out[missing] = vals
+            for i, R0MAX in zip(missing.tolist(), vals.tolist()):
+                R0_MAX_CACHE.put(keys[i], R0MAX)
+                if self.cache is not None:
+                    self.cache.put(self._cache_key('r0_max', {'y': keys[i][0]}), R0MAX, 'r0_max')
+        out = out.reshape(ys.shape)
+        if mask:
+            emitting = out >= 0.0
+            return np.where(emitting, out, np.nan), emitting
+        return out
     
-    def r0_int(self, y, RMIN):
-        return self.r0IntDE(y, RMIN, self.kap, self.sig, self.thv, self.k, self.p, self.gA)
+    def _budget(self, rtol, atol):
+        # tolerance_budget, or the fixed r0IntDE targets when neither is given.
+        if rtol is None and atol is None:
+            return {'r0_rtol': 0.0, 'r0_atol': 1.0e-5, 'phi_eps': 1.0e-9,
+                    'root_xacc': self.backend.phi_xacc}
+        return tolerance_budget(rtol, atol)
+
+    def _table_error(self, value):
+        # Relative error the phi table adds to an integral built on it.
+        error = self.phi_table.max_error
+        return error*abs(value) if np.isfinite(error) else 0.0
+
+    @_instrumented
+    def r0_int(self, y, RMIN, rtol = None, atol = None, full_output = False, variable = 'linear'):
+        # Without rtol or atol the DE rule runs to 1e-5 absolute with every phi
+        # integral to 1e-9 relative. Given either, tolerance_budget splits the
+        # target across the DE rule, the phi integrals and their roots so the
+        # inner levels are only as accurate as the result needs. variable =
+        # 'log' runs the DE rule over log r0 (see R0_VARIABLES) from Python,
+        # with the phi integrals and roots at the same budget. full_output adds
+        # the budget, the error estimate of the DE rule (plus the table's own
+        # error when a phi_table is used) and the fluxG evaluations it took.
+        # Plain values go through the persistent cache when there is one.
+        variable = _r0_variable(variable, RMIN)
+        if self.cache is not None and self.phi_table is None and not full_output:
+            params = {'y': y, 'RMIN': RMIN, 'rtol': rtol, 'atol': atol, 'variable': variable}
+            return self._cached('r0_int', params, lambda: self._r0_int(y, RMIN, rtol, atol, full_output, variable))
+        return self._r0_int(y, RMIN, rtol, atol, full_output, variable)
+
+    def _log_integrand(self, y, u, phi_eps, xacc):
+        # The r0 integrand in u = log r0, its phi integrals to phi_eps with
+        # roots to xacc (the table's accuracy when there is a phi_table).
+        r0 = np.exp(u)
+        if self.phi_table is not None:
+            return r0*self._r0_integrand_c(y, r0)
+        scalar = np.isscalar(r0)
+        r0 = np.atleast_1d(_as_doubles(r0))
+        out = np.empty_like(r0)
+        self.fluxGBatchTol(y, r0, r0.size, self.kap, self.sig, self.thv, self.gA, self.k, self.p,
+                           phi_eps, xacc, out)
+        out *= r0
+        return out[0] if scalar else out
+
+    def _r0_int(self, y, RMIN, rtol, atol, full_output, variable):
+        budget = self._budget(rtol, atol)
+        evals = read_stats(self.backend)['r0_evals']
+        if variable == 'log':
+            R0MAX = self.r0_max(y)
+            value, err = 0.0, 0.0
+            if R0MAX > 0.0:
+                fun = lambda u: self._log_integrand(y, u, budget['phi_eps'], budget['root_xacc'])
+                value, err = _r0_int_de(fun, np.log(RMIN), np.log(R0MAX), budget['r0_atol'], budget['r0_rtol'])
+                if self.phi_table is not None:
+                    err += self._table_error(value)
+        elif self.phi_table is not None:
+            # Same DE rule and target as r0IntDE, with tabulated phi integrals.
+            R0MAX = self.r0_max(y)
+            value, err = 0.0, 0.0
+            if R0MAX >= 0.0:
+                value, err = _r0_int_de(lambda r0: self._r0_integrand_c(y, r0), RMIN, R0MAX,
+                                        budget['r0_atol'], budget['r0_rtol'])
+                err += self._table_error(value)
+        elif rtol is None and atol is None and not full_output:
+            return self.r0IntDE(y, RMIN, self.kap, self.sig, self.thv, self.k, self.p, self.gA)
+        else:
+            value, err = self.r0IntDETol(y, RMIN, self.kap, self.sig, self.thv, self.k, self.p, self.gA,
+                                         budget['r0_atol'], budget['r0_rtol'], budget['phi_eps'],
+                                         budget['root_xacc'])
+        if full_output:
+            budget['error'] = err
+            budget['evals'] = read_stats(self.backend)['r0_evals'] - evals
+            return value, budget
+        return value
     
-    def r0_int_ct(self, y, RMIN, RMAX):
-        return quad(self.fluxG_ct, RMIN, RMAX, (y, self.kap, self.sig, self.thv, self.k, self.p, self.gA))[0]
+    @classmethod
+    def r0_int_points(cls, y, RMIN, kap, thv, sig, gA, k, p, threads = 0, backend = None):
+        # r0_int for many independent parameter points in one native call. The
+        # arguments broadcast against each other and the result has their
+        # shape; the points are shared out over threads threads (0 for every
+        # core) as each thread comes free, since their costs differ by orders
+        # of magnitude. Failed points are NaN.
+        lib = load_backend(backend)
+        points, shape = _points(y, RMIN, kap, sig, thv, k, p, gA)
+        out = np.empty(len(points))
+        lib.r0IntDEPoints(points, len(points), threads, out)
+        return out.reshape(shape)
+
+    @classmethod
+    def phi_int_points(cls, r0, kap, thv, sig, threads = 0, backend = None):
+        # phi_int over broadcast (r0, kap, thv, sig) points, as r0_int_points.
+        lib = load_backend(backend)
+        points, shape = _points(r0, kap, thv, sig)
+        out = np.empty(len(points))
+        lib.phiIntPoints(points, len(points), threads, out)
+        return out.reshape(shape)
+
+    @_instrumented
+    def r0_int_vec(self, y, RMIN, rtol = None, atol = None, pure = False):
+        # The r0IntDE rule (or the tolerance_budget targets of rtol and atol)
+        # run from Python with every DE level handed to the integrand in one
+        # array call: _r0_integrand_c, or the Python _r0_integrand with pure.
+        # y may be an array, giving an array of integrals.
+        if not np.isscalar(y):
+            ys = _as_doubles(y)
+            return np.array([self.r0_int_vec(yi, RMIN, rtol, atol, pure) for yi in ys.ravel()]).reshape(ys.shape)
+        budget = self._budget(rtol, atol)
+        R0MAX = self.r0_max(y)
+        if R0MAX < 0.0:
+            return 0.0
+        integrand = self._r0_integrand if pure else self._r0_integrand_c
+        return _r0_int_de(lambda r0: integrand(y, r0), RMIN, R0MAX, budget['r0_atol'], budget['r0_rtol'])[0]
+
+    @_instrumented
+    def r0_int_multi(self, y, RMIN, p, k = None, gA = None, rtol = None, atol = None):
+        # r0_int for many spectral and environment parameter sets at once: p,
+        # k and gA (the integrator's own where None) broadcast against each
+        # other and the result has their shape. Only the prefactor of fluxG
+        # depends on them, so the triples sharing k and gA, hence r0_max,
+        # share the DE nodes and every phi integral is computed once for all
+        # of their p. Each triple stops where r0IntDE would, and rtol and atol
+        # budget the DE rule, phi integrals and roots as there, so the values
+        # are those of r0_int.
+        k = self.k if k is None else k
+        gA = self.gA if gA is None else gA
+        triples, shape = _points(p, k, gA)
+        budget = self._budget(rtol, atol)
+        out = np.zeros(len(triples))
+        groups = {}
+        for i, (pi, ki, gAi) in enumerate(triples):
+            groups.setdefault((ki, gAi), []).append(i)
+        for (ki, gAi), idx in groups.items():
+            R0MAX = self.r0Max(y, self.kap, self.sig, self.thv, ki, self.p, gAi)
+            if R0MAX < 0.0:
+                continue
+            ps = triples[idx, 0]
+            def integrand(r0):
+                if self.phi_table is not None:
+                    phi = self.phi_table(r0, self.kap, self.thv)
+                else:
+                    phi = np.empty_like(r0)
+                    self.phiIntBatchTol(r0, r0.size, self.kap, self.thv, self.sig, budget['phi_eps'],
+                                        budget['root_xacc'], phi)
+                pref = flux_prefactor(y, r0[:, np.newaxis], self.kap, self.sig, self.thv, gAi, ki,
+                                      ps[np.newaxis, :])
+                return pref*phi[:, np.newaxis]
+            out[idx] = _r0_int_de_multi(integrand, RMIN, R0MAX, budget['r0_atol'], budget['r0_rtol'])
+        return out.reshape(shape)
+
+    @_instrumented
+    def r0_surrogate(self, y, RMIN, tol = 1.0e-8):
+        # grba_surrogate.ChebSurrogate of _r0_integrand_c(y, r0) on
+        # [RMIN, r0_max(y)], refined until the Chebyshev tail of every piece
+        # is below tol relative to its largest value. Its integral() stands
+        # in for r0_int and calling it for the integrand, so plots and
+        # integrals share one set of fluxG evaluations.
+        from grba_surrogate import ChebSurrogate
+        R0MAX = self.r0_max(y)
+        if not R0MAX > RMIN:
+            raise ValueError("no emitting r0 range: r0_max({}) = {} <= RMIN = {}".format(y, R0MAX, RMIN))
+        return ChebSurrogate.build(lambda r0: self._r0_integrand_c(y, r0), RMIN, R0MAX, tol)
+
+    @_instrumented
+    def flux_curve(self, ys, rmin, tol = 1.0e-8):
+        # r0_int for a whole array of y. fluxG needs the phi integral at r0
+        # itself, so every y draws on the same phi(r0) curve: it is sampled
+        # once over [rmin, max r0_max] (refined until interpolation is good
+        # to tol) and each y is then integrated with the r0IntDE rule.
+        ys = _as_doubles(ys)
+        R0MAX, emitting = self.r0_max_batch(ys, mask = True)
+        out = np.zeros(ys.shape)
+        if not np.any(emitting):
+            return out
+        table = self.phi_table
+        if table is None:
+            from grba_table import PhiTable
+            table = PhiTable.refine(rmin, np.max(R0MAX[emitting]), self.kap, self.thv, self.sig,
+                                    tol = tol, backend = self.backend)
+        for i in zip(*np.nonzero(emitting)):
+            y = ys[i]
+            fun = lambda r0: flux_prefactor(y, r0, self.kap, self.sig, self.thv, self.gA, self.k, self.p)*table(r0, self.kap, self.thv)
+            out[i] = _r0_int_de(fun, rmin, R0MAX[i])[0]
+        return out
+
+    @_instrumented
+    def r0_int_ct(self, y, RMIN, RMAX, rtol = None, atol = None, full_output = False, variable = 'linear'):
+        # quad over [RMIN, RMAX] with its default targets, or with the r0 part
+        # of tolerance_budget(rtol, atol) and the phi integrals and roots
+        # loosened to match. variable is as for r0_int; over log r0 quad
+        # calls fluxG from Python. full_output is as for r0_int, with quad's
+        # error estimate; plain values are cached as there.
+        variable = _r0_variable(variable, RMIN, RMAX)
+        if self.cache is not None and self.phi_table is None and not full_output:
+            params = {'y': y, 'RMIN': RMIN, 'RMAX': RMAX, 'rtol': rtol, 'atol': atol, 'variable': variable}
+            return self._cached('r0_int_ct', params,
+                                lambda: self._r0_int_ct(y, RMIN, RMAX, rtol, atol, full_output, variable))
+        return self._r0_int_ct(y, RMIN, RMAX, rtol, atol, full_output, variable)
+
+    def _flux_quad(self, args):
+        # quad's integrand and args for fluxG_ct with args: on the native
+        # library a LowLevelCallable of fluxWrap_ud whose user_data block
+        # holds args and the phi tolerances, so QUADPACK calls straight into
+        # it; fluxG_ct itself where that is unavailable or lowlevel is off.
+        if not self.lowlevel or LowLevelCallable is None or self.backend.name != 'native':
+            return self.fluxG_ct, args
+        # args is (y, kap, sig, thv, k, p, gA), plus (phiEps, xacc) when a
+        # budget set them.
+        tols = args[7:] or (1.0e-9, self.backend.phi_xacc)
+        assert len(tols) == 2
+        block = (c_double*9)(*(args[:7] + tols))
+        # cast keeps block alive with the pointer.
+        return LowLevelCallable(self.backend.fluxWrap_ud, cast(block, c_void_p)), ()
+
+    def _r0_int_ct(self, y, RMIN, RMAX, rtol, atol, full_output, variable):
+        evals = read_stats(self.backend)['r0_evals']
+        args = (y, self.kap, self.sig, self.thv, self.k, self.p, self.gA)
+        if rtol is None and atol is None:
+            budget = {'r0_rtol': 1.49e-8, 'r0_atol': 1.49e-8, 'phi_eps': 1.0e-9,
+                      'root_xacc': self.backend.phi_xacc}
+            tols = {}
+        else:
+            budget = tolerance_budget(rtol, atol)
+            tols = {'epsabs': budget['r0_atol'], 'epsrel': budget['r0_rtol']}
+            args += (budget['phi_eps'], budget['root_xacc'])
+        if variable == 'log':
+            fun = lambda u: self._log_integrand(y, u, budget['phi_eps'], budget['root_xacc'])
+            value, err = _r0_int_quad(fun, np.log(RMIN), np.log(RMAX), **tols)
+            if self.phi_table is not None:
+                err += self._table_error(value)
+        elif self.phi_table is not None:
+            value, err = _r0_int_quad(lambda r0: self._r0_integrand_c(y, r0), RMIN, RMAX, **tols)
+            err += self._table_error(value)
+        else:
+            fun, args = self._flux_quad(args)
+            value, err = _r0_int_quad(fun, RMIN, RMAX, args, **tols)
+        if full_output:
+            budget['error'] = err
+            budget['evals'] = read_stats(self.backend)['r0_evals'] - evals
+            return value, budget
+        return value
 
 if __name__ == '__main__':
     import timeit
     SIGMA = 2.0
-    title = "|   Y   |  KAP   |  THV  |  TIME(s)    |"
+    title = "|   Y   |  KAP   |  THV  |  R0MAX  |"
+    print "backend: {}".format(load_backend().name)
     print title
     print "-"*len(title)
     for Y in [0.001, 0.1, 0.5, 0.9, 0.999]:
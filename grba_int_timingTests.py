@@ -11,6 +11,7 @@ from scipy.optimize import root, fsolve, brentq
 from scipy.integrate import quad, romberg, quadrature, simps
 from math import radians, degrees
 from grba_int import *
+from grba_sweep import GridSpec, sweep_to_file, load_sweep, iter_records
 
 mpl.rcParams['font.family'] = 'sans-serif'
 mpl.rcParams['font.sans-serif'] = 'Helvetica Neue UltraLight'
@@ -27,13 +28,9 @@ mpl.rcParams['legend.numpoints'] = 1
 # plt.style.use('seaborn-whitegrid')
 sns.set_style('ticks', {'legend.frameon': True})
 
-grbaint = cdll.LoadLibrary("Release/grba_integration.dll")
+grbaint = native_backend()
 thp = grbaint.thetaPrime
-thp.restype = c_double
-thp.argtypes = [c_double, c_double, c_double]
 engProf = grbaint.energyProfile
-engProf.restype = c_double
-engProf.argtypes = [c_double, c_double, c_double]
 
 def thetaPrime(r, thv, phi):
     # top = r*(np.cos(thv)**2.0 - 0.25*np.sin(2.0*thv)**2.0*np.cos(phi)**2.0)**2.0
@@ -41,6 +38,7 @@ def thetaPrime(r, thv, phi):
     # return np.divide(top, bot)
     return thp(r, thv, phi)
 
+@memoize()
 def r0_max(y, kap, sig, thv, gA = 1.0, k = 0.0, p = 2.2):
     Gk = (4.0 - k)*gA**2.0
     def rootR0(rm):
@@ -78,54 +76,63 @@ def intG(y, chi, k = 0.0, p = 2.2):
     factor = np.power((7.0 - 2.0*k)*chi*np.power(y, 4.0 - k) + 1.0, bG - 2.0)
     return ys*chis*factor
 
-def root_test():
-    TINY = np.power(10.0, -9.0)
+# Records of the sweeps below; thv in degrees.
+ROOT_TIMING_DTYPE = np.dtype([('y', 'f8'), ('kap', 'f8'), ('thv', 'f8'), ('r0', 'f8'),
+                              ('method', 'S6'), ('c', 'i4'), ('time', 'f8')])
+PHI_INTEGRAND_DTYPE = np.dtype([('y', 'f8'), ('kap', 'f8'), ('thv', 'f8'), ('r0', 'f8'),
+                                ('value', 'f8'), ('r0max', 'f8')])
+
+ROOT_TINY = np.power(10.0, -9.0)
+PHI_TINY = 1.0e-3
+ROOT_METHODS = ['root', 'fsolve']
+
+def root_timing_point(grb, YVAL, KAP, THV):
+    # Mean time (3x100 runs) of the r' roots along 8 phis, for 10 r0 in
+    # [ROOT_TINY, r0_max] and each of ROOT_METHODS.
+    SIGMA = grb.sig
+    THETA_V = radians(THV)
+    R0MAX = r0_max(YVAL, KAP, SIGMA, THETA_V)
+    if not R0MAX > 0.0:
+        return np.zeros(0, dtype=ROOT_TIMING_DTYPE)
+    r0s = np.linspace(0.0, R0MAX, num = 10)
+    r0s[0] = ROOT_TINY
+    out = np.zeros(len(r0s)*len(ROOT_METHODS), dtype=ROOT_TIMING_DTYPE)
+    i = 0
+    for R0 in r0s:
+        G = R0
+        for c, m in enumerate(ROOT_METHODS):
+            def test_rP_roots(G=G, R0=R0, KAP=KAP, SIGMA=SIGMA, THETA_V=THETA_V, m=m):
+                phis = np.linspace(0.0, 2.0*np.pi, num = 8)
+                for PHI in phis:
+                    if m == 'fsolve':
+                        RP = fsolve(root_fun, G,
+                                    args = (R0, PHI, KAP, SIGMA, THETA_V),
+                                    fprime=root_jac)[0]
+                    else:
+                        RP = root(root_fun, G,
+                                    args = (R0, PHI, KAP, SIGMA, THETA_V),
+                                    jac = root_jac).x[0]
+                    G = RP
+            t = np.mean(timeit.Timer(test_rP_roots).repeat(3, 100))
+            out[i] = (YVAL, KAP, THV, R0, m, c, t)
+            i += 1
+    return out
+
+def root_test(path = "rPrime_Root_Timing.npy"):
+    # The timings are streamed to path as they are made (serially, so they
+    # do not compete for the CPU) and the plots read them back from it.
+    TINY = ROOT_TINY
     SIGMA = 2.0
-    for YVAL in [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]:
-    # for YVAL in [0.5]:
-        ms = []
-        ts = []
-        rs = []
-        ks = []
-        ths = []
-        cs = []
-        for KAP in [0.0, 1.0, 10.0]:
-            for THV in [1.0, 2.0, 6.0]:
-                THETA_V = radians(THV)
-                R0MAX = r0_max(YVAL, KAP, SIGMA,THETA_V)
-                if R0MAX > 0.0:
-                    r0s = np.linspace(0.0, R0MAX, num = 10)
-                    r0s[0] = TINY
-                    for R0 in r0s:
-                        G = R0
-                        for c, m in enumerate(['root', 'fsolve']):
-                            def test_rP_roots(G=G, R0=R0, KAP=KAP, SIGMA=SIGMA, THETA_V=THETA_V, m=m):
-                                phis = np.linspace(0.0, 2.0*np.pi, num = 8)
-                                for PHI in phis:
-                                    if m == 'fsolve':
-                                        RP = fsolve(root_fun, G,
-                                                    args = (R0, PHI, KAP, SIGMA, THETA_V),
-                                                    fprime=root_jac)[0]
-                                    else:
-                                        RP = root(root_fun, G,
-                                                    args = (R0, PHI, KAP, SIGMA, THETA_V),
-                                                    jac = root_jac).x[0]
-                                    G = RP
-                            # t = timeit.timeit("test_rP_roots()", setup="from __main__ import test_rP_roots")
-                            t = np.mean(timeit.Timer("test_rP_roots()", setup="from __main__ import test_rP_roots").repeat(3, 100))
-                            # print KAP, THETA_V, R0, m, t
-                            ms.append(m)
-                            rs.append(R0)
-                            ts.append(t)
-                            ks.append(KAP)
-                            ths.append(THV)
-                            cs.append(c)
+    YVALS = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+    spec = GridSpec(YVALS, [0.0, 1.0, 10.0], [1.0, 2.0, 6.0], sig = SIGMA,
+                    quantity = root_timing_point, dtype = ROOT_TIMING_DTYPE)
+    sweep_to_file(spec, path, max_workers = 1)
+    records = load_sweep(path)
+    for YVAL in YVALS:
         print YVAL
-        data = [rs, ms, ks, ths, ts, cs]
-        df = pd.DataFrame(data)
-        df = df.transpose()
-        cols = ['R0', 'Method', 'Kappa', 'ThetaV', 'Time', 'C']
-        df.columns = cols
+        df = pd.DataFrame.from_records(np.array(records[records['y'] == YVAL]))
+        df = df.rename(columns = {'r0': 'R0', 'method': 'Method', 'kap': 'Kappa', 'thv': 'ThetaV',
+                                  'time': 'Time', 'c': 'C'})
         # df = df.round({'R0P': 3})
         g = sns.FacetGrid(df, col='Kappa', row='ThetaV', hue='Method', sharex=False,
                                 palette = sns.color_palette("Set1", n_colors=2),
@@ -151,60 +158,34 @@ def root_test():
         # plt.show()
         plt.savefig("rPrime_Root_Timing(y={a}_r0'min={b}).pdf".format(a=YVAL, b=TINY), format="pdf", dpi=1200)
 
-def main():
+def phi_integrand_point(grb, YVAL, KAP, THV):
+    # grb._r0_integrand at 100 r0 in [PHI_TINY, r0_max].
+    R0MAX = r0_max(YVAL, KAP, grb.sig, radians(THV))
+    if not R0MAX > 0.0:
+        return np.zeros(0, dtype=PHI_INTEGRAND_DTYPE)
+    r0s = np.linspace(0.0, R0MAX, 100)  # num = 2**order + 1
+    r0s[0] = PHI_TINY
+    out = np.zeros(len(r0s), dtype=PHI_INTEGRAND_DTYPE)
+    for i, R0 in enumerate(r0s):
+        # val = grb.simps_phi(R0) / np.pi
+        out[i] = (YVAL, KAP, THV, R0, grb._r0_integrand(YVAL, R0), R0MAX)
+    return out
+
+def main(path = "phiIntegrand.npy"):
     def vertical_line(x, **kwargs):
         uniques = x.unique()
         for x in np.nditer(uniques):
             plt.axvline(x = x, **kwargs)
     
-    order = 5
-    TINY = 1.0e-3
+    TINY = PHI_TINY
     SIGMA = 2.0
-    ys = []
-    ks = []
-    ts = []
-    rs = []
-    rms = []
-    vs = []
-    for YVAL in [TINY, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0 - TINY]:
-    # for YVAL in [0.5]:
-        for KAP in [0.0, 1.0, 10.0]:
-            for THV in [0.0, 1.0, 2.0, 6.0]:
-                print YVAL, KAP, THV
-                THETA_V = radians(THV)
-                R0MAX = r0_max(YVAL, KAP, SIGMA,THETA_V)
-                if R0MAX > 0.0:
-                    grb = GrbaIntegrator(KAP, THETA_V, SIGMA, 1.0, 0.0, 2.2)
-                    r0s = np.linspace(0.0, R0MAX, 100)  # num = 2**order + 1
-                    # vals = []
-                    # vals.append(0.0)
-                    # for R0 in r0s[1:]:
-                        # val = grb._r0_integrand(YVAL, R0)
-                        # val_c = grb._r0_integrand_c(YVAL, R0)
-                        # err = np.abs(val - val_c) / val_c * 100.0
-                        # if err > 1.0e-11:
-                            # print YVAL, KAP, THV, R0, err
-                        # vals.append(val)
-                    
-                    # val = simps(vals, r0s)
-                    # print YVAL, KAP, THV, val
-                    r0s[0] = TINY
-                    for R0 in r0s:
-                        # val = grb.simps_phi(R0) / np.pi
-                        val = grb._r0_integrand(YVAL, R0)
-                        # val = R0**2.0
-                        ys.append(YVAL)
-                        ks.append(KAP)
-                        ts.append(THV)
-                        rs.append(R0)
-                        vs.append(val)
-                        rms.append(R0MAX)
-    
-    data = [rs, vs, ks, ts, ys, rms]
-    df = pd.DataFrame(data)
-    df = df.transpose()
-    cols = ['R0', 'PhiInt', 'Kappa', 'ThetaV', 'Y', 'R0MAX']
-    df.columns = cols
+    spec = GridSpec([TINY, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0 - TINY], [0.0, 1.0, 10.0], [0.0, 1.0, 2.0, 6.0],
+                    sig = SIGMA, gA = 1.0, k = 0.0, p = 2.2,
+                    quantity = phi_integrand_point, dtype = PHI_INTEGRAND_DTYPE)
+    sweep_to_file(spec, path)
+    df = pd.concat([pd.DataFrame.from_records(part) for part in iter_records(path)], ignore_index = True)
+    df = df.rename(columns = {'r0': 'R0', 'value': 'PhiInt', 'kap': 'Kappa', 'thv': 'ThetaV',
+                              'y': 'Y', 'r0max': 'R0MAX'})
     df['PhiInt'] = df['PhiInt'].apply(np.log10)
     df['R0'] = df['R0'].apply(np.log10)
     g = sns.FacetGrid(df, col='Kappa', row='ThetaV', hue='Y', sharex=False,
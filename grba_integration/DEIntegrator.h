@@ -33,6 +33,37 @@ public:
             c, 
             d, 
             targetAbsoluteError, 
+            0.0,
+            numFunctionEvaluations, 
+            errorEstimate, 
+            doubleExponentialAbcissas, 
+            doubleExponentialWeights
+        );
+    }
+
+    /*! Integrate an analytic function over a finite interval, stopping once the error
+        estimate is below either target. @return The value of the integral. */
+    static double Integrate
+    (
+        const TFunctionObject& f,       //!< [in] integrand
+        double a,                       //!< [in] left limit of integration
+        double b,                       //!< [in] right limit of integration
+        double targetAbsoluteError,     //!< [in] desired bound on error
+        double targetRelativeError,     //!< [in] desired bound on error relative to the integral
+        int& numFunctionEvaluations,    //!< [out] number of function evaluations used
+        double& errorEstimate           //!< [out] estimated error in integration
+    )
+    {
+        double c = 0.5*(b - a);
+        double d = 0.5*(a + b);
+
+        return IntegrateCore
+        (
+            f, 
+            c, 
+            d, 
+            targetAbsoluteError, 
+            targetRelativeError,
             numFunctionEvaluations, 
             errorEstimate, 
             doubleExponentialAbcissas, 
@@ -76,6 +107,7 @@ private:
         double c,   // slope of change of variables
         double d,   // intercept of change of variables
         double targetAbsoluteError,
+        double targetRelativeError,
         int& numFunctionEvaluations,
         double& errorEstimate,
         const double* abcissas,
@@ -140,7 +172,7 @@ private:
                 errorEstimate = currentDelta;
             }
 
-            if (errorEstimate < 0.1*targetAbsoluteError)
+            if (errorEstimate < 0.1*targetAbsoluteError || errorEstimate < 0.1*targetRelativeError*fabs(integral))
                 break;
         }
         
@@ -1,12 +1,27 @@
 #define _USE_MATH_DEFINES
+#ifdef _WIN32
 #define DLLEXPORT extern "C" __declspec(dllexport)
+#else
+#define DLLEXPORT extern "C" __attribute__((visibility("default")))
+#define printf_s printf
+#endif
 #include <cmath>
+#include <cstdlib>
 #include <iostream>
 #include <fstream>
 #include <stdio.h>
+#ifdef _WIN32
 #include <conio.h>
+#endif
 #include <vector>
+#include <chrono>
+#include <algorithm>
+#include <atomic>
+#include <mutex>
+#include <thread>
+#ifndef GRBA_NO_CMINPACK
 #include "cminpack.h"
+#endif
 #include "DEIntegrator.h"
 
 const double TORAD = M_PI / 180.0;
@@ -21,23 +36,49 @@ class RootFuncPhi;
 //void testRootSolve();
 int fcn(void *p, int n, const double *x, double *fvec, double *fjac, int ldfjac, int iflag);
 double rootPhi(RootFuncPhi& func, const double g, const double xacc);
-double simpsPhi(params& ps, const double r0, const double a, const double b, const double eps = 1.0e-9);
+double simpsPhi(params& ps, const double r0, const double a, const double b, const double eps = 1.0e-9, const int nmin = 3, const double xacc = 1.0e-9);
+double phiIntegral(params& ps, const double r0, const double eps = 1.0e-9, const double xacc = 1.0e-9);
 void testSimpsPhi();
 DLLEXPORT double phiInt(const double r0, const double kap, const double thv, const double sig);
 double intG(double y, double chi, const double k, const double p);
-DLLEXPORT double fluxG(params& ps, const double y, const double r0);
+DLLEXPORT double fluxG(params& ps, const double y, const double r0, const double phiEps = 1.0e-9, const double xacc = 1.0e-9);
 DLLEXPORT double fluxWrap(double y, double r0, const double kap, const double sig, const double thv, const double gA, const double k, const double p);
-DLLEXPORT double fluxWrap_ct(int n, double args[8]);
+// args holds n = 8 doubles (r0, y, kap, sig, thv, k, p, gA), or n = 10 with
+// the phi Simpson eps and root tolerance appended.
+DLLEXPORT double fluxWrap_ct(int n, const double *args);
+DLLEXPORT double fluxWrap_ud(double r0, void *userData);
 void testPhiInt();
 double milneR0(params& ps, const double y, const double a, const double b, const double eps = 1.0e-7);
 DLLEXPORT double r0Int(double y, double r0Min, double r0Max, const double kap, const double sig, const double thv, const double gA, const double k, const double p);
 void testR0Int();
 struct RootFuncR0;
 double rtsafeR0(RootFuncR0& func, const double x1, const double x2, const double xacc);
+double rtsafeR0(RootFuncR0& func, const double x1, const double x2, const double fl, const double fh, const double x0, const double xacc);
 
 class GrbaIntegrator;
 DLLEXPORT double r0Max(double y, const double kap, const double sig, const double thv, const double k, const double p, const double gA);
 DLLEXPORT double r0IntDE(double y, const double RMIN, const double kap, const double sig, const double thv, const double k, const double p, const double gA);
+DLLEXPORT double r0IntDETol(double y, const double RMIN, const double kap, const double sig, const double thv, const double k, const double p, const double gA, const double atol, const double rtol, const double phiEps, const double xacc, double *errEst);
+DLLEXPORT void thetaPrimeBatch(const double *r, const int n, const double thv, const double phi, double *out);
+DLLEXPORT long long rootSolveCount();
+DLLEXPORT long long rootIterCount();
+DLLEXPORT void resetRootSolveCount();
+DLLEXPORT void setPhiPredictor(const int mode);
+DLLEXPORT void setPhiMethod(const int method);
+struct GrbaStats;
+DLLEXPORT void readStats(GrbaStats *out);
+DLLEXPORT void resetStats();
+DLLEXPORT void setStatsTiming(const int on);
+DLLEXPORT void energyProfileBatch(const double *thp, const int n, const double sig, const double kap, double *out);
+DLLEXPORT void phiIntBatch(const double *r0, const int n, const double kap, const double thv, const double sig, double *out);
+DLLEXPORT void phiIntBatchTol(const double *r0, const int n, const double kap, const double thv, const double sig, const double eps, const double xacc, double *out);
+DLLEXPORT void fluxWrapBatch(const double y, const double *r0, const int n, const double kap, const double sig, const double thv, const double gA, const double k, const double p, double *out);
+DLLEXPORT void fluxWrapPairBatch(const double *y, const double *r0, const int n, const double kap, const double sig, const double thv, const double gA, const double k, const double p, double *out);
+DLLEXPORT void fluxWrapBatchTol(const double y, const double *r0, const int n, const double kap, const double sig, const double thv, const double gA, const double k, const double p, const double phiEps, const double xacc, double *out);
+DLLEXPORT void r0MaxBatch(const double *y, const int n, const double kap, const double sig, const double thv, const double k, const double p, const double gA, double *out);
+DLLEXPORT void r0MaxWalk(const double *y, const int n, const double kap, const double sig, const double thv, const double k, const double p, const double gA, double *out, int *found);
+DLLEXPORT void r0IntDEPoints(const double *points, const int n, const int nthreads, double *out);
+DLLEXPORT void phiIntPoints(const double *points, const int n, const int nthreads, double *out);
 
 int main(void)
 {
@@ -94,6 +135,46 @@ DLLEXPORT double energyProfile(double thp, double sig, double kap) {
 //    }
 //};
 
+// Per-thread instrumentation, read with readStats(). The counters are always
+// kept; the stage timers (seconds) only run after setStatsTiming(1). r0Time
+// covers whole r0 integrals, so it includes the phi integrals inside them.
+struct GrbaStats {
+    long long rootSolves;       // phi root solves
+    long long rootIters;        // their iterations (function evaluations for cminpack)
+    long long phiIntegrals;     // phi integrals, closed forms included
+    long long simpsonLevels;    // Simpson levels reached, summed over the integrals
+    long long r0MaxSolves;
+    long long r0Integrals;      // r0IntDE integrals
+    long long r0Evals;          // their integrand evaluations
+    double r0Error;             // and summed DE error estimates
+    double r0MaxTime;
+    double phiTime;
+    double r0Time;
+};
+
+static thread_local GrbaStats STATS = {};
+// The settings below are read by runPoints workers while another thread may
+// set them, so they are atomic; each phi integral reads them once.
+static std::atomic<int> STATS_TIMING(0);
+
+// Adds the lifetime of the object to total when timing is on.
+class StageTimer
+{
+public:
+    StageTimer(double &TOTAL) : total(TOTAL), on(STATS_TIMING != 0) {
+        if (on) start = std::chrono::steady_clock::now();
+    }
+
+    ~StageTimer() {
+        if (on) total += std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+    }
+
+private:
+    double &total;
+    const bool on;
+    std::chrono::steady_clock::time_point start;
+};
+
 class RootFuncPhi
 {
 public:
@@ -112,12 +193,20 @@ public:
     }
 
     double df(double r) {
+        return std::abs(dfSigned(r));
+    }
+
+    // dr'/dphi along the root, -f_phi / f_r by the implicit function theorem.
+    double slope(double r) {
+        double tv = tan(thv), s2 = sin(2.0*thv);
         double thp = thetaPrime(r, thv, phi);
-        double first = r + tan(thv)*cos(phi);
-        double second = pow(r, 2) + 2.0*r*tan(thv)*cos(phi) + pow(tan(thv), 2);
-        double frac = (kap*log(2.0)*pow(thp / sig, 2.0*kap)) / (r*(1.0 + 0.5*r*sin(2.0*thv)*cos(phi)));
-        double exponent = 2.0*energyProfile(thp, sig, kap);
-        return std::abs((first - second*frac)*exponent);
+        double q = kap*log(2.0)*pow(thp / sig, 2.0*kap);
+        double S = pow(r, 2) + 2.0*r*tv*cos(phi) + pow(tv, 2);
+        double D = 1.0 + 0.5*r*s2*cos(phi);
+        double A = pow(cos(thv), 2) - 0.25*pow(s2*cos(phi), 2);
+        double dLogThp = 0.25*pow(s2, 2)*sin(phi)*cos(phi) / A + 0.5*r*s2*sin(phi) / D;
+        double fPhi = -2.0*energyProfile(thp, sig, kap)*(r*tv*sin(phi) + q*S*dLogThp);
+        return -fPhi / dfSigned(r);
     }
 
     const double phiVal() {
@@ -126,8 +215,27 @@ public:
 
 private:
     const double phi, r0, kap, sig, thv;
+
+    double dfSigned(double r) {
+        double thp = thetaPrime(r, thv, phi);
+        double first = r + tan(thv)*cos(phi);
+        double second = pow(r, 2) + 2.0*r*tan(thv)*cos(phi) + pow(tan(thv), 2);
+        double frac = (kap*log(2.0)*pow(thp / sig, 2.0*kap)) / (r*(1.0 + 0.5*r*sin(2.0*thv)*cos(phi)));
+        double exponent = 2.0*energyProfile(thp, sig, kap);
+        double thp0 = thetaPrime(r, thv, 0.0);
+        double frac0 = (kap*log(2.0)*pow(thp0 / sig, 2.0*kap)) / (r*(1.0 + 0.5*r*sin(2.0*thv)));
+        double exponent0 = 2.0*energyProfile(thp0, sig, kap);
+        return (first - second*frac)*exponent + pow(r0 + tan(thv), 2)*frac0*exponent0;
+    }
 };
 
+// Exact root of the kap = 0 problem, a good starting point for any kap.
+double phiRootGuess(const double r0, const double phi, const double thv) {
+    double tv = tan(thv);
+    return sqrt(pow(r0 + tv, 2) - pow(tv*sin(phi), 2)) - tv*cos(phi);
+}
+
+#ifndef GRBA_NO_CMINPACK
 int fcn(void *p, int n, const double *x, double *fvec, double *fjac, int ldfjac, int iflag)
 {
     /*      subroutine fcn for hybrj example. */
@@ -136,6 +244,7 @@ int fcn(void *p, int n, const double *x, double *fvec, double *fjac, int ldfjac,
     if (iflag != 2)
     {
         fvec[0] = ((RootFuncPhi*)p)->f(x[0]);
+        STATS.rootIters++;
     }
     else
     {
@@ -169,6 +278,32 @@ double rootPhi(RootFuncPhi& func, double g, const double xacc) {
 
     return (double)x[0];
 };
+#else
+// Portable replacement for the cminpack solver: Newton steps from the
+// guess g, where df is |f'| so every step heads for the root at positive r'.
+// Steps that would leave r' <= 0 are replaced by halving and steps near a
+// vanishing derivative are capped at a tenfold increase.
+double rootPhi(RootFuncPhi& func, double g, const double xacc) {
+    const int MAXIT = 100;
+    double r = g;
+    for (int j = 0; j < MAXIT; j++) {
+        STATS.rootIters++;
+        double dx = func.f(r) / func.df(r);
+        double rn = r - dx;
+        if (!(rn > 0.0)) {
+            r *= 0.5;
+            continue;
+        }
+        if (!(rn < 10.0*r)) {
+            r *= 10.0;
+            continue;
+        }
+        r = rn;
+        if (std::abs(dx) <= xacc*r) return r;
+    }
+    throw("Maximum number of iterations exceeded in rootPhi");
+};
+#endif
 
 //double rtnewtPhi(RootFuncPhi& func, const double g, const double xacc) {
 //    const int JMAX = 20;
@@ -308,36 +443,88 @@ double rootPhi(RootFuncPhi& func, double g, const double xacc) {
 //    throw("Maximum number of iterations exceeded in simpsPhi");
 //}
 
-double simpsPhi(params& ps, const double r0, const double a, const double b, const double eps) {
+// How simpsPhi guesses the roots at new midpoints after the first level:
+// 0 from the mean of the roots either side, 1 from a cubic Hermite predictor
+// through those roots and their slopes dr'/dphi.
+static std::atomic<int> PHI_PREDICTOR(1);
+
+// Quadrature simpsPhi returns: 0 composite Simpson, 1 the trapezoid sums themselves.
+// The integrand is smooth and periodic, and even about 0 and pi, so the trapezoid
+// rule on [0, pi] converges exponentially where Simpson is only algebraic.
+static std::atomic<int> PHI_METHOD(0);
+
+// Default root tolerance. Roots have to be well inside the Simpson tolerance or
+// the level-to-level change never settles below eps.
+const double PHI_XACC = 1.0e-9;
+
+// Simpson's rule built from successive trapezoid refinements, S_2n = (4 T_2n - T_n) / 3,
+// so each level only solves the roots at the new midpoints. Level n has 2^(n-1)
+// intervals; Simpson sums start at level nmin and are compared from the next one.
+// f(a) = 1 when a is a multiple of 2 pi since r' = r0 there; other endpoints are
+// solved for, all roots to a relative xacc. The first midpoint starts from the
+// kap = 0 root, later ones as set by PHI_PREDICTOR. PHI_METHOD = 1 compares and
+// returns the trapezoid sums instead of the Simpson ones.
+double simpsPhi(params& ps, const double r0, const double a, const double b, const double eps, const int nmin, const double xacc) {
     const int NMAX = 25;
-    double sum, osum = 0.0;
-    for (int n = 3; n < NMAX; n++) {
-        int it, j;
-        double h, s, x, g, tnm;
-        for (it = 2, j = 1; j<n - 1; j++) it <<= 1;
-        tnm = it;
-        h = (b - a) / tnm;
-        s = 2.0;
-        g = r0;
-        x = a;
-        //printf("SimpsPhi: Nsteps = %d, step size = %02.3e, starting guess = %02.3e \n", it, h, g);
-        for (int i = 1; i < it; i++, x += h) {
-            RootFuncPhi rfunc(x, r0, ps);
-            double rp = rootPhi(rfunc, g, 1.0e-5);
-            g = rp;
-            double fx = pow(rp / r0, 2.0);
-            if (i % 2) {
-                s += 4.0*fx;
+    const bool tangent = PHI_PREDICTOR == 1;
+    const bool trapezoid = PHI_METHOD == 1;
+    std::vector<double> roots(2, r0), slopes(2, 0.0), next, nextSlopes;
+    for (int e = 0; e < 2; e++) {
+        double x = e ? b : a;
+        RootFuncPhi rfunc(x, r0, ps);
+        if (std::fmod(x, 2.0*M_PI) != 0.0) {
+            roots[e] = rootPhi(rfunc, phiRootGuess(r0, x, ps.THV), xacc);
+            STATS.rootSolves++;
+        }
+        slopes[e] = rfunc.slope(roots[e]);
+    }
+    double trap = 0.5*(b - a)*(pow(roots[0] / r0, 2.0) + pow(roots[1] / r0, 2.0)), otrap, sum, osum = 0.0;
+    for (int m = 1; m < NMAX; m++) {
+        int it = 1 << (m - 1);
+        double h = (b - a) / (2 * it);
+        double s = 0.0;
+        next.resize(2 * it + 1);
+        if (tangent && m > 1) {
+            // Slopes of the previous level's midpoints, only once a level needs them.
+            for (int k = 1; k < it; k += 2) {
+                RootFuncPhi rfunc(a + 2 * k*h, r0, ps);
+                slopes[k] = rfunc.slope(roots[k]);
+            }
+        }
+        for (int j = 0; j < it; j++) {
+            double x = a + (2 * j + 1)*h;
+            double g = 0.5*(roots[j] + roots[j + 1]);
+            if (m == 1) {
+                g = phiRootGuess(r0, x, ps.THV);
             }
-            else {
-                s += 2.0*fx;
+            else if (tangent) {
+                double gh = g + 0.25*h*(slopes[j] - slopes[j + 1]);
+                if (gh > 0.0) g = gh;
             }
+            RootFuncPhi rfunc(x, r0, ps);
+            double rp = rootPhi(rfunc, g, xacc);
+            STATS.rootSolves++;
+            next[2 * j] = roots[j];
+            next[2 * j + 1] = rp;
+            s += pow(rp / r0, 2.0);
+        }
+        next[2 * it] = roots[it];
+        roots.swap(next);
+        if (tangent) {
+            nextSlopes.resize(2 * it + 1);
+            for (int j = 0; j <= it; j++) nextSlopes[2 * j] = slopes[j];
+            slopes.swap(nextSlopes);
         }
-        //system("pause");
-        sum = s*h / 3.0;
-        if (n > 3)
+        otrap = trap;
+        trap = 0.5*trap + h*s;
+        int n = m + 1;
+        if (n < nmin) continue;
+        sum = trapezoid ? trap : (4.0*trap - otrap) / 3.0;
+        if (n > nmin)
             if (std::abs(sum - osum) < eps*std::abs(osum) || (sum == 0.0 && osum == 0.0)) {
-                //std::cout << "n = " << n << ",\tNum Steps = " << it << ",\tSum = " << sum << std::endl;
+                // Counted on the scale of the Python engines, whose levels have
+                // 2^(n-1) intervals over [0, 2 pi].
+                STATS.simpsonLevels += n + std::lround(std::log2(2.0*M_PI / (b - a)));
                 return sum;
             }
         osum = sum;
@@ -345,9 +532,55 @@ double simpsPhi(params& ps, const double r0, const double a, const double b, con
     throw("Maximum number of iterations exceeded in simpsPhi");
 }
 
+// The phi integral over [0, 2 pi]. The root equation only sees cos(phi), so the
+// integrand is symmetric about pi and [0, pi] is integrated and doubled. For
+// kap = 0, r' = sqrt((r0 + tan thv)^2 - (tan thv sin phi)^2) - tan thv cos phi and
+// the integral is 2 pi (1 + tan thv / r0)^2, which is 2 pi for thv = 0 at any kap.
+// Starting the half range one level lower keeps the steps of the full-range rule.
+double phiIntegral(params& ps, const double r0, const double eps, const double xacc) {
+    StageTimer timer(STATS.phiTime);
+    STATS.phiIntegrals++;
+    if (ps.KAP == 0.0 || ps.THV == 0.0)
+        return 2.0*M_PI*pow(1.0 + tan(ps.THV) / r0, 2.0);
+    return 2.0*simpsPhi(ps, r0, 0.0, M_PI, eps, 2, xacc);
+}
+
+DLLEXPORT long long rootSolveCount() {
+    return STATS.rootSolves;
+}
+
+DLLEXPORT long long rootIterCount() {
+    return STATS.rootIters;
+}
+
+DLLEXPORT void resetRootSolveCount() {
+    STATS.rootSolves = 0;
+    STATS.rootIters = 0;
+}
+
+DLLEXPORT void readStats(GrbaStats *out) {
+    *out = STATS;
+}
+
+DLLEXPORT void resetStats() {
+    STATS = GrbaStats();
+}
+
+DLLEXPORT void setStatsTiming(const int on) {
+    STATS_TIMING = on;
+}
+
+DLLEXPORT void setPhiPredictor(const int mode) {
+    PHI_PREDICTOR = mode;
+}
+
+DLLEXPORT void setPhiMethod(const int method) {
+    PHI_METHOD = method;
+}
+
 DLLEXPORT double phiInt(const double r0, const double kap, const double thv, const double sig) {
     params PS = { kap, sig, thv, 0.0, 2.2, 1.0 };
-    double sumVal = simpsPhi(PS, r0, 0.0, 2.0*M_PI);
+    double sumVal = phiIntegral(PS, r0);
     return sumVal;
 }
 
@@ -366,7 +599,7 @@ double intG(double y, double chi, const double k, const double p) {
     return ys*chis*fac;
 }
 
-DLLEXPORT double fluxG(params& ps, const double y, double r0) {
+DLLEXPORT double fluxG(params& ps, const double y, double r0, const double phiEps, const double xacc) {
     const double kap = ps.KAP;
     const double sig = ps.SIG;
     const double thv = ps.THV;
@@ -378,7 +611,7 @@ DLLEXPORT double fluxG(params& ps, const double y, double r0) {
     double thP0 = thetaPrime(r0 / y, thv, 0.0);
     double exp0 = pow(thP0 / sig, 2.0*kap);
     double chiVal = (y - Gk*exp2(-exp0)*pow(tan(thv) + r0 / y, 2.0)) / (pow(y, 5.0 - k));
-    return r0*intG(y, chiVal, k, p)*simpsPhi(ps, r0, 0.0, 2.0*M_PI);
+    return r0*intG(y, chiVal, k, p)*phiIntegral(ps, r0, phiEps, xacc);
 }
 
 DLLEXPORT double fluxWrap(double y, double r0, const double kap, const double sig, const double thv, const double gA, const double k, const double p) {
@@ -387,15 +620,27 @@ DLLEXPORT double fluxWrap(double y, double r0, const double kap, const double si
     return fluxVal;
 }
 
-DLLEXPORT double fluxWrap_ct(int n, double args[8]) {
+// quad passes n = 8 for (r0, y, kap, sig, thv, k, p, gA); n = 10 appends the
+// phi Simpson eps and root tolerance.
+DLLEXPORT double fluxWrap_ct(int n, const double *args) {
     double y, r0;  // , kap, sig, thv, gA, k, p
     r0 = args[0];
     y = args[1];
     params PS = { args[2], args[3], args[4], args[5], args[6], args[7] };
-    double fluxVal = fluxG(PS, y, r0);
+    double phiEps = n > 8 ? args[8] : 1.0e-9;
+    double xacc = n > 9 ? args[9] : PHI_XACC;
+    double fluxVal = fluxG(PS, y, r0, phiEps, xacc);
     return fluxVal;
 }
 
+// fluxWrap_ct as a scipy LowLevelCallable, double (double, void *): userData
+// points to the nine doubles (y, kap, sig, thv, k, p, gA, phiEps, xacc).
+DLLEXPORT double fluxWrap_ud(double r0, void *userData) {
+    const double *args = static_cast<const double*>(userData);
+    params PS = { args[1], args[2], args[3], args[4], args[5], args[6] };
+    return fluxG(PS, args[0], r0, args[7], args[8]);
+}
+
 double milneR0(params& ps, const double y, const double a, const double b, const double eps) {
     const int NMAX = 25;
     double sum, osum = 0.0;
@@ -486,15 +731,22 @@ struct RootFuncR0
         double thp0 = thetaPrime(r0, thv, 0.0);
         double frac = kap*log(2.0)*pow(thp0 / sig, 2.0*kap)*((r0 + tan(thv)) / (r0 * (1.0 + r0*sin(thv)*cos(thv))));
         double exponent = 2.0*energyProfile(thp0, sig, kap);
-        return (1.0 - frac)*exponent;
+        // d/dr0 of lhs: (r0/y + tan thv) / y times its derivative in r0/y.
+        return (1.0 - frac)*exponent*(r0 + tan(thv)) / y;
     }
 };
 
 double rtsafeR0(RootFuncR0& func, const double x1, const double x2, const double xacc) {
+    return rtsafeR0(func, x1, x2, func.f(x1), func.f(x2), 0.5*(x1 + x2), xacc);
+}
+
+// rtsafeR0 with f already known at both ends of the bracket, starting from
+// x0 inside it.
+double rtsafeR0(RootFuncR0& func, const double x1, const double x2, const double fl, const double fh, const double x0, const double xacc) {
+    StageTimer timer(STATS.r0MaxTime);
+    STATS.r0MaxSolves++;
     const int MAXIT = 100;
     double xl, xh;
-    double fl = func.f(x1);
-    double fh = func.f(x2);
     if ((fl > 0.0 && fh > 0.0) || (fl < 0.0 && fh < 0.0)) {
         //std::cout << "Root not bracketed in rtsafeR0" << std::endl;
         //std::cout << "fl = " << fl << ", fh = " << fh << std::endl;
@@ -511,7 +763,7 @@ double rtsafeR0(RootFuncR0& func, const double x1, const double x2, const double
         xh = x1;
         xl = x2;
     }
-    double rts = 0.5*(x1 + x2);
+    double rts = x0;
     double dxold = std::abs(x2 - x1);
     double dx = dxold;
     double f = func.f(rts);
@@ -544,13 +796,39 @@ double rtsafeR0(RootFuncR0& func, const double x1, const double x2, const double
     throw("Maximum number of iterations exceeded in rtsafeR0");
 }
 
+// The r0_max root is searched in [0, R0_BRACKET]. When f is negative at both
+// ends the root lies beyond it, and the upper end is doubled until f turns
+// positive or it passes R0_BRACKET_MAX.
+const double R0_BRACKET = 0.65;
+const double R0_BRACKET_MAX = 1.0e3;
+const double R0_XACC = 1.0e-7;
+
+// Returns the upper end, with f at both ends in fl and fh.
+double r0Bracket(RootFuncR0& func, double& fl, double& fh) {
+    double hi = R0_BRACKET;
+    fl = func.f(0.0);
+    fh = func.f(hi);
+    while (fl < 0.0 && fh < 0.0 && hi < R0_BRACKET_MAX) {
+        hi *= 2.0;
+        fh = func.f(hi);
+    }
+    return hi;
+}
+
+double solveR0Max(RootFuncR0& func) {
+    double fl, fh;
+    double hi = r0Bracket(func, fl, fh);
+    return rtsafeR0(func, 0.0, hi, fl, fh, 0.5*hi, R0_XACC);
+}
+
 
 class GrbaIntegrator
 {
 public:
 
-    GrbaIntegrator(double Y, const double KAP, const double SIG, const double THV, const double K, const double P, const double GA) :
-        y(Y), kap(KAP), sig(SIG), thv(THV), k(K), p(P), gA(GA)
+    GrbaIntegrator(double Y, const double KAP, const double SIG, const double THV, const double K, const double P, const double GA,
+                   const double PHIEPS = 1.0e-9, const double XACC = PHI_XACC) :
+        y(Y), kap(KAP), sig(SIG), thv(THV), k(K), p(P), gA(GA), phiEps(PHIEPS), xacc(XACC)
     {}
 
     double operator()(double r0) const
@@ -560,7 +838,7 @@ public:
         double thP0 = thetaPrime(r0 / y, thv, 0.0);
         double exp0 = pow(thP0 / sig, 2.0*kap);
         double chiVal = (y - Gk*exp2(-exp0)*pow(tan(thv) + r0 / y, 2.0)) / (pow(y, 5.0 - k));
-        return r0*intG(y, chiVal, k, p)*simpsPhi(ps, r0, 0.0, 2.0*M_PI);
+        return r0*intG(y, chiVal, k, p)*phiIntegral(ps, r0, phiEps, xacc);
     }
 
     //double intG(double y, double chi) {
@@ -578,12 +856,12 @@ public:
         double thP0 = thetaPrime(r0, thv, 0.0);
         double exp0 = pow(thP0 / sig, 2.0*kap);
         double chiVal = (y - Gk*exp2(-exp0)*pow(tan(thv) + r0, 2.0)) / (pow(y, 5.0 - k));
-        return r0*intG(y, chiVal, k, p)*simpsPhi(ps, r0, 0.0, 2.0*M_PI);
+        return r0*intG(y, chiVal, k, p)*phiIntegral(ps, r0);
     }*/
 
 private:
     double y;
-    const double kap, sig, thv, gA, k, p;
+    const double kap, sig, thv, gA, k, p, phiEps, xacc;
 };
 
 void testPhiInt() {
@@ -616,7 +894,7 @@ void testPhiInt() {
                 //printf_s("%f\t%f\t%f\t%f\n", KAP, THV, R0MAX, step);
                 for (int i = 1; i < 9; i++) {
                     double R0 = i*step;
-                    double sumVal = simpsPhi(PS, R0, 0.0, 2.0*M_PI);
+                    double sumVal = phiIntegral(PS, R0);
                     printf_s("%d\t%f\t%f\n", i, R0, sumVal);
                     system("pause");
                 }
@@ -639,22 +917,241 @@ void testPhiInt() {
 DLLEXPORT double r0Max(double y, const double kap, const double sig, const double thv, const double k, const double p, const double gA) {
     params PS = { kap, sig, thv, k, p, gA };
     RootFuncR0 r0func(y, PS);
-    double R0MAX = rtsafeR0(r0func, 0.0, 0.65, 1.0e-7);
+    double R0MAX = solveR0Max(r0func);
     return R0MAX;
 }
 
 DLLEXPORT double r0IntDE(double y, const double RMIN, const double kap, const double sig, const double thv, const double k, const double p, const double gA) {
+    double errEst;
+    return r0IntDETol(y, RMIN, kap, sig, thv, k, p, gA, 1e-5, 0.0, 1.0e-9, PHI_XACC, &errEst);
+}
+
+// r0IntDE with the DE rule stopped at atol or rtol relative to the integral,
+// whichever is reached first, and the phi integrals run to phiEps with roots to
+// xacc. errEst receives the DE error estimate (0 when nothing emits).
+DLLEXPORT double r0IntDETol(double y, const double RMIN, const double kap, const double sig, const double thv, const double k, const double p, const double gA, const double atol, const double rtol, const double phiEps, const double xacc, double *errEst) {
     params PS = { kap, sig, thv, k, p, gA };
     RootFuncR0 r0func(y, PS);
-    double R0MAX = rtsafeR0(r0func, 0.0, 0.65, 1.0e-7);
+    double R0MAX = solveR0Max(r0func);
+    *errEst = 0.0;
     if (R0MAX >= 0.0) {
-        GrbaIntegrator func(y, kap, sig, thv, k, p, gA);
+        StageTimer timer(STATS.r0Time);
+        GrbaIntegrator func(y, kap, sig, thv, k, p, gA, phiEps, xacc);
         double intVal;
-        intVal = DEIntegrator<GrbaIntegrator>::Integrate(func, RMIN, R0MAX, 1e-5);
+        int evals;
+        intVal = DEIntegrator<GrbaIntegrator>::Integrate(func, RMIN, R0MAX, atol, rtol, evals, *errEst);
+        STATS.r0Integrals++;
+        STATS.r0Evals += evals;
+        STATS.r0Error += *errEst;
         return intVal;
     }
     else {
         return 0.0;
     }
     
-}
\ No newline at end of file
+}
+
+DLLEXPORT void thetaPrimeBatch(const double *r, const int n, const double thv, const double phi, double *out) {
+    for (int i = 0; i < n; i++) {
+        out[i] = thetaPrime(r[i], thv, phi);
+    }
+}
+
+DLLEXPORT void energyProfileBatch(const double *thp, const int n, const double sig, const double kap, double *out) {
+    for (int i = 0; i < n; i++) {
+        out[i] = energyProfile(thp[i], sig, kap);
+    }
+}
+
+// The batch exports cannot let an exception escape the C boundary, so a
+// failed point is reported as NaN and the remaining points are still evaluated.
+DLLEXPORT void phiIntBatch(const double *r0, const int n, const double kap, const double thv, const double sig, double *out) {
+    params PS = { kap, sig, thv, 0.0, 2.2, 1.0 };
+    for (int i = 0; i < n; i++) {
+        try {
+            out[i] = phiIntegral(PS, r0[i]);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }
+}
+
+// phiIntBatch with the phi integrals to eps and their roots to xacc.
+DLLEXPORT void phiIntBatchTol(const double *r0, const int n, const double kap, const double thv, const double sig, const double eps, const double xacc, double *out) {
+    params PS = { kap, sig, thv, 0.0, 2.2, 1.0 };
+    for (int i = 0; i < n; i++) {
+        try {
+            out[i] = phiIntegral(PS, r0[i], eps, xacc);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }
+}
+
+DLLEXPORT void fluxWrapBatch(const double y, const double *r0, const int n, const double kap, const double sig, const double thv, const double gA, const double k, const double p, double *out) {
+    params PS = { kap, sig, thv, k, p, gA };
+    for (int i = 0; i < n; i++) {
+        try {
+            out[i] = fluxG(PS, y, r0[i]);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }
+}
+
+// fluxWrapBatch with the phi integrals to phiEps and their roots to xacc.
+DLLEXPORT void fluxWrapBatchTol(const double y, const double *r0, const int n, const double kap, const double sig, const double thv, const double gA, const double k, const double p, const double phiEps, const double xacc, double *out) {
+    params PS = { kap, sig, thv, k, p, gA };
+    for (int i = 0; i < n; i++) {
+        try {
+            out[i] = fluxG(PS, y, r0[i], phiEps, xacc);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }
+}
+
+// fluxWrapBatch with its own y for every r0.
+DLLEXPORT void fluxWrapPairBatch(const double *y, const double *r0, const int n, const double kap, const double sig, const double thv, const double gA, const double k, const double p, double *out) {
+    params PS = { kap, sig, thv, k, p, gA };
+    for (int i = 0; i < n; i++) {
+        try {
+            out[i] = fluxG(PS, y[i], r0[i]);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }
+}
+
+DLLEXPORT void r0MaxBatch(const double *y, const int n, const double kap, const double sig, const double thv, const double k, const double p, const double gA, double *out) {
+    params PS = { kap, sig, thv, k, p, gA };
+    for (int i = 0; i < n; i++) {
+        RootFuncR0 r0func(y[i], PS);
+        try {
+            out[i] = solveR0Max(r0func);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }
+}
+
+// r0Max along y, best in ascending order: each solve starts from the root
+// extrapolated linearly from the two before it instead of the middle of the
+// bracket, which leaves a Newton step or two per point. found[i] is 0, and
+// out[i] NAN, where the full r0Max bracket has no sign change (nothing
+// emits) or the solve fails.
+DLLEXPORT void r0MaxWalk(const double *y, const int n, const double kap, const double sig, const double thv, const double k, const double p, const double gA, double *out, int *found) {
+    params PS = { kap, sig, thv, k, p, gA };
+    double yPrev[2], rPrev[2];
+    int have = 0;
+    for (int i = 0; i < n; i++) {
+        RootFuncR0 r0func(y[i], PS);
+        double fl, fh;
+        double hi = r0Bracket(r0func, fl, fh);
+        out[i] = NAN;
+        found[i] = 0;
+        if ((fl > 0.0 && fh > 0.0) || (fl < 0.0 && fh < 0.0)) {
+            have = 0;
+            continue;
+        }
+        double guess = 0.5*hi;
+        if (have > 0) {
+            double x0 = rPrev[0];
+            if (have > 1 && yPrev[0] != yPrev[1])
+                x0 += (rPrev[0] - rPrev[1])*(y[i] - yPrev[0]) / (yPrev[0] - yPrev[1]);
+            // df is singular at r0 = 0.
+            if (x0 > 0.0 && x0 < hi) guess = x0;
+        }
+        try {
+            out[i] = rtsafeR0(r0func, 0.0, hi, fl, fh, guess, R0_XACC);
+        }
+        catch (...) {
+            have = 0;
+            continue;
+        }
+        if (out[i] < 0.0) {
+            out[i] = NAN;
+            have = 0;
+            continue;
+        }
+        found[i] = 1;
+        yPrev[1] = yPrev[0];
+        rPrev[1] = rPrev[0];
+        yPrev[0] = y[i];
+        rPrev[0] = out[i];
+        have = std::min(have + 1, 2);
+    }
+}
+
+void addStats(GrbaStats& total, const GrbaStats& part) {
+    total.rootSolves += part.rootSolves;
+    total.rootIters += part.rootIters;
+    total.phiIntegrals += part.phiIntegrals;
+    total.simpsonLevels += part.simpsonLevels;
+    total.r0MaxSolves += part.r0MaxSolves;
+    total.r0Integrals += part.r0Integrals;
+    total.r0Evals += part.r0Evals;
+    total.r0Error += part.r0Error;
+    total.r0MaxTime += part.r0MaxTime;
+    total.phiTime += part.phiTime;
+    total.r0Time += part.r0Time;
+}
+
+// Runs point(i) for i in [0, n) on nthreads threads (all cores for nthreads <= 0).
+// Points are handed out one at a time from a shared counter, so a thread that
+// drew cheap points simply takes more of them. The workers' stats are added to
+// the calling thread's, stage times summed over threads.
+template<class TPoint>
+void runPoints(TPoint point, const int n, int nthreads) {
+    if (nthreads <= 0) nthreads = (int)std::thread::hardware_concurrency();
+    nthreads = std::max(1, std::min(nthreads, n));
+    if (nthreads == 1) {
+        for (int i = 0; i < n; i++) point(i);
+        return;
+    }
+    std::atomic<int> next(0);
+    std::mutex statsLock;
+    GrbaStats total = {};
+    auto worker = [&]() {
+        for (int i = next++; i < n; i = next++) point(i);
+        std::lock_guard<std::mutex> lock(statsLock);
+        addStats(total, STATS);
+    };
+    std::vector<std::thread> pool;
+    for (int t = 0; t < nthreads; t++) pool.emplace_back(worker);
+    for (std::thread& t : pool) t.join();
+    addStats(STATS, total);
+}
+
+// r0IntDE for n independent points, each a row (y, RMIN, kap, sig, thv, k, p, gA)
+// of points in r0IntDE's argument order. Failed points come back as NaN.
+DLLEXPORT void r0IntDEPoints(const double *points, const int n, const int nthreads, double *out) {
+    runPoints([=](int i) {
+        const double *a = points + 8 * i;
+        try {
+            out[i] = r0IntDE(a[0], a[1], a[2], a[3], a[4], a[5], a[6], a[7]);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }, n, nthreads);
+}
+
+// phiInt for n rows (r0, kap, thv, sig), as r0IntDEPoints.
+DLLEXPORT void phiIntPoints(const double *points, const int n, const int nthreads, double *out) {
+    runPoints([=](int i) {
+        const double *a = points + 4 * i;
+        try {
+            out[i] = phiInt(a[0], a[1], a[2], a[3]);
+        }
+        catch (...) {
+            out[i] = NAN;
+        }
+    }, n, nthreads);
+}
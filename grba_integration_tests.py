@@ -12,6 +12,7 @@ from math import radians, degrees
 from cycler import cycler
 
 from grba_int import *
+from grba_sweep import GridSpec, sweep_to_file, load_sweep
 
 # n = 10
 # colors = [plt.get_cmap('Blues')(1. * i/n) for i in range(n)]
@@ -36,19 +37,11 @@ sns.set_style('ticks', {'legend.frameon': True})
 
 TINY = 1.0e-9
 
-grbaint = cdll.LoadLibrary("Release/grba_integration.dll")
+grbaint = native_backend()
 phiInt = grbaint.phiInt
-phiInt.restype = c_double
-phiInt.argtypes = [c_double, c_double, c_double, c_double]
 thp = grbaint.thetaPrime
-thp.restype = c_double
-thp.argtypes = [c_double, c_double, c_double]
 engProf = grbaint.energyProfile
-engProf.restype = c_double
-engProf.argtypes = [c_double, c_double, c_double]
 fluxG_cFunc = grbaint.fluxWrap
-fluxG_cFunc.restype = c_double
-fluxG_cFunc.argtypes = [c_double, c_double, c_double, c_double, c_double, c_double, c_double, c_double]
 
 def intG(y, chi, k = 0.0, p = 2.2):
     bG = (1.0 - p)/2.0
@@ -68,6 +61,7 @@ def thetaPrime(r, thv, phi):
     # return np.divide(top, bot)
     return thp(r, thv, phi)
 
+@memoize()
 def r0_max(y, kap, sig, thv, gA = 1.0, k = 0.0, p = 2.2):
     Gk = (4.0 - k)*gA**2.0
     def rootR0(rm):
@@ -197,7 +191,8 @@ def plot_r0Int_cTest(y, kap, sig, thv):
     if R0_MAX > 0.0:
         r0s = np.logspace(-3, np.log10(R0_MAX), num = 100)
         vals = vec_fluxG_fullStr(r0s, y, kap, sig, thv)
-        cVals = vec_fluxG_fullStr_cFunc(r0s, y, kap, sig, thv)
+        grb = GrbaIntegrator(kap, thv, sig, 1.0, 0.0, 2.2)
+        cVals = grb._r0_integrand_c(y, r0s)
         lab = np.repeat("Python", len(vals))
         clab = np.repeat("C++", len(cVals))
         dat = pd.DataFrame(data = {'r0': r0s, 'int': vals, 'lab': lab})
@@ -421,49 +416,44 @@ def plot_r0Phi(r0, kap, sig, thv):
     # print data.head()
     return(dat)
 
-def plot_root_grid():
-    R0 = np.power(10.0, -9.0)
-    PHI = np.pi/2.0
+# Records of the sweeps below; thv in degrees and phi in units of pi.
+ROOT_GRID_DTYPE = np.dtype([('y', 'f8'), ('kap', 'f8'), ('thv', 'f8'), ('phi', 'f8'),
+                            ('c', 'i4'), ('rp', 'f8'), ('jac', 'f8'), ('fun', 'f8')])
+RPRIME_PHI_DTYPE = np.dtype([('y', 'f8'), ('kap', 'f8'), ('thv', 'f8'), ('r0', 'f8'),
+                             ('phi', 'f8'), ('c', 'i4'), ('rp', 'f8')])
+
+ROOT_GRID_R0 = np.power(10.0, -9.0)
+RPRIME_R0S = [1.0e-5]  # , 1.0e-7, 1.0e-9
+
+def root_grid_point(grb, YVAL, KAP, THV):
+    # root_fun and root_jac on 100 r' in +-100 r0, at 5 phis.
+    R0 = ROOT_GRID_R0
+    THETA_V = radians(THV)
+    phis = np.linspace(0.0, 2.0*np.pi, num = 5)
+    rVals = np.linspace(-100.0*R0, 100.0*R0, num = 100)
+    out = np.zeros(len(phis)*len(rVals), dtype=ROOT_GRID_DTYPE)
+    i = 0
+    for c, PHI in enumerate(phis):
+        for R in rVals:
+            jac = root_jac(r=R, r0=R0, phi=PHI, kap=KAP, sig=grb.sig, thv=THETA_V)
+            fun = root_fun(r=R, r0=R0, phi=PHI, kap=KAP, sig=grb.sig, thv=THETA_V)
+            out[i] = (YVAL, KAP, THV, PHI/np.pi, c, R, jac, fun)
+            i += 1
+    return out
+
+def plot_root_grid(path = "root_grid.npy"):
+    R0 = ROOT_GRID_R0
     SIG = 2.0
-    # for YVAL in [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]:
-    for YVAL in [0.5]:
-        js = []
-        fs = []
-        ps = []
-        rs = []
-        ks = []
-        ts = []
-        cs = []
-        for KAP in [0.0, 1.0, 10.0]:
-            for THV in [1.0, 2.0, 6.0]:
-                THETA_V = radians(THV)
-                phis = np.linspace(0.0, 2.0*np.pi, num = 5)
-                # phiVal = np.pi/2.0
-                # phis = [phiVal - R0, phiVal, phiVal + R0, 3.0*phiVal - R0, 3.0*phiVal, 3.0*phiVal + R0]
-                for c, PHI in enumerate(phis):
-                # r0s = [1.0e-9, 1.0e-7, 1.0e-5, 1.0e-3, 1.0e-1]
-                # r0s = [1.0e-9, 1.0e-7]
-                # for c, R0 in enumerate(r0s):
-                    # G = R0
-                    rVals = np.linspace(-100.0*R0, 100.0*R0, num = 100)
-                    # rVals = np.linspace(-0.1, 0.1, num = 100)
-                    for R in rVals:
-                        jac = root_jac(r=R, r0=R0, phi=PHI, kap=KAP, sig=SIG, thv=THETA_V)
-                        fun = root_fun(r=R, r0=R0, phi=PHI, kap=KAP, sig=SIG, thv=THETA_V)
-                        js.append(jac)
-                        fs.append(fun)
-                        ps.append(PHI/np.pi)
-                        # ps.append(R0)
-                        rs.append(R)
-                        ks.append(KAP)
-                        ts.append(THV)
-                        cs.append(c)
-
-        data = [ps, rs, ks, ts, js, fs, cs]
-        df = pd.DataFrame(data)
-        df = df.transpose()
-        cols = ['R0', 'Rp', 'Kappa', 'ThetaV', 'Jac', 'Fun', 'C']
-        df.columns = cols
+    # YVALS = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+    YVALS = [0.5]
+    spec = GridSpec(YVALS, [0.0, 1.0, 10.0], [1.0, 2.0, 6.0], sig = SIG,
+                    quantity = root_grid_point, dtype = ROOT_GRID_DTYPE)
+    sweep_to_file(spec, path)
+    records = load_sweep(path)
+    for YVAL in YVALS:
+        df = pd.DataFrame.from_records(np.array(records[records['y'] == YVAL]))
+        df = df.rename(columns = {'phi': 'R0', 'rp': 'Rp', 'kap': 'Kappa', 'thv': 'ThetaV',
+                                  'jac': 'Jac', 'fun': 'Fun', 'c': 'C'})
         # df = df.round({'R0P': 3})
         g = sns.FacetGrid(df, col='Kappa', row='ThetaV', hue='C',
                                 palette = sns.color_palette("deep", n_colors=5)) #ylim=(0,2),
@@ -488,58 +478,35 @@ def plot_root_grid():
         g.fig.subplots_adjust(top=.9)
         plt.show()
 
-def main(tiny):
+def rprime_phi_point(grb, YVAL, KAP, THV):
+    # r' along 100 phis for each of RPRIME_R0S, each root seeding the next.
+    THETA_V = radians(THV)
+    phis = np.linspace(0.0, 2.0*np.pi, num = 100)
+    out = np.zeros(len(RPRIME_R0S)*len(phis), dtype=RPRIME_PHI_DTYPE)
+    i = 0
+    for c, R0 in enumerate(RPRIME_R0S):
+        G = R0
+        for PHI in phis:
+            RP = solveR(G, R0, PHI, KAP, grb.sig, THETA_V)
+            G = RP
+            # F = np.log10(np.power(np.divide(RP, R0), 2.0))
+            out[i] = (YVAL, KAP, THV, R0, PHI/np.pi, c, RP)
+            i += 1
+    return out
+
+def main(tiny, path = "rPrime-phi_profiles.npy"):
     # tiny = np.power(10.0, -3.0)
     SIGMA = 2.0
-    # KAPPA = 0.0
-    # THETA_V = radians(2.0)
-    # YVAL = 0.05
-    # plt.figure()
-    # for YVAL in [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]:
-    for YVAL in [0.5]:
-        ps = []
-        fs = []
-        rs = []
-        ks = []
-        ts = []
-        cs = []
-        for KAP in [0.0, 1.0, 10.0]:
-            for THV in [1.0, 2.0, 6.0]:
-                THETA_V = radians(THV)
-                R0MAX = r0_max(YVAL, KAP, SIGMA, radians(THV))
-                # r0s = np.linspace(0.0, R0MAX, num = 9)
-                # r0s[0] = tiny
-                r0s = [1.0e-5]  # , 1.0e-7, 1.0e-9
-                phis = np.linspace(0.0, 2.0*np.pi, num = 100)
-                # R, P = np.meshgrid(r0s, phis)
-                # s = np.frompyfunc(solveR, 5, 1)
-                # RM = s(R, P, KAP, SIGMA, radians(THV))
-                # r0Maxs = np.amax(RM, axis = 1)
-                # r0Maxs = phiUpperBound(r0s, KAP, SIGMA, radians(THV))
-                # plt.plot(r0s, r0Maxs, label = "kap = {a: 04.1f}, thv = {b: 3.1f}".format(a = KAP, b = THV))
-                # plt.legend()
-                # vals = np.linspace(R0MAX, 0.0, endpoint = False, num = 100, retstep = True)
-                # print KAP, THV, R0MAX, vals[1], vals[0]
-                # plot_rMaxPhi_grid(YVAL, KAP, SIGMA, radians(THV))
-                for c, R0 in enumerate(r0s):
-                    G = R0
-                    for PHI in phis:
-                        RP = solveR(G, R0, PHI, KAP, SIGMA, THETA_V)
-                        G = RP
-                        # F = np.log10(np.power(np.divide(RP, R0), 2.0))
-                        ps.append(PHI/np.pi)
-                        rs.append(R0)
-                        # fs.append(F)
-                        fs.append(RP)
-                        ks.append(KAP)
-                        ts.append(THV)
-                        cs.append(c)
-
-        data = [ps, rs, ks, ts, fs, cs]
-        df = pd.DataFrame(data)
-        df = df.transpose()
-        cols = ['Phi', 'R0P', 'Kappa', 'ThetaV', 'RP', 'C']
-        df.columns = cols
+    # YVALS = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+    YVALS = [0.5]
+    spec = GridSpec(YVALS, [0.0, 1.0, 10.0], [1.0, 2.0, 6.0], sig = SIGMA,
+                    quantity = rprime_phi_point, dtype = RPRIME_PHI_DTYPE)
+    sweep_to_file(spec, path)
+    records = load_sweep(path)
+    for YVAL in YVALS:
+        df = pd.DataFrame.from_records(np.array(records[records['y'] == YVAL]))
+        df = df.rename(columns = {'phi': 'Phi', 'r0': 'R0P', 'kap': 'Kappa', 'thv': 'ThetaV',
+                                  'rp': 'RP', 'c': 'C'})
         # df = df.round({'R0P': 3})
         # print df.groupby(['Kappa', 'ThetaV', 'C']).get_group((0.0, 1.0, 0.0))['RP']
         g = sns.FacetGrid(df, col='Kappa', row='ThetaV', hue='C',
@@ -571,7 +538,7 @@ def main(tiny):
                                        loc='upper right',
                                        bbox_to_anchor=(1.2, 1.0))
         g.set_titles(r"$\kappa = {col_name}$ | $\theta_V = {row_name}$")
-        plt.suptitle(r"$y={a} | r'_{{0,min}}={b}$".format(a=YVAL, b=TINY))
+        plt.suptitle(r"$y={a} | r'_{{0,min}}={b}$".format(a=YVAL, b=tiny))
         g.fig.subplots_adjust(top=.9)
         plt.show()
         # plt.savefig("rPrime-phi_profiles(y={a}_r0'min={b}).pdf".format(a=YVAL, b=TINY), format="pdf", dpi=1200)
@@ -0,0 +1,475 @@
+import math
+import numpy as np
+from numba import njit
+
+from grba_int import (NumpyBackend, COUNTERS, R0_BRACKET, R0_BRACKET_MAX, _DE_ABSCISSAS, _DE_WEIGHTS,
+                      _as_doubles, _count_r0_integral, _phi_method, _phi_predictor, _timed)
+
+# Compiled counterparts of the NumPy engine (the Python reference): same
+# geometry, the same damped Newton steps on the phi roots, the same Simpson
+# levels and predictor, and the r0IntDE rule, so results agree with it to
+# the root tolerance. Compiled code is cached on disk next to this module
+# (or under NUMBA_CACHE_DIR), so only the first process ever compiles it.
+
+# Counts the kernels add to: root solves, root iterations, phi integrals
+# and Simpson levels, copied into COUNTERS after every call.
+ROOT_SOLVES, ROOT_ITERS, PHI_INTEGRALS, SIMPSON_LEVELS = range(4)
+
+@njit(cache=True)
+def theta_prime(r, thv, phi):
+    numer = r*math.sqrt(math.cos(thv)**2 - 0.25*math.sin(2.0*thv)**2*math.cos(phi)**2)
+    return numer / (1.0 + 0.5*r*math.sin(2.0*thv)*math.cos(phi))
+
+@njit(cache=True)
+def energy_profile(thp, sig, kap):
+    return 2.0**(-(thp / sig)**(2.0*kap))
+
+@njit(cache=True)
+def root_fun(r, r0, phi, kap, sig, thv):
+    tv = math.tan(thv)
+    eng = energy_profile(theta_prime(r, thv, phi), sig, kap)
+    eng0 = energy_profile(theta_prime(r, thv, 0.0), sig, kap)
+    return eng*(r*r + 2.0*r*tv*math.cos(phi) + tv*tv) - (r0 + tv)**2*eng0
+
+@njit(cache=True)
+def root_jac(r, r0, phi, kap, sig, thv):
+    tv = math.tan(thv)
+    s2 = math.sin(2.0*thv)
+    thp = theta_prime(r, thv, phi)
+    first = r + tv*math.cos(phi)
+    second = r*r + 2.0*r*tv*math.cos(phi) + tv*tv
+    frac = kap*math.log(2.0)*(thp / sig)**(2.0*kap) / (r*(1.0 + 0.5*r*s2*math.cos(phi)))
+    thp0 = theta_prime(r, thv, 0.0)
+    frac0 = kap*math.log(2.0)*(thp0 / sig)**(2.0*kap) / (r*(1.0 + 0.5*r*s2))
+    return ((first - second*frac)*2.0*energy_profile(thp, sig, kap)
+            + (r0 + tv)**2*frac0*2.0*energy_profile(thp0, sig, kap))
+
+@njit(cache=True)
+def root_guess(r0, phi, thv):
+    tv = math.tan(thv)
+    return math.sqrt((r0 + tv)**2 - (tv*math.sin(phi))**2) - tv*math.cos(phi)
+
+@njit(cache=True)
+def root_slope(r, r0, phi, kap, sig, thv):
+    tv = math.tan(thv)
+    s2 = math.sin(2.0*thv)
+    cphi, sphi = math.cos(phi), math.sin(phi)
+    thp = theta_prime(r, thv, phi)
+    q = kap*math.log(2.0)*(thp / sig)**(2.0*kap)
+    S = r*r + 2.0*r*tv*cphi + tv*tv
+    D = 1.0 + 0.5*r*s2*cphi
+    A = math.cos(thv)**2 - 0.25*(s2*cphi)**2
+    dLogThp = 0.25*s2*s2*sphi*cphi / A + 0.5*r*s2*sphi / D
+    fPhi = -2.0*energy_profile(thp, sig, kap)*(r*tv*sphi + q*S*dLogThp)
+    return -fPhi / root_jac(r, r0, phi, kap, sig, thv)
+
+@njit(cache=True)
+def _newton(r0, phi, g, kap, sig, thv, xacc, maxit, counts):
+    # newton_phi for one node; NaN when it does not converge.
+    r = g
+    for it in range(maxit):
+        counts[ROOT_ITERS] += 1
+        dx = root_fun(r, r0, phi, kap, sig, thv) / abs(root_jac(r, r0, phi, kap, sig, thv))
+        rn = r - dx
+        bad = False
+        if not rn > 0.0:
+            rn = 0.5*r
+            bad = True
+        elif not rn < 10.0*r:
+            rn = 10.0*r
+            bad = True
+        r = rn
+        if not bad and abs(dx) <= xacc*rn:
+            return r
+    return np.nan
+
+@njit(cache=True)
+def solve_root(r0, phi, g, kap, sig, thv, xacc, counts):
+    # Newton from g, then once more from the kap = 0 root where that fails.
+    counts[ROOT_SOLVES] += 1
+    r = _newton(r0, phi, g, kap, sig, thv, xacc, 50, counts)
+    if r != r:
+        r = _newton(r0, phi, root_guess(r0, phi, thv), kap, sig, thv, xacc, 100, counts)
+    return r
+
+@njit(cache=True)
+def simps_phi(r0, kap, sig, thv, eps, nmin, xacc, tangent, trapezoid, counts):
+    # simps_phi_np for one r0: [0, pi] doubled, level n with 2**(n - 2)
+    # intervals over pi, sums compared from level nmin + 1. Returns the
+    # integral (NaN without convergence) and the level it stopped at.
+    counts[PHI_INTEGRALS] += 1
+    if kap == 0.0 or thv == 0.0:
+        return 2.0*math.pi*(1.0 + math.tan(thv) / r0)**2, 0
+    NMAX = 25
+    it = 1 << (nmin - 2)
+    h = math.pi / it
+    roots = np.empty(it + 1)
+    slopes = np.empty(it + 1)
+    roots[0] = r0
+    roots[it] = solve_root(r0, math.pi, root_guess(r0, math.pi, thv), kap, sig, thv, xacc, counts)
+    slopes[:] = np.nan
+    slopes[0] = slopes[it] = 0.0
+    for j in range(1, it):
+        roots[j] = solve_root(r0, j*h, root_guess(r0, j*h, thv), kap, sig, thv, xacc, counts)
+    fEnd = (roots[it] / r0)**2
+    osum = 0.0
+    for n in range(nmin, NMAX):
+        if n > nmin:
+            # Halve the step: old nodes move to the even places and the new
+            # midpoints start from their neighbours.
+            it *= 2
+            h *= 0.5
+            nextRoots = np.empty(it + 1)
+            nextSlopes = np.empty(it + 1)
+            nextSlopes[:] = np.nan
+            for j in range(0, it + 1, 2):
+                nextRoots[j] = roots[j // 2]
+                nextSlopes[j] = slopes[j // 2]
+            for j in range(1, it, 2):
+                rl, rr = nextRoots[j - 1], nextRoots[j + 1]
+                g = 0.5*(rl + rr)
+                if tangent:
+                    for m in (j - 1, j + 1):
+                        if nextSlopes[m] != nextSlopes[m]:
+                            nextSlopes[m] = root_slope(nextRoots[m], r0, m*h, kap, sig, thv)
+                    gh = g + 0.25*h*(nextSlopes[j - 1] - nextSlopes[j + 1])
+                    if gh > 0.0:
+                        g = gh
+                nextRoots[j] = solve_root(r0, j*h, g, kap, sig, thv, xacc, counts)
+            roots, slopes = nextRoots, nextSlopes
+        odd = 0.0
+        even = 0.0
+        for j in range(1, it):
+            if j % 2 == 1:
+                odd += (roots[j] / r0)**2
+            else:
+                even += (roots[j] / r0)**2
+        if trapezoid:
+            sum = (0.5*(1.0 + fEnd) + odd + even)*2.0*h
+        else:
+            sum = (1.0 + fEnd + 4.0*odd + 2.0*even)*2.0*h / 3.0
+        if n > nmin and (abs(sum - osum) < eps*abs(osum) or (sum == 0.0 and osum == 0.0)):
+            counts[SIMPSON_LEVELS] += n
+            return sum, n
+        osum = sum
+    counts[SIMPSON_LEVELS] += NMAX - 1
+    return np.nan, NMAX - 1
+
+@njit(cache=True)
+def int_g(y, chi, k, p):
+    bG = (1.0 - p) / 2.0
+    ys = y**(0.5*(bG*(4.0 - k) + 4.0 - 3.0*k))
+    chis = chi**((7.0*k - 23.0 + bG*(13.0 + k)) / (6.0*(4.0 - k)))
+    return ys*chis*((7.0 - 2.0*k)*chi*y**(4.0 - k) + 1.0)**(bG - 2.0)
+
+@njit(cache=True)
+def flux_g(y, r0, kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts):
+    Gk = (4.0 - k)*gA*gA
+    exp0 = (theta_prime(r0 / y, thv, 0.0) / sig)**(2.0*kap)
+    chiVal = (y - Gk*2.0**(-exp0)*(math.tan(thv) + r0 / y)**2) / y**(5.0 - k)
+    phi = simps_phi(r0, kap, sig, thv, eps, 3, xacc, tangent, trapezoid, counts)[0]
+    return r0*int_g(y, chiVal, k, p)*phi
+
+@njit(cache=True)
+def r0_root_fun(r0, y, kap, sig, thv, k, gA):
+    r0 = r0 / y
+    Gk = (4.0 - k)*gA*gA
+    eng0 = energy_profile(theta_prime(r0, thv, 0.0), sig, kap)
+    return (r0 + math.tan(thv))**2*eng0 - (y - y**(5.0 - k)) / Gk
+
+@njit(cache=True)
+def r0_root_jac(r0, y, kap, sig, thv, k, gA):
+    r0 = r0 / y
+    thp0 = theta_prime(r0, thv, 0.0)
+    frac = kap*math.log(2.0)*(thp0 / sig)**(2.0*kap)*((r0 + math.tan(thv)) / (r0*(1.0 + r0*math.sin(thv)*math.cos(thv))))
+    return (1.0 - frac)*2.0*energy_profile(thp0, sig, kap)*(r0 + math.tan(thv)) / y
+
+@njit(cache=True)
+def rtsafe_r0(y, kap, sig, thv, k, gA, x1, x2, fl, fh, x0, xacc):
+    # fl and fh are the function at x1 and x2, x0 the first iterate.
+    if (fl > 0.0 and fh > 0.0) or (fl < 0.0 and fh < 0.0):
+        return -1.0
+    if fl == 0.0:
+        return x1
+    if fh == 0.0:
+        return x2
+    if fl < 0.0:
+        xl, xh = x1, x2
+    else:
+        xh, xl = x1, x2
+    rts = x0
+    dxold = abs(x2 - x1)
+    dx = dxold
+    f = r0_root_fun(rts, y, kap, sig, thv, k, gA)
+    df = r0_root_jac(rts, y, kap, sig, thv, k, gA)
+    for j in range(100):
+        if (((rts - xh)*df - f)*((rts - xl)*df - f) > 0.0) or (abs(2.0*f) > abs(dxold*df)):
+            dxold = dx
+            dx = 0.5*(xh - xl)
+            rts = xl + dx
+            if xl == rts:
+                return rts
+        else:
+            dxold = dx
+            dx = f / df
+            temp = rts
+            rts -= dx
+            if temp == rts:
+                return rts
+        if abs(dx) < xacc:
+            return rts
+        f = r0_root_fun(rts, y, kap, sig, thv, k, gA)
+        df = r0_root_jac(rts, y, kap, sig, thv, k, gA)
+        if f < 0.0:
+            xl = rts
+        else:
+            xh = rts
+    raise RuntimeError("Maximum number of iterations exceeded in rtsafe_r0")
+
+@njit(cache=True)
+def r0_bracket(y, kap, sig, thv, k, gA):
+    hi = R0_BRACKET
+    fl = r0_root_fun(0.0, y, kap, sig, thv, k, gA)
+    fh = r0_root_fun(hi, y, kap, sig, thv, k, gA)
+    while fl < 0.0 and fh < 0.0 and hi < R0_BRACKET_MAX:
+        hi *= 2.0
+        fh = r0_root_fun(hi, y, kap, sig, thv, k, gA)
+    return hi, fl, fh
+
+@njit(cache=True)
+def r0_max(y, kap, sig, thv, k, gA, xacc):
+    hi, fl, fh = r0_bracket(y, kap, sig, thv, k, gA)
+    return rtsafe_r0(y, kap, sig, thv, k, gA, 0.0, hi, fl, fh, 0.5*hi, xacc)
+
+@njit(cache=True)
+def r0_max_walk(ys, kap, sig, thv, k, gA, xacc, out, found):
+    # grba_int.r0_max_walk; returns the number of root solves.
+    solves = 0
+    have = 0
+    y0 = r0 = y1 = r1 = 0.0
+    for i in range(len(ys)):
+        y = ys[i]
+        out[i] = np.nan
+        found[i] = 0
+        hi, fl, fh = r0_bracket(y, kap, sig, thv, k, gA)
+        if fl*fh > 0.0:
+            have = 0
+            continue
+        guess = 0.5*hi
+        if have > 0:
+            x0 = r0
+            if have > 1 and y0 != y1:
+                x0 += (r0 - r1)*(y - y0) / (y0 - y1)
+            if x0 > 0.0 and x0 < hi:
+                guess = x0
+        solves += 1
+        R0MAX = rtsafe_r0(y, kap, sig, thv, k, gA, 0.0, hi, fl, fh, guess, xacc)
+        if R0MAX < 0.0:
+            have = 0
+            continue
+        out[i] = R0MAX
+        found[i] = 1
+        y1, r1 = y0, r0
+        y0, r0 = y, R0MAX
+        have = min(have + 1, 2)
+    return solves
+
+_DE_X = np.concatenate(_DE_ABSCISSAS)
+_DE_W = np.concatenate(_DE_WEIGHTS)
+_DE_OFFSETS = np.cumsum([0] + [len(x) for x in _DE_ABSCISSAS])
+
+@njit(cache=True)
+def r0_int_de(y, a, b, kap, sig, thv, k, p, gA, atol, rtol, eps, xacc, tangent, trapezoid,
+              xs, ws, offsets, counts):
+    # de_integrate of flux_g over [a, b]. Returns the integral, the number
+    # of integrand evaluations and the error estimate.
+    c = 0.5*(b - a)
+    d = 0.5*(a + b)
+    atol /= c
+    integral = ws[0]*flux_g(y, d, kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts)
+    for i in range(1, offsets[1]):
+        integral += ws[i]*(flux_g(y, c*xs[i] + d, kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts)
+                           + flux_g(y, -c*xs[i] + d, kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts))
+    neval = 2*offsets[1] - 1
+    errorEstimate = 1.7976931348623157e308
+    currentDelta = 1.7976931348623157e308
+    h = 1.0
+    for level in range(1, len(offsets) - 1):
+        h *= 0.5
+        newContribution = 0.0
+        for i in range(offsets[level], offsets[level + 1]):
+            newContribution += ws[i]*(flux_g(y, c*xs[i] + d, kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts)
+                                      + flux_g(y, -c*xs[i] + d, kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts))
+        neval += 2*(offsets[level + 1] - offsets[level])
+        newContribution *= h
+        previousDelta = currentDelta
+        currentDelta = abs(0.5*integral - newContribution)
+        integral = 0.5*integral + newContribution
+        if level == 1:
+            continue
+        if currentDelta == 0.0:
+            break
+        r = math.log(currentDelta) / math.log(previousDelta)
+        if r > 1.9 and r < 2.1:
+            errorEstimate = currentDelta*currentDelta
+        else:
+            errorEstimate = currentDelta
+        if errorEstimate < 0.1*atol or errorEstimate < 0.1*rtol*abs(integral):
+            break
+    return c*integral, neval, errorEstimate*c
+
+@njit(cache=True)
+def phi_batch(r0, kap, sig, thv, eps, nmin, xacc, tangent, trapezoid, counts, out, levels):
+    for i in range(len(r0)):
+        out[i], levels[i] = simps_phi(r0[i], kap, sig, thv, eps, nmin, xacc, tangent, trapezoid, counts)
+
+@njit(cache=True)
+def flux_batch(y, r0, kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts, out):
+    for i in range(len(r0)):
+        out[i] = flux_g(y[i], r0[i], kap, sig, thv, gA, k, p, eps, xacc, tangent, trapezoid, counts)
+
+def _flags(predictor=None, method=None):
+    return _phi_predictor(predictor) == 'tangent', _phi_method(method) == 'trapezoid'
+
+def _commit(counts):
+    COUNTERS['root_solves'] += int(counts[ROOT_SOLVES])
+    COUNTERS['root_iters'] += int(counts[ROOT_ITERS])
+    COUNTERS['phi_integrals'] += int(counts[PHI_INTEGRALS])
+    COUNTERS['simpson_levels'] += int(counts[SIMPSON_LEVELS])
+
+@_timed('phi_time')
+def simps_phi_nb(r0, kap, sig, thv, eps=1.0e-9, nmin=6, full_output=False, predictor=None, xacc=1.0e-10,
+                 method=None):
+    # simps_phi_np on the compiled kernel, with the same arguments and
+    # return values.
+    tangent, trapezoid = _flags(predictor, method)
+    scalar = np.isscalar(r0)
+    shape = np.shape(r0)
+    r0 = _as_doubles(r0).ravel()
+    result = np.empty(r0.shape)
+    levels = np.empty(r0.shape, dtype=np.int64)
+    counts = np.zeros(4, dtype=np.int64)
+    phi_batch(r0, kap, sig, thv, eps, nmin, xacc, tangent, trapezoid, counts, result, levels)
+    _commit(counts)
+    if scalar:
+        result, levels = result[0], int(levels[0])
+    else:
+        result, levels = result.reshape(shape), levels.reshape(shape)
+    if full_output:
+        nroots, iters = int(counts[ROOT_SOLVES]), int(counts[ROOT_ITERS])
+        return result, {'root_solves': nroots, 'root_iters': iters,
+                        'iters_per_node': iters / float(max(nroots, 1)), 'level': levels}
+    return result
+
+_WARM = [False]
+
+def warm_up():
+    # Load (or on the very first run, compile and cache) every kernel, so
+    # the first real call does not pay for it.
+    if _WARM[0]:
+        return
+    counts = np.zeros(4, dtype=np.int64)
+    one = np.array([0.1])
+    out = np.empty(1)
+    levels = np.empty(1, dtype=np.int64)
+    for tangent in (False, True):
+        for trapezoid in (False, True):
+            phi_batch(one, 1.0, 2.0, 0.1, 1.0e-9, 3, 1.0e-10, tangent, trapezoid, counts, out, levels)
+            flux_batch(one + 0.4, one, 1.0, 2.0, 0.1, 1.0, 0.0, 2.2, 1.0e-9, 1.0e-10, tangent, trapezoid,
+                       counts, out)
+            r0_int_de(0.5, 1.0e-5, 0.1, 1.0, 2.0, 0.1, 0.0, 2.2, 1.0, 1.0e-5, 0.0, 1.0e-9, 1.0e-10,
+                      tangent, trapezoid, _DE_X, _DE_W, _DE_OFFSETS, counts)
+    r0_max(0.5, 1.0, 2.0, 0.1, 0.0, 1.0, 1.0e-7)
+    r0_max_walk(np.array([0.1, 0.5]), 1.0, 2.0, 0.1, 0.0, 1.0, 1.0e-7, np.empty(2), np.empty(2, dtype=np.intc))
+    _WARM[0] = True
+
+class NumbaBackend(NumpyBackend):
+    # NumpyBackend with the phi integrals, fluxG, r0Max and the DE rule on
+    # the compiled kernels. The settings, counters and point batches are
+    # inherited; phi time is only kept for direct phi integrals, the ones
+    # inside fluxG count towards r0 time.
+    name = 'numba'
+
+    def __init__(self):
+        warm_up()
+
+    def simpsPhi(self, r0, kap, sig, thv, eps=1.0e-9, nmin=6, full_output=False, predictor=None,
+                 xacc=1.0e-10, method=None):
+        return simps_phi_nb(r0, kap, sig, thv, eps, nmin, full_output, predictor, xacc, method)
+
+    def phiInt(self, r0, kap, thv, sig):
+        return simps_phi_nb(r0, kap, sig, thv, nmin=3)
+
+    def phiIntBatch(self, r0, n, kap, thv, sig, out):
+        out[:n] = simps_phi_nb(r0[:n], kap, sig, thv, nmin=3)
+
+    def phiIntBatchTol(self, r0, n, kap, thv, sig, eps, xacc, out):
+        out[:n] = simps_phi_nb(r0[:n], kap, sig, thv, eps, nmin=3, xacc=xacc)
+
+    def fluxWrap(self, y, r0, kap, sig, thv, gA, k, p):
+        return self.fluxWrap_ct(r0, y, kap, sig, thv, k, p, gA)
+
+    def fluxWrap_ct(self, r0, y, kap, sig, thv, k, p, gA, phiEps=1.0e-9, xacc=1.0e-10):
+        counts = np.zeros(4, dtype=np.int64)
+        tangent, trapezoid = _flags()
+        value = flux_g(y, r0, kap, sig, thv, gA, k, p, phiEps, xacc, tangent, trapezoid, counts)
+        _commit(counts)
+        return value
+
+    def fluxWrapBatch(self, y, r0, n, kap, sig, thv, gA, k, p, out):
+        self.fluxWrapPairBatch(np.full(n, float(y)), r0, n, kap, sig, thv, gA, k, p, out)
+
+    def fluxWrapPairBatch(self, y, r0, n, kap, sig, thv, gA, k, p, out):
+        counts = np.zeros(4, dtype=np.int64)
+        tangent, trapezoid = _flags()
+        values = np.empty(n)
+        flux_batch(_as_doubles(y[:n]), _as_doubles(r0[:n]), kap, sig, thv, gA, k, p, 1.0e-9, self.phi_xacc,
+                   tangent, trapezoid, counts, values)
+        _commit(counts)
+        out[:n] = values
+
+    def fluxWrapBatchTol(self, y, r0, n, kap, sig, thv, gA, k, p, phiEps, xacc, out):
+        counts = np.zeros(4, dtype=np.int64)
+        tangent, trapezoid = _flags()
+        values = np.empty(n)
+        flux_batch(np.full(n, float(y)), _as_doubles(r0[:n]), kap, sig, thv, gA, k, p, phiEps, xacc,
+                   tangent, trapezoid, counts, values)
+        _commit(counts)
+        out[:n] = values
+
+    @_timed('r0_max_time')
+    def r0Max(self, y, kap, sig, thv, k, p, gA):
+        COUNTERS['r0_max_solves'] += 1
+        return r0_max(y, kap, sig, thv, k, gA, 1.0e-7)
+
+    @_timed('r0_max_time')
+    def r0MaxWalk(self, y, n, kap, sig, thv, k, p, gA, out, found):
+        values = np.empty(n)
+        flags = np.empty(n, dtype=np.intc)
+        COUNTERS['r0_max_solves'] += r0_max_walk(_as_doubles(y[:n]), kap, sig, thv, k, gA, 1.0e-7, values, flags)
+        out[:n] = values
+        found[:n] = flags
+
+    def r0MaxBatch(self, y, n, kap, sig, thv, k, p, gA, out):
+        for i in xrange(n):
+            out[i] = self.r0Max(y[i], kap, sig, thv, k, p, gA)
+
+    def r0IntDE(self, y, RMIN, kap, sig, thv, k, p, gA):
+        return self.r0IntDETol(y, RMIN, kap, sig, thv, k, p, gA, 1.0e-5, 0.0, 1.0e-9, self.phi_xacc)[0]
+
+    def r0IntDETol(self, y, RMIN, kap, sig, thv, k, p, gA, atol, rtol, phiEps, xacc):
+        R0MAX = self.r0Max(y, kap, sig, thv, k, p, gA)
+        if R0MAX < 0.0:
+            return 0.0, 0.0
+        return _r0_int_de_nb(y, RMIN, R0MAX, kap, sig, thv, k, p, gA, atol, rtol, phiEps, xacc)
+
+@_timed('r0_time')
+def _r0_int_de_nb(y, a, b, kap, sig, thv, k, p, gA, atol, rtol, phiEps, xacc):
+    # _r0_int_de of fluxG on the compiled DE rule.
+    counts = np.zeros(4, dtype=np.int64)
+    tangent, trapezoid = _flags()
+    value, neval, err = r0_int_de(y, a, b, kap, sig, thv, k, p, gA, atol, rtol, phiEps, xacc,
+                                  tangent, trapezoid, _DE_X, _DE_W, _DE_OFFSETS, counts)
+    _commit(counts)
+    _count_r0_integral(neval, err)
+    return value, err
@@ -0,0 +1,144 @@
+import numpy as np
+from numpy.polynomial import chebyshev as C
+
+from grba_int import _as_doubles
+
+def cheb_points(n):
+    # The n + 1 Chebyshev extrema on [-1, 1], from 1 down to -1; those of n
+    # are the even ones of 2 n.
+    return np.cos(np.pi*np.arange(n + 1) / n)
+
+def cheb_coefficients(values):
+    # Chebyshev coefficients of the interpolant through values at
+    # cheb_points(len(values) - 1), by a DCT-I done with an FFT.
+    n = len(values) - 1
+    v = np.concatenate((values, values[n - 1:0:-1]))
+    c = np.real(np.fft.fft(v))[:n + 1] / n
+    c[0] *= 0.5
+    c[n] *= 0.5
+    return c
+
+class ChebSurrogate(object):
+    # Piecewise Chebyshev interpolant of a function on [breaks[0],
+    # breaks[-1]]: piece i covers [breaks[i], breaks[i + 1]] with the
+    # coefficients in row i of coeffs (zero padded). build() picks the
+    # pieces and their degrees so the discarded tail of every piece is below
+    # tol relative to that piece's largest value, evaluating the function in
+    # array calls at nested Chebyshev points. Values and integrals come from
+    # the polynomials alone.
+    def __init__(self, breaks, coeffs, tol=np.nan, nevals=0):
+        self.breaks = _as_doubles(breaks)
+        self.coeffs = np.atleast_2d(_as_doubles(coeffs))
+        self.tol = float(tol)
+        self.nevals = int(nevals)
+        if self.coeffs.shape[0] != len(self.breaks) - 1:
+            raise ValueError("{} pieces need {} breaks, got {}".format(self.coeffs.shape[0],
+                                                                     self.coeffs.shape[0] + 1, len(self.breaks)))
+
+    @classmethod
+    def build(cls, fun, a, b, tol=1.0e-8, nmin=16, nmax=128, maxpieces=512):
+        # fun takes an array of points. A piece whose degree-nmax
+        # interpolant is still not resolved is split, at the geometric mean
+        # where it spans more than a factor of 4 (fluxG is steep near small
+        # r0), at the middle otherwise.
+        pieces = []
+        nevals = 0
+        todo = [(float(a), float(b))]
+        while todo:
+            lo, hi = todo.pop()
+            n = nmin
+            x = 0.5*(lo + hi) + 0.5*(hi - lo)*cheb_points(n)
+            f = _as_doubles(fun(x))
+            nevals += len(x)
+            while True:
+                c = cheb_coefficients(f)
+                scale = np.max(np.abs(f))
+                if not np.all(np.isfinite(c)):
+                    raise ValueError("non-finite integrand value on [{}, {}]".format(lo, hi))
+                if np.max(np.abs(c[-3:])) <= tol*scale:
+                    break
+                if n >= nmax:
+                    c = None
+                    break
+                # Doubling n keeps every old point; only the odd ones are new.
+                x = 0.5*(lo + hi) + 0.5*(hi - lo)*cheb_points(2*n)[1::2]
+                fnew = _as_doubles(fun(x))
+                nevals += len(x)
+                merged = np.empty(2*n + 1)
+                merged[0::2], merged[1::2] = f, fnew
+                f, n = merged, 2*n
+            if c is None:
+                if len(pieces) + len(todo) + 2 > maxpieces:
+                    raise RuntimeError("no surrogate within {} pieces to tol = {}".format(maxpieces, tol))
+                mid = np.sqrt(lo*hi) if lo > 0.0 and hi > 4.0*lo else 0.5*(lo + hi)
+                todo.extend(((mid, hi), (lo, mid)))
+                continue
+            # Trailing coefficients below the tolerance are dropped.
+            keep = np.nonzero(np.abs(c) > tol*scale)[0]
+            pieces.append((lo, hi, c[:keep[-1] + 1] if len(keep) else c[:1]))
+        pieces.sort()
+        breaks = [p[0] for p in pieces] + [pieces[-1][1]]
+        coeffs = np.zeros((len(pieces), max(len(p[2]) for p in pieces)))
+        for i, (_, _, c) in enumerate(pieces):
+            coeffs[i, :len(c)] = c
+        return cls(breaks, coeffs, tol, nevals)
+
+    @property
+    def domain(self):
+        return self.breaks[0], self.breaks[-1]
+
+    @property
+    def degrees(self):
+        return np.array([np.max(np.nonzero(c)[0]) if np.any(c) else 0 for c in self.coeffs])
+
+    def _locate(self, x):
+        if np.any(x < self.breaks[0]) or np.any(x > self.breaks[-1]):
+            raise ValueError("points outside [{}, {}]".format(self.breaks[0], self.breaks[-1]))
+        return np.clip(np.searchsorted(self.breaks, x, side='right') - 1, 0, len(self.coeffs) - 1)
+
+    def _local(self, x, i):
+        lo, hi = self.breaks[i], self.breaks[i + 1]
+        return (2.0*x - lo - hi) / (hi - lo)
+
+    def __call__(self, x):
+        scalar = np.isscalar(x)
+        x = np.atleast_1d(_as_doubles(x))
+        piece = self._locate(x)
+        out = np.empty(x.shape)
+        for i in np.unique(piece):
+            sel = piece == i
+            out[sel] = C.chebval(self._local(x[sel], i), self.coeffs[i])
+        if scalar:
+            return out[0]
+        return out
+
+    def _piece_integral(self, i, lo=None, hi=None):
+        # Integral over [lo, hi] within piece i, its whole width by default.
+        half = 0.5*(self.breaks[i + 1] - self.breaks[i])
+        anti = C.chebint(self.coeffs[i])
+        t0 = -1.0 if lo is None else self._local(lo, i)
+        t1 = 1.0 if hi is None else self._local(hi, i)
+        return half*(C.chebval(t1, anti) - C.chebval(t0, anti))
+
+    def integral(self, lo=None, hi=None):
+        # Exact integral of the surrogate over [lo, hi], its whole domain by
+        # default.
+        lo = self.breaks[0] if lo is None else float(lo)
+        hi = self.breaks[-1] if hi is None else float(hi)
+        if hi < lo:
+            return -self.integral(hi, lo)
+        i, j = self._locate(np.array([lo, hi]))
+        if i == j:
+            return self._piece_integral(i, lo, hi)
+        total = self._piece_integral(i, lo=lo) + self._piece_integral(j, hi=hi)
+        for m in xrange(i + 1, j):
+            total += self._piece_integral(m)
+        return total
+
+    def save(self, path):
+        np.savez(path, breaks=self.breaks, coeffs=self.coeffs, tol=self.tol, nevals=self.nevals)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['breaks'], data['coeffs'], data['tol'], data['nevals'])
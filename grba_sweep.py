@@ -0,0 +1,307 @@
+import os
+import time
+import multiprocessing
+import numpy as np
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from grba_int import GrbaIntegrator, load_backend
+from grba_cache import ResultCache
+
+# One record per grid point. thv is in degrees, as the sweep drivers write
+# it; time is the wall time spent on that point in its worker.
+SWEEP_DTYPE = np.dtype([('y', 'f8'), ('kap', 'f8'), ('thv', 'f8'),
+                        ('value', 'f8'), ('time', 'f8')])
+
+QUANTITIES = ('r0_int', 'r0_max', 'r0_int_ct')
+
+class GridSpec(object):
+    # A (y, kap, thv) grid plus everything else a point needs. Points are
+    # ordered y-major, then kap, then thv, like the nested driver loops.
+    # cache is a grba_cache.ResultCache, or its path, shared by the workers
+    # so that a repeated sweep only computes the points it has not seen.
+    # quantity is one of QUANTITIES, one SWEEP_DTYPE record per point, or a
+    # module-level function quantity(grb, y, kap, thv) returning any number
+    # of records of dtype for the point, grb being the point's integrator
+    # and thv in degrees.
+    def __init__(self, ys, kaps, thvs, sig=2.0, gA=1.0, k=0.0, p=2.2, rmin=1.0e-5,
+                 quantity='r0_int', backend=None, cache=None, dtype=None):
+        if callable(quantity):
+            if dtype is None:
+                raise ValueError("a quantity function needs the dtype of its records")
+        elif quantity not in QUANTITIES:
+            raise ValueError("unknown quantity {!r}, expected one of {}".format(quantity, QUANTITIES))
+        self.ys = np.atleast_1d(np.asarray(ys, dtype=float))
+        self.kaps = np.atleast_1d(np.asarray(kaps, dtype=float))
+        self.thvs = np.atleast_1d(np.asarray(thvs, dtype=float))
+        self.sig = sig
+        self.gA = gA
+        self.k = k
+        self.p = p
+        self.rmin = rmin
+        self.quantity = quantity
+        self.backend = backend
+        self.cache = cache
+        self.dtype = SWEEP_DTYPE if dtype is None else np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return (len(self.ys), len(self.kaps), len(self.thvs))
+
+    def __len__(self):
+        return len(self.ys)*len(self.kaps)*len(self.thvs)
+
+    def points(self):
+        for y in self.ys:
+            for kap in self.kaps:
+                for thv in self.thvs:
+                    yield y, kap, thv
+
+    def params(self):
+        # Picklable form handed to the workers.
+        return (self.sig, self.gA, self.k, self.p, self.rmin, self.quantity, self.backend, self.cache)
+
+def point_cost(y, kap, thv):
+    # Rough relative cost of one point: thv = 0 is nearly free, and the phi
+    # integrals get dearer with thv and with kap.
+    return 1.0 + thv*(1.0 + kap)
+
+# Per-process state: each backend and cache is opened once per worker, by
+# the name and path the specs give, and integrators are reused across the
+# points of every chunk that worker receives.
+_BACKENDS = {}
+_CACHES = {}
+_INTEGRATORS = {}
+
+def _integrator(kap, thv, sig, gA, k, p, backend, cache=None):
+    if backend not in _BACKENDS:
+        _BACKENDS[backend] = load_backend(backend)
+    lib = _BACKENDS[backend]
+    if cache is not None:
+        path = cache.path if isinstance(cache, ResultCache) else cache
+        if path not in _CACHES:
+            _CACHES[path] = ResultCache(path)
+        cache = _CACHES[path]
+    key = (kap, thv, sig, gA, k, p, lib.name, cache)
+    grb = _INTEGRATORS.get(key)
+    if grb is None:
+        grb = GrbaIntegrator(kap, np.radians(thv), sig, gA, k, p, backend=lib, cache=cache)
+        _INTEGRATORS[key] = grb
+    return grb
+
+def evaluate_point(y, kap, thv, params):
+    sig, gA, k, p, rmin, quantity, backend, cache = params
+    grb = _integrator(kap, thv, sig, gA, k, p, backend, cache)
+    if callable(quantity):
+        return quantity(grb, y, kap, thv)
+    if quantity == 'r0_max':
+        return grb.r0_max(y)
+    if quantity == 'r0_int':
+        return grb.r0_int(y, rmin)
+    R0MAX = grb.r0_max(y)
+    if R0MAX <= rmin:
+        return 0.0
+    return grb.r0_int_ct(y, rmin, R0MAX)
+
+def _run_chunk(chunk, params):
+    # The grid indices of chunk and their records: one SWEEP_DTYPE record
+    # per point, or those of a quantity function with the index of their
+    # point repeated.
+    if callable(params[5]):
+        parts = [np.atleast_1d(evaluate_point(y, kap, thv, params)) for _, y, kap, thv in chunk]
+        index = np.repeat([j for j, _, _, _ in chunk], [len(part) for part in parts])
+        return index, np.concatenate(parts)
+    index = np.empty(len(chunk), dtype=int)
+    out = np.zeros(len(chunk), dtype=SWEEP_DTYPE)
+    for i, (j, y, kap, thv) in enumerate(chunk):
+        start = time.time()
+        value = evaluate_point(y, kap, thv, params)
+        index[i] = j
+        out[i] = (y, kap, thv, value, time.time() - start)
+    return index, out
+
+def make_chunks(points, workers, cost=point_cost, per_worker=4, max_size=None):
+    # Split (index, y, kap, thv) points into about per_worker*workers chunks
+    # of similar estimated cost, or more so that none holds over max_size
+    # points: points are dealt, dearest first, to the currently cheapest
+    # chunk. Chunks come back dearest first so the pool starts on the slow
+    # ones.
+    nchunks = per_worker*workers
+    if max_size is not None:
+        nchunks = max(nchunks, -(-len(points) // max_size))
+    nchunks = max(1, min(len(points), nchunks))
+    costs = np.array([cost(y, kap, thv) for _, y, kap, thv in points])
+    chunks = [[] for _ in xrange(nchunks)]
+    totals = np.zeros(nchunks)
+    # The totals of full chunks are hidden from the choice as infinite.
+    open_totals = totals.copy()
+    for i in np.argsort(-costs, kind='mergesort'):
+        j = np.argmin(open_totals)
+        chunks[j].append(points[i])
+        totals[j] += costs[i]
+        open_totals[j] = np.inf if max_size is not None and len(chunks[j]) >= max_size else totals[j]
+    order = np.argsort(-totals, kind='mergesort')
+    return [chunks[j] for j in order if chunks[j]]
+
+def _pending(spec, skip, size):
+    # The (index, y, kap, thv) points of spec not in skip, in lists of at
+    # most size, read off the grid lazily.
+    part = []
+    for i, (y, kap, thv) in enumerate(spec.points()):
+        if skip is None or (y, kap, thv) not in skip:
+            part.append((i, y, kap, thv))
+            if len(part) == size:
+                yield part
+                part = []
+    if part:
+        yield part
+
+def iter_sweep(spec, max_workers=None, cost=point_cost, chunk=256, skip=None, per_worker=4):
+    # Evaluate spec.quantity on the grid and yield (index, records) as each
+    # chunk of at most chunk points is done: the grid indices and their
+    # SWEEP_DTYPE records, in completion order. Points whose (y, kap, thv)
+    # is in skip are left out. max_workers=1 runs in this process, in grid
+    # order. Memory stays bounded whatever the grid size: the grid is read
+    # per_worker*max_workers chunks at a time and balanced with make_chunks
+    # within that block, at most 2*max_workers chunks are in flight, and a
+    # chunk's results are let go once yielded.
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    params = spec.params()
+    if max_workers == 1:
+        for part in _pending(spec, skip, chunk):
+            yield _run_chunk(part, params)
+        return
+    parts = (part for block in _pending(spec, skip, per_worker*max_workers*chunk)
+             for part in make_chunks(block, max_workers, cost, per_worker, max_size=chunk))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        running = set(pool.submit(_run_chunk, part, params) for part in islice(parts, 2*max_workers))
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for part in islice(parts, len(done)):
+                running.add(pool.submit(_run_chunk, part, params))
+            while done:
+                yield done.pop().result()
+
+def sweep(spec, max_workers=None, cost=point_cost):
+    # Evaluate spec.quantity on every grid point and return its records in
+    # grid order. max_workers=1 runs in this process.
+    if callable(spec.quantity):
+        parts = list(iter_sweep(spec, max_workers, cost))
+        if not parts:
+            return np.zeros(0, dtype=spec.dtype)
+        index = np.concatenate([part[0] for part in parts])
+        return np.concatenate([part[1] for part in parts])[np.argsort(index, kind='mergesort')]
+    result = np.zeros(len(spec), dtype=SWEEP_DTYPE)
+    for index, records in iter_sweep(spec, max_workers, cost):
+        result[index] = records
+    return result
+
+class SweepWriter(object):
+    # Appends SWEEP_DTYPE records to a .npy file in chunks of at most chunk
+    # records, so memory stays bounded. The header has room for any length
+    # and is rewritten on every flush, so the file is a valid array of all
+    # records flushed so far even if the sweep dies; load_sweep reads it
+    # memory-mapped. mode 'a' carries on with an existing file.
+    HEADER_SIZE = 256
+
+    def __init__(self, path, chunk=1024, mode='w', dtype=SWEEP_DTYPE):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        if mode == 'a' and os.path.exists(path):
+            done = load_sweep(path)
+            if done.dtype != self.dtype:
+                raise ValueError("{} holds {} records, not {}".format(path, done.dtype, self.dtype))
+            self.count = len(done)
+            del done
+            self._file = open(path, 'r+b')
+            self._file.seek(self.HEADER_SIZE + self.count*self.dtype.itemsize)
+            self._file.truncate()
+        elif mode in ('w', 'a'):
+            self._file = open(path, 'wb')
+            self._write_header()
+        else:
+            raise ValueError("mode must be 'w' or 'a', not {!r}".format(mode))
+        self._buffer = np.empty(chunk, dtype=self.dtype)
+        self._used = 0
+
+    def _write_header(self):
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({:d},), }}".format(
+            np.lib.format.dtype_to_descr(self.dtype), self.count)
+        size = self.HEADER_SIZE - len(np.lib.format.MAGIC_PREFIX) - 4
+        if len(header) >= size:
+            raise ValueError("dtype {} is too wide for the .npy header".format(self.dtype))
+        self._file.seek(0)
+        self._file.write(np.lib.format.magic(1, 0) + np.array(size, '<u2').tobytes())
+        self._file.write(header.ljust(size - 1) + '\n')
+
+    def write(self, records):
+        records = np.asarray(records, dtype=self.dtype)
+        while len(records):
+            n = min(len(records), len(self._buffer) - self._used)
+            self._buffer[self._used:self._used + n] = records[:n]
+            self._used += n
+            records = records[n:]
+            if self._used == len(self._buffer):
+                self.flush()
+
+    def flush(self):
+        if self._used:
+            self._file.seek(self.HEADER_SIZE + self.count*self.dtype.itemsize)
+            self._file.write(self._buffer[:self._used].tobytes())
+            self.count += self._used
+            self._used = 0
+        self._write_header()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def sweep_to_file(spec, path, max_workers=None, cost=point_cost, chunk=256, resume=False):
+    # iter_sweep streamed into a SweepWriter at path, records in completion
+    # order. resume keeps the records already in path and only evaluates
+    # the points missing from it, which needs y, kap and thv fields in the
+    # records. Returns the number of records in the file.
+    skip = None
+    if resume and os.path.exists(path):
+        done = load_sweep(path)
+        skip = set(zip(done['y'].tolist(), done['kap'].tolist(), done['thv'].tolist()))
+        del done
+    with SweepWriter(path, chunk, mode='a' if resume else 'w', dtype=spec.dtype) as writer:
+        for index, records in iter_sweep(spec, max_workers, cost, chunk, skip):
+            writer.write(records)
+            writer.flush()
+    return writer.count
+
+def load_sweep(path, mmap_mode='r'):
+    # The records of a sweep file, memory-mapped so that only what is used
+    # gets read.
+    return np.load(path, mmap_mode=mmap_mode)
+
+def iter_records(path, chunk=65536):
+    # The records of a sweep file in chunks of at most chunk, each read into
+    # memory only when reached.
+    records = load_sweep(path)
+    for start in xrange(0, len(records), chunk):
+        yield np.array(records[start:start + chunk])
+
+def to_dataframe(result):
+    import pandas as pd
+    return pd.DataFrame.from_records(result)
+
+if __name__ == '__main__':
+    SPEC = GridSpec([0.001, 0.1, 0.5, 0.9, 0.999], [0.0, 1.0, 10.0], [0.0, 1.0, 3.0])
+    start = time.time()
+    res = sweep(SPEC)
+    print to_dataframe(res)
+    print "total {:.3f}s".format(time.time() - start)
@@ -0,0 +1,158 @@
+import os
+import numpy as np
+
+from grba_int import load_backend, phi_int_kap0, _as_doubles
+
+def _phi_kap0(logr0, thv):
+    return phi_int_kap0(np.power(10.0, logr0), thv)
+
+class PhiTable(object):
+    # phiInt(r0, kap, thv) sampled for one sigma on a grid that is uniform in
+    # log10(r0). What gets interpolated is the log of phiInt divided by its
+    # kap = 0 closed form 2 pi (1 + tan(thv) / r0)**2, which removes the
+    # steep r0 and thv dependence: cubic Lagrange along log10(r0), linear in
+    # kap and thv. max_error is the largest relative deviation from phiInt
+    # found by validate(), i.e. the bound the table is served with.
+    def __init__(self, logr0, kaps, thvs, sig, values, max_error=np.nan):
+        self.logr0 = _as_doubles(logr0)
+        self.kaps = _as_doubles(kaps)
+        self.thvs = _as_doubles(thvs)
+        self.sig = float(sig)
+        self.values = values
+        self.max_error = float(max_error)
+        if len(self.logr0) < 4:
+            raise ValueError("PhiTable needs at least 4 r0 samples")
+        if values.shape != (len(self.logr0), len(self.kaps), len(self.thvs)):
+            raise ValueError("values shape {} does not match the grid".format(values.shape))
+
+    @classmethod
+    def build(cls, r0min, r0max, kaps, thvs, sig=2.0, num=256, backend=None, validate=True):
+        lib = load_backend(backend)
+        logr0 = np.linspace(np.log10(r0min), np.log10(r0max), num)
+        r0s = np.power(10.0, logr0)
+        kaps = np.atleast_1d(_as_doubles(kaps))
+        thvs = np.atleast_1d(_as_doubles(thvs))
+        values = np.empty((num, len(kaps), len(thvs)))
+        out = np.empty(num)
+        for j, kap in enumerate(kaps):
+            for k, thv in enumerate(thvs):
+                lib.phiIntBatch(r0s, num, kap, thv, sig, out)
+                if not np.all(np.isfinite(out)):
+                    raise ValueError("phiInt failed for kap = {}, thv = {}".format(kap, thv))
+                values[:, j, k] = out
+
+        table = cls(logr0, kaps, thvs, sig, values)
+        if validate:
+            table.max_error = table.validate(lib)
+        return table
+
+    @classmethod
+    def refine(cls, r0min, r0max, kap, thv, sig=2.0, tol=1.0e-8, backend=None, num=17, maxnum=1 << 14):
+        # Single (kap, thv) table whose log10(r0) spacing is halved until the
+        # interpolant matches phiInt at the new midpoints to tol. Earlier
+        # samples are kept, so each phi integral is computed once. Raises if
+        # maxnum samples do not get there.
+        lib = load_backend(backend)
+        logr0 = np.linspace(np.log10(r0min), np.log10(r0max), num)
+        values = np.empty(num)
+        lib.phiIntBatch(np.power(10.0, logr0), num, kap, thv, sig, values)
+        if not np.all(np.isfinite(values)):
+            raise ValueError("phiInt failed for kap = {}, thv = {}".format(kap, thv))
+        while True:
+            table = cls(logr0, [kap], [thv], sig, values[:, np.newaxis, np.newaxis])
+            mid = 0.5*(logr0[:-1] + logr0[1:])
+            r0s = np.power(10.0, mid)
+            vmid = np.empty(len(mid))
+            lib.phiIntBatch(r0s, len(mid), kap, thv, sig, vmid)
+            if not np.all(np.isfinite(vmid)):
+                raise ValueError("phiInt failed for kap = {}, thv = {}".format(kap, thv))
+            err = np.max(np.abs(table(r0s, kap, thv) - vmid) / vmid)
+            merged = np.empty(2*len(logr0) - 1)
+            merged[0::2], merged[1::2] = logr0, mid
+            logr0 = merged
+            merged = np.empty(len(logr0))
+            merged[0::2], merged[1::2] = values, vmid
+            values = merged
+            if err < tol:
+                # err belongs to the coarser grid, so it bounds the finer one.
+                return cls(logr0, [kap], [thv], sig, values[:, np.newaxis, np.newaxis], err)
+            if len(logr0) >= maxnum:
+                raise RuntimeError("no phi table within {} samples to tol = {} (error {})"
+                                   .format(maxnum, tol, err))
+
+    def validate(self, lib=None):
+        # Compare against phiInt half way between grid points on every axis
+        # that has more than one point.
+        if lib is None:
+            lib = load_backend()
+        def mids(x):
+            return x if len(x) == 1 else 0.5*(x[:-1] + x[1:])
+        r0s = np.power(10.0, mids(self.logr0))
+        out = np.empty(len(r0s))
+        err = 0.0
+        for kap in mids(self.kaps):
+            for thv in mids(self.thvs):
+                lib.phiIntBatch(r0s, len(r0s), kap, thv, self.sig, out)
+                err = max(err, np.max(np.abs(self(r0s, kap, thv) - out) / out))
+        return err
+
+    def _axis_weights(self, axis, x, name):
+        if len(axis) == 1:
+            if not np.isclose(x, axis[0]):
+                raise ValueError("{} = {} is not in this table ({})".format(name, x, axis[0]))
+            return [(0, 1.0)]
+        if x < axis[0] or x > axis[-1]:
+            raise ValueError("{} = {} is outside [{}, {}]".format(name, x, axis[0], axis[-1]))
+        j = min(max(np.searchsorted(axis, x) - 1, 0), len(axis) - 2)
+        t = (x - axis[j]) / (axis[j + 1] - axis[j])
+        return [(j, 1.0 - t), (j + 1, t)]
+
+    def check(self, kap, thv):
+        self._axis_weights(self.kaps, kap, 'kap')
+        self._axis_weights(self.thvs, thv, 'thv')
+
+    def __call__(self, r0, kap, thv):
+        scalar = np.isscalar(r0)
+        u = np.log10(np.atleast_1d(_as_doubles(r0)))
+        u0 = self.logr0[0]
+        du = self.logr0[1] - u0
+        n = len(self.logr0)
+        if np.any(u < u0 - 1.0e-12) or np.any(u > self.logr0[-1] + 1.0e-12):
+            raise ValueError("r0 outside [{}, {}]".format(10.0**u0, 10.0**self.logr0[-1]))
+
+        # Four-point Lagrange stencil around each r0.
+        i0 = np.clip(np.floor((u - u0) / du).astype(int) - 1, 0, n - 4)
+        t = (u - u0) / du - i0
+        w = [-(t - 1.0)*(t - 2.0)*(t - 3.0) / 6.0,
+             t*(t - 2.0)*(t - 3.0) / 2.0,
+             -t*(t - 1.0)*(t - 3.0) / 2.0,
+             t*(t - 1.0)*(t - 2.0) / 6.0]
+
+        logPhi = np.zeros(u.shape)
+        for j, wk in self._axis_weights(self.kaps, kap, 'kap'):
+            for k, wt in self._axis_weights(self.thvs, thv, 'thv'):
+                if wk*wt == 0.0:
+                    continue
+                for m in xrange(4):
+                    logQ = np.log(self.values[i0 + m, j, k] / _phi_kap0(self.logr0[i0 + m], self.thvs[k]))
+                    logPhi += wk*wt*w[m]*logQ
+        phi = np.exp(logPhi)*_phi_kap0(u, thv)
+        if scalar:
+            return phi[0]
+        return phi
+
+    def save(self, path):
+        # The values go to <path>.npy so they can be memory-mapped on load;
+        # the axes and metadata go to <path>.npz.
+        stem = os.path.splitext(path)[0]
+        np.save(stem + '.npy', np.asarray(self.values))
+        np.savez(stem + '.npz', logr0=self.logr0, kaps=self.kaps, thvs=self.thvs,
+                 sig=self.sig, max_error=self.max_error)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        stem = os.path.splitext(path)[0]
+        meta = np.load(stem + '.npz')
+        values = np.load(stem + '.npy', mmap_mode=mmap_mode)
+        return cls(meta['logr0'], meta['kaps'], meta['thvs'], meta['sig'], values,
+                   meta['max_error'])
@@ -0,0 +1,157 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from grba_int import GrbaIntegrator, R0_MAX_CACHE, flux_g, load_backend, read_stats, reset_stats
+from grba_cache import ResultCache, make_key
+from grba_sweep import GridSpec, load_sweep, sweep, sweep_to_file
+from grba_table import PhiTable
+
+KAP = 1.0
+THV = np.radians(3.0)
+SIG = 2.0
+
+def _backend(name):
+    # The backend of name, or a skip where it is not available here.
+    try:
+        return load_backend(name)
+    except (OSError, ImportError) as e:
+        pytest.skip("{} backend unavailable: {}".format(name, e))
+
+def test_phi_table_refine_meets_tol():
+    lib = _backend('native')
+    table = PhiTable.refine(1.0e-5, 0.5, KAP, THV, SIG, tol=1.0e-8, backend=lib)
+    assert table.max_error < 1.0e-8
+    # Half way between the final samples the interpolant is within tol.
+    mid = 0.5*(table.logr0[:-1] + table.logr0[1:])
+    r0s = np.power(10.0, mid)
+    want = np.empty(len(r0s))
+    lib.phiIntBatch(r0s, len(r0s), KAP, THV, SIG, want)
+    assert np.max(np.abs(table(r0s, KAP, THV) - want) / want) < 1.0e-8
+
+def test_phi_table_save_load(tmpdir):
+    table = PhiTable.build(1.0e-5, 0.5, [0.0, 1.0], [0.0, THV], SIG, num=64, backend=_backend('native'))
+    path = str(tmpdir.join('phi.npy'))
+    table.save(path)
+    loaded = PhiTable.load(path)
+    assert np.array_equal(np.asarray(loaded.values), np.asarray(table.values))
+    assert np.array_equal(loaded.logr0, table.logr0)
+    assert loaded.max_error == table.max_error
+    assert loaded.sig == table.sig
+
+def test_phi_table_refine_maxnum():
+    with pytest.raises(RuntimeError):
+        PhiTable.refine(1.0e-5, 0.5, KAP, THV, SIG, tol=1.0e-16, backend=_backend('native'), maxnum=64)
+
+@pytest.mark.parametrize('backend', ['native', 'numpy', 'numba'])
+def test_backend_parity(backend):
+    # Every engine against the NumPy one, which is always there. The r0_max
+    # memo is cleared so each engine solves for itself.
+    values = []
+    for lib in (_backend('numpy'), _backend(backend)):
+        R0_MAX_CACHE.clear()
+        grb = GrbaIntegrator(KAP, THV, SIG, 1.0, 0.0, 2.2, backend=lib)
+        R0MAX = grb.r0_max(0.5)
+        values.append((grb.phi_int(0.5*R0MAX), R0MAX, grb.r0_int(0.5, 1.0e-5)))
+    want, got = values
+    assert want[2] == pytest.approx(0.0015866, rel=1.0e-4)
+    assert got == pytest.approx(want, rel=1.0e-8)
+
+def test_r0_max_memo_per_backend():
+    # A NumPy integrator does not take the native r0_max from the memo.
+    R0_MAX_CACHE.clear()
+    GrbaIntegrator(KAP, THV, SIG, 1.0, 0.0, 2.2, backend=_backend('native')).r0_max(0.5)
+    grb = GrbaIntegrator(KAP, THV, SIG, 1.0, 0.0, 2.2, backend=_backend('numpy'))
+    reset_stats(grb.backend)
+    grb.r0_max(0.5)
+    assert read_stats(grb.backend)['r0_max_solves'] == 1
+
+def test_cache_fetch_counts(tmpdir):
+    cache = ResultCache(str(tmpdir.join('results.sqlite')))
+    calls = []
+    def compute():
+        calls.append(1)
+        return 2.5
+    key = make_key('phi_int', {'r0': 0.1, 'kap': KAP})
+    assert cache.fetch(key, compute) == 2.5
+    assert cache.fetch(key, compute) == 2.5
+    assert len(calls) == 1
+    assert (cache.stats['hits'], cache.stats['misses'], cache.stats['puts']) == (1, 1, 1)
+
+def test_cache_nan(tmpdir):
+    # NaN is a stored result, not a miss.
+    cache = ResultCache(str(tmpdir.join('results.sqlite')))
+    cache.put('nan', float('nan'))
+    assert np.isnan(cache.get('nan'))
+    assert cache.stats['hits'] == 1
+
+def test_cache_evict(tmpdir):
+    cache = ResultCache(str(tmpdir.join('results.sqlite')), maxsize=10)
+    for i in xrange(ResultCache.EVICT_EVERY):
+        cache.put(str(i), float(i))
+    assert len(cache) == 10
+    assert cache.stats['evictions'] == ResultCache.EVICT_EVERY - 10
+    # The most recently used entries are the ones kept.
+    assert cache.get(str(ResultCache.EVICT_EVERY - 1)) == ResultCache.EVICT_EVERY - 1
+    assert cache.get('0') is None
+
+def _cache_worker(args):
+    # Reads and writes a shared range of keys, each get updating used.
+    path, seed = args
+    cache = ResultCache(path, timeout=60.0)
+    for i in xrange(2000):
+        key = str((i*7 + seed) % 50)
+        cache.fetch(key, lambda: float(key))
+    return cache.stats
+
+def test_cache_two_processes(tmpdir):
+    path = str(tmpdir.join('results.sqlite'))
+    ResultCache(path).put('0', 0.0)
+    pool = multiprocessing.Pool(2)
+    try:
+        stats = pool.map(_cache_worker, [(path, 0), (path, 3)])
+    finally:
+        pool.close()
+        pool.join()
+    assert [s['errors'] for s in stats] == [0, 0]
+    assert sum(s['hits'] + s['misses'] for s in stats) == 4000
+    cache = ResultCache(path)
+    assert len(cache) == 50
+    assert all(cache.get(str(i)) == float(i) for i in xrange(50))
+
+def test_sweep_resume_after_crash(tmpdir):
+    # A sweep that died after writing part of the grid, leaving bytes past
+    # the count in its header, is finished by resume with every point once.
+    path = str(tmpdir.join('sweep.npy'))
+    grid = ([0.1, 0.5, 0.9], [0.0, 1.0], [0.0, 3.0])
+    spec = GridSpec(*grid, quantity='r0_max', backend='numpy')
+    sweep_to_file(GridSpec(grid[0][:2], grid[1], grid[2], quantity='r0_max', backend='numpy'), path,
+                  max_workers=1)
+    with open(path, 'ab') as f:
+        f.write(b'\x7f'*37)
+    assert sweep_to_file(spec, path, max_workers=1, resume=True) == len(spec)
+    done = load_sweep(path)
+    assert sorted(zip(done['y'], done['kap'], done['thv'])) == sorted(spec.points())
+    want = sweep(spec, max_workers=1)
+    order = np.lexsort((done['thv'], done['kap'], done['y']))
+    assert np.array_equal(done['value'][order], want['value'])
+
+def test_r0_int_log_budget():
+    # The log variable runs its phi integrals at the budget it reports, and
+    # stays within rtol of the linear rule.
+    grb = GrbaIntegrator(KAP, THV, SIG, 1.0, 0.0, 2.2, backend=_backend('numpy'))
+    value, budget = grb.r0_int(0.5, 1.0e-5, rtol=1.0e-4, variable='log', full_output=True)
+    fun = lambda r0: flux_g(0.5, r0, KAP, SIG, THV, 1.0, 0.0, 2.2, budget['phi_eps'], budget['root_xacc'])
+    u = np.log(0.25*grb.r0_max(0.5))
+    assert grb._log_integrand(0.5, u, budget['phi_eps'], budget['root_xacc']) == np.exp(u)*fun(np.exp(u))
+    assert value == pytest.approx(grb.r0_int(0.5, 1.0e-5, rtol=1.0e-4), rel=1.0e-4)
+
+def test_r0_int_multi_matches_r0_int():
+    # A loose rtol, at which the phi budget moves the value well past rounding.
+    lib = _backend('numpy')
+    grb = GrbaIntegrator(KAP, THV, SIG, 1.0, 0.0, 2.2, backend=lib)
+    got = grb.r0_int_multi(0.5, 1.0e-5, [2.2, 2.5], rtol=1.0e-2)
+    want = [GrbaIntegrator(KAP, THV, SIG, 1.0, 0.0, p, backend=lib).r0_int(0.5, 1.0e-5, rtol=1.0e-2)
+            for p in (2.2, 2.5)]
+    assert got == pytest.approx(want, rel=1.0e-12)